@@ -0,0 +1,16 @@
+-- Оповещение воркеров об изменении каталога (инвалидация кэша каталога в памяти)
+CREATE OR REPLACE FUNCTION myaso.notify_catalog_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Один NOTIFY на оператор, а не на каждую строку импорта прайс-листа
+    PERFORM pg_notify('myaso_catalog_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер на любые изменения каталога
+DROP TRIGGER IF EXISTS trigger_notify_catalog_change ON myaso.products;
+CREATE TRIGGER trigger_notify_catalog_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON myaso.products
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION myaso.notify_catalog_change();
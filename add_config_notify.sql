@@ -0,0 +1,21 @@
+-- Оповещение воркеров об изменении конфигурации (инвалидация снимка prompts/system в памяти)
+CREATE OR REPLACE FUNCTION myaso.notify_config_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Один NOTIFY на оператор; payload - имя изменённой таблицы
+    PERFORM pg_notify('myaso_config_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_notify_prompts_change ON myaso.prompts;
+CREATE TRIGGER trigger_notify_prompts_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON myaso.prompts
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION myaso.notify_config_change();
+
+DROP TRIGGER IF EXISTS trigger_notify_system_change ON myaso.system;
+CREATE TRIGGER trigger_notify_system_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON myaso.system
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION myaso.notify_config_change();
@@ -0,0 +1,13 @@
+-- Последовательная обработка диалога: не больше одной выполняющейся задачи
+-- на client_phone во всех воркерах. Подряд пришедшие сообщения клиента
+-- склеиваются в одну задачу (остальные получают статус 'merged').
+ALTER TABLE myaso.jobs
+    ADD COLUMN IF NOT EXISTS conversation_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_one_running_per_conversation_idx
+    ON myaso.jobs (conversation_key)
+    WHERE status = 'running' AND conversation_key IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS jobs_conversation_queued_idx
+    ON myaso.jobs (conversation_key, id)
+    WHERE status = 'queued';
@@ -0,0 +1,4 @@
+-- Хэш текстового описания товара, по которому был построен embedding.
+-- Задание переэмбеддинга каталога пропускает строки, у которых хэш не изменился.
+ALTER TABLE myaso.products
+    ADD COLUMN IF NOT EXISTS embedding_hash TEXT;
@@ -0,0 +1,46 @@
+-- Оповещение воркеров об изменении истории диалога (инвалидация кэша истории в памяти).
+-- Один NOTIFY на диалог и ход в операторе; свой ход воркер узнаёт по turn_id.
+
+-- 1. Вставка строк истории
+CREATE OR REPLACE FUNCTION myaso.notify_history_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'myaso_history_changed',
+        json_build_object('op', 'INSERT', 'client_phone', client_phone, 'turn_id', turn_id)::text
+    )
+    FROM (SELECT DISTINCT client_phone, turn_id FROM new_rows) AS changed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_notify_history_insert
+    AFTER INSERT ON myaso.conversation_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION myaso.notify_history_insert();
+
+-- 2. Удаление и изменение истории (сброс диалога, ручные правки)
+CREATE OR REPLACE FUNCTION myaso.notify_history_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'myaso_history_changed',
+        json_build_object('op', TG_OP, 'client_phone', client_phone)::text
+    )
+    FROM (SELECT DISTINCT client_phone FROM old_rows) AS changed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_notify_history_delete
+    AFTER DELETE ON myaso.conversation_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION myaso.notify_history_delete();
+
+CREATE TRIGGER trigger_notify_history_update
+    AFTER UPDATE ON myaso.conversation_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION myaso.notify_history_delete();
@@ -0,0 +1,9 @@
+-- Сводка ходов диалога, вышедших за окно истории (см. HistorySummarizer).
+-- summarized_until - created_at последней свёрнутой строки conversation_history.
+CREATE TABLE IF NOT EXISTS myaso.conversation_summaries (
+    client_phone TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    summarized_until TIMESTAMPTZ NOT NULL,
+    rows_folded INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,87 @@
+-- Структурное хранение вызовов инструментов в истории диалога вместо строк
+-- "Tool call: X with args: {...}" / "Tool ...". Вызов и его результат связаны
+-- общим tool_call_id.
+ALTER TABLE myaso.conversation_history
+    ADD COLUMN IF NOT EXISTS message_kind TEXT,
+    ADD COLUMN IF NOT EXISTS tool_name TEXT,
+    ADD COLUMN IF NOT EXISTS tool_call_id TEXT,
+    ADD COLUMN IF NOT EXISTS tool_args JSONB;
+
+ALTER TABLE myaso.conversation_history
+    DROP CONSTRAINT IF EXISTS conversation_history_message_kind_check;
+ALTER TABLE myaso.conversation_history
+    ADD CONSTRAINT conversation_history_message_kind_check
+    CHECK (message_kind IN ('message', 'tool_call', 'tool_result'));
+
+CREATE INDEX IF NOT EXISTS conversation_history_tool_call_idx
+    ON myaso.conversation_history (client_phone, tool_call_id)
+    WHERE tool_call_id IS NOT NULL;
+
+-- Безопасное приведение текста к jsonb для старых строк
+CREATE OR REPLACE FUNCTION myaso.try_jsonb(value TEXT)
+RETURNS JSONB AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 1. Вызовы инструментов: "Tool call: <name> with args: <model_dump tool'а>"
+WITH parsed AS (
+    SELECT
+        ctid AS row_ctid,
+        trim(substring(message FROM '^Tool call: (.*?) with args: ')) AS tool_name,
+        myaso.try_jsonb(substring(message FROM ' with args: (.*)$')) AS dump
+    FROM myaso.conversation_history
+    WHERE message_kind IS NULL
+      AND role = 'tool'
+      AND message LIKE 'Tool call: % with args: %'
+)
+UPDATE myaso.conversation_history AS h
+SET message_kind = 'tool_call',
+    tool_name = parsed.tool_name,
+    tool_call_id = COALESCE(
+        NULLIF(parsed.dump -> 'tool_call' ->> 'id', ''),
+        'call_' || md5(h.client_phone || h.created_at::text || h.message)
+    ),
+    tool_args = COALESCE(
+        CASE jsonb_typeof(parsed.dump -> 'tool_call' -> 'function' -> 'arguments')
+            WHEN 'string' THEN myaso.try_jsonb(parsed.dump -> 'tool_call' -> 'function' ->> 'arguments')
+            WHEN 'object' THEN parsed.dump -> 'tool_call' -> 'function' -> 'arguments'
+        END,
+        parsed.dump - 'tool_call',
+        '{}'::jsonb
+    ),
+    message = 'Tool call: ' || parsed.tool_name
+FROM parsed
+WHERE h.ctid = parsed.row_ctid;
+
+-- 2. Результаты инструментов: ответ идёт следующей строкой после вызова
+WITH ordered AS (
+    SELECT
+        ctid AS row_ctid,
+        role,
+        message,
+        message_kind,
+        LAG(message_kind) OVER w AS previous_kind,
+        LAG(tool_name) OVER w AS previous_tool_name,
+        LAG(tool_call_id) OVER w AS previous_tool_call_id
+    FROM myaso.conversation_history
+    WINDOW w AS (PARTITION BY client_phone ORDER BY created_at, seq NULLS FIRST)
+)
+UPDATE myaso.conversation_history AS h
+SET message_kind = 'tool_result',
+    tool_name = CASE WHEN ordered.previous_kind = 'tool_call' THEN ordered.previous_tool_name END,
+    tool_call_id = CASE WHEN ordered.previous_kind = 'tool_call' THEN ordered.previous_tool_call_id END,
+    message = CASE WHEN h.message LIKE 'Tool %' THEN substring(h.message FROM 6) ELSE h.message END
+FROM ordered
+WHERE h.ctid = ordered.row_ctid
+  AND ordered.message_kind IS NULL
+  AND ordered.role = 'tool'
+  AND (ordered.previous_kind = 'tool_call' OR ordered.message LIKE 'Tool %');
+
+-- 3. Остальные строки - обычные сообщения
+UPDATE myaso.conversation_history
+SET message_kind = 'message'
+WHERE message_kind IS NULL;
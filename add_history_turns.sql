@@ -0,0 +1,9 @@
+-- Строки одного хода диалога (сообщение клиента, вызовы и ответы инструментов,
+-- ответ ассистента) пишутся одной вставкой. У них один created_at, поэтому
+-- порядок внутри хода задаётся явным seq.
+ALTER TABLE myaso.conversation_history
+    ADD COLUMN IF NOT EXISTS turn_id UUID,
+    ADD COLUMN IF NOT EXISTS seq INTEGER;
+
+CREATE INDEX IF NOT EXISTS conversation_history_phone_order_idx
+    ON myaso.conversation_history (client_phone, created_at, seq);
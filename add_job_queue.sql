@@ -0,0 +1,32 @@
+-- Очередь фоновых задач (initConversation / processConversation / resetConversation).
+-- Воркеры забирают задачи через SELECT ... FOR UPDATE SKIP LOCKED и держат
+-- аренду (locked_until), которую продлевают, пока задача выполняется.
+-- Если воркер упал, аренда истекает и задача выдаётся повторно (at-least-once).
+CREATE TABLE IF NOT EXISTS myaso.jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    -- queued | running | done | failed
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    available_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMPTZ,
+    locked_by TEXT,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS jobs_queued_idx
+    ON myaso.jobs (available_at, id)
+    WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS jobs_running_idx
+    ON myaso.jobs (locked_until)
+    WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS jobs_finished_idx
+    ON myaso.jobs (finished_at)
+    WHERE status IN ('done', 'failed');
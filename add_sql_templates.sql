@@ -0,0 +1,9 @@
+-- Кэш SQL, сгенерированного моделью для подбора товаров (см. SqlTemplateCache).
+-- sql - запрос с параметрами $n::text, params - имена атрибутов клиента по порядку.
+CREATE TABLE IF NOT EXISTS myaso.sql_templates (
+    cache_key TEXT PRIMARY KEY,
+    sql TEXT NOT NULL,
+    params JSONB NOT NULL DEFAULT '[]'::jsonb,
+    schema_version TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,75 @@
+"""
+Локальный фейковый WhatsApp шлюз для тестов и бенчмарков.
+
+Принимает те же запросы, что и настоящий шлюз (/send-message, /sendImage),
+с настраиваемой задержкой и долей ошибок, и запоминает полученные сообщения.
+
+Запуск:
+    python -m benchmarks.fake_gateway --port 2026 --latency 0.2 --failure-rate 0.05
+и GATEWAY_BASE_URL=http://127.0.0.1:2026 для приложения.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+
+
+def create_app(latency_s: float = 0.0, failure_rate: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.messages = []
+    app.state.in_flight = 0
+    app.state.max_in_flight = 0
+
+    async def record(kind: str, request: Request):
+        payload = await request.json()
+        app.state.in_flight += 1
+        app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+        try:
+            await asyncio.sleep(latency_s)
+            if random.random() < failure_rate:
+                raise HTTPException(status_code=503, detail="fake gateway failure")
+            app.state.messages.append(
+                {"kind": kind, "received_at": time.time(), **payload}
+            )
+        finally:
+            app.state.in_flight -= 1
+        return {"success": True}
+
+    @app.post("/send-message")
+    async def send_message(request: Request):
+        return await record("message", request)
+
+    @app.post("/sendImage")
+    async def send_image(request: Request):
+        return await record("image", request)
+
+    @app.get("/messages")
+    async def messages():
+        return {
+            "messages": app.state.messages,
+            "max_in_flight": app.state.max_in_flight,
+        }
+
+    @app.delete("/messages")
+    async def reset():
+        app.state.messages.clear()
+        app.state.max_in_flight = 0
+        return {"success": True}
+
+    return app
+
+
+if __name__ == "__main__":
+    from uvicorn import run
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2026)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    run(create_app(args.latency, args.failure_rate), host=args.host, port=args.port)
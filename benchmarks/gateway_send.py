@@ -0,0 +1,47 @@
+"""
+Бенчмарк отправки сообщений через WhatsAppGateway.
+
+Шлёт N сообщений одновременно на шлюз (по умолчанию на локальный
+benchmarks.fake_gateway) и печатает статистику клиента: задержки,
+повторы и ошибки.
+
+Запуск:
+    python -m benchmarks.fake_gateway --latency 0.2 --failure-rate 0.05 &
+    python -m benchmarks.gateway_send --messages 200
+"""
+
+import argparse
+import asyncio
+import time
+
+from src.services.client_registry import registry
+from src.services.gateway_client import GatewayError, WhatsAppGateway
+
+
+async def run(base_url: str, messages: int):
+    client = WhatsAppGateway(base_url=base_url)
+
+    async def send(i: int):
+        try:
+            await client.send_message(recipient="70000000000", message=f"Сообщение #{i}")
+        except GatewayError as e:
+            print(f"#{i} failed: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*[send(i) for i in range(messages)])
+    elapsed = time.perf_counter() - started
+
+    print(f"messages:  {messages}")
+    print(f"wall time: {elapsed:.2f}s ({messages / elapsed:.1f} msg/s)")
+    print(f"stats:     {client.stats()}")
+
+    await registry.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:2026")
+    parser.add_argument("--messages", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.base_url, args.messages))
@@ -0,0 +1,91 @@
+"""
+Бенчмарк конкурентности LLMService.infer.
+
+Подменяет транспорт AsyncOpenAI на локальный фейковый OpenAI-совместимый
+эндпоинт с фиксированной задержкой и запускает N ходов диалога одновременно.
+Если вызовы не блокируют event loop, общее время близко к одной задержке,
+а не к N задержкам.
+
+Запуск:
+    python -m benchmarks.llm_concurrency --turns 16 --latency 2
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+from src.config.settings import settings
+from src.services.llm_service import llm
+
+
+class FakeCompletionServer:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        return httpx.Response(
+            200,
+            json={
+                "id": f"chatcmpl-bench-{self.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": settings.openrouter.model_id,
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Добрый день!"},
+                    }
+                ],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+            },
+        )
+
+
+async def run(turns: int, latency: float):
+    server = FakeCompletionServer(latency)
+    llm.client = AsyncOpenAI(
+        api_key="bench",
+        base_url="http://fake-llm.local/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handler)),
+    )
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *[
+            llm.infer(query=f"Сообщение клиента #{i}", history=[])
+            for i in range(turns)
+        ]
+    )
+    elapsed = time.perf_counter() - started
+
+    print(f"turns:              {turns}")
+    print(f"llm latency:        {latency:.2f}s")
+    print(f"wall time:          {elapsed:.2f}s")
+    print(f"serial lower bound: {turns * latency:.2f}s")
+    print(f"max in flight:      {server.max_in_flight}")
+
+    await llm.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.turns, args.latency))
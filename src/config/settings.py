@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import BaseModel
 import os
+from typing import Dict, List
 from dotenv import load_dotenv
 
 # Load .env file explicitly
@@ -21,6 +22,11 @@ class OpenRouterSettings(BaseSettings):
     # base_url: str = "https://openrouter.ai/api/v1"
     openrouter_api_key: str
     model_id: str
+    # Пул keep-alive соединений для AsyncOpenAI клиента
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
+    llm_keepalive_expiry: float = 30.0
+    llm_timeout: float = 120.0
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", extra="ignore"
     )
@@ -30,6 +36,14 @@ class LangFuseSettings(BaseSettings):
     langfuse_public_key: str
     langfuse_secret_key: str
     langfuse_host: str
+    # Трейсы вызовов модели копятся в очереди и отправляются фоновой задачей пачками
+    langfuse_enabled: bool = True
+    # Доля вызовов, попадающих в трейсы (1.0 - все)
+    langfuse_sample_rate: float = 1.0
+    # При переполненной очереди трейсы отбрасываются, а не тормозят диалог
+    langfuse_queue_size: int = 1000
+    langfuse_batch_size: int = 50
+    langfuse_flush_interval_s: float = 5.0
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", extra="ignore"
     )
@@ -63,11 +77,292 @@ class AlibabaSettings(BaseSettings):
         )
 
 
+class EmbeddingCacheSettings(BaseSettings):
+    embedding_cache_max_size: int = 2048
+    embedding_cache_ttl_s: float = 7 * 24 * 3600
+    # Путь к sqlite файлу дискового кэша. Пустая строка отключает дисковый кэш
+    embedding_cache_path: str = ""
+    embedding_disk_cache_max_size: int = 50000
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class CatalogEmbeddingSettings(BaseSettings):
+    # text-embedding-v4 принимает не больше 10 текстов в одном запросе
+    catalog_embedding_batch_size: int = 10
+    catalog_embedding_concurrency: int = 4
+    catalog_embedding_write_batch_size: int = 200
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class VectorIndexSettings(BaseSettings):
+    # Поиск товаров по эмбеддингу в памяти воркера вместо ORDER BY embedding <-> ...
+    vector_index_enabled: bool = False
+    # exact - точный top-k по матрице NumPy, hnsw - граф hnswlib, auto - hnsw для больших каталогов
+    vector_index_backend: str = "auto"
+    vector_index_hnsw_min_size: int = 20000
+    vector_index_hnsw_m: int = 16
+    vector_index_hnsw_ef_construction: int = 200
+    vector_index_hnsw_ef_search: int = 64
+    vector_index_refresh_interval_s: float = 300.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class CatalogCacheSettings(BaseSettings):
+    catalog_cache_enabled: bool = True
+    # Страховка на случай пропущенного NOTIFY об изменении каталога
+    catalog_cache_ttl_s: float = 300.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class ConfigCacheSettings(BaseSettings):
+    config_cache_enabled: bool = True
+    # Фоновое перечитывание prompts и system на случай пропущенного NOTIFY
+    config_cache_ttl_s: float = 300.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class GatewaySettings(BaseSettings):
+    # WhatsApp шлюз: /send-message и /sendImage
+    gateway_base_url: str = "http://51.250.42.45:2026"
+    gateway_connect_timeout_s: float = 5.0
+    gateway_timeout_s: float = 15.0
+    # Повторы после первой попытки: только если запрос не ушёл (ошибка соединения)
+    # или шлюз ответил 429/503; паузы экспоненциальные со случайным разбросом
+    gateway_retries: int = 2
+    gateway_retry_max_wait_s: float = 5.0
+    # Максимум одновременных запросов к шлюзу на воркер
+    gateway_max_in_flight: int = 20
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class JobQueueSettings(BaseSettings):
+    # Очередь задач в myaso.jobs (add_job_queue.sql). False - старые BackgroundTasks
+    job_queue_enabled: bool = True
+    job_queue_workers: int = 4
+    # Аренда задачи; пока задача выполняется, аренда продлевается
+    job_queue_visibility_timeout_s: float = 180.0
+    job_queue_poll_interval_s: float = 1.0
+    job_queue_max_attempts: int = 3
+    job_queue_retry_backoff_s: float = 5.0
+    # Сколько ждать незавершённые задачи при остановке воркера
+    job_queue_drain_timeout_s: float = 20.0
+    job_queue_retention_h: float = 72.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class ConversationSchedulerSettings(BaseSettings):
+    # Сообщения клиента, пришедшие с паузой меньше debounce, склеиваются в один ход
+    conversation_debounce_s: float = 2.0
+    # Верхняя граница ожидания первого сообщения пачки
+    conversation_max_wait_s: float = 10.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class HistoryWindowSettings(BaseSettings):
+    history_window_enabled: bool = True
+    # Сколько последних строк истории читается за ход
+    history_max_rows: int = 40
+    # Бюджет окна истории в токенах (оценка, см. estimate_tokens)
+    history_max_tokens: int = 6000
+    # Бюджеты по темам prompts.topic, например {"Продать": 8000}
+    history_topic_max_tokens: Dict[str, int] = {}
+    # Первое сообщение диалога (контекст и инструкции инициализации) всегда в окне
+    history_pin_first_message: bool = True
+    # Старые ходы сворачиваются в сводку в фоне
+    history_summary_enabled: bool = True
+    # Пустая строка - основная модель (openrouter.model_id)
+    history_summary_model: str = ""
+    # Сводка обновляется, когда за окном накопилось хотя бы столько строк
+    history_summary_min_rows: int = 6
+    history_summary_batch_rows: int = 60
+    history_summary_max_tokens: int = 600
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+    def max_tokens_for(self, topic: str) -> int:
+        return self.history_topic_max_tokens.get(topic, self.history_max_tokens)
+
+
+class HistoryCacheSettings(BaseSettings):
+    history_cache_enabled: bool = True
+    history_cache_max_conversations: int = 1000
+    # Верхняя граница памяти под кэш истории (оценка по UTF-8 размеру сообщений)
+    history_cache_max_bytes: int = 64 * 1024 * 1024
+    # Страховка от пропущенных NOTIFY из других воркеров
+    history_cache_ttl_s: float = 900.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class SqlTemplateCacheSettings(BaseSettings):
+    sql_template_cache_enabled: bool = True
+    # Шаблонов в памяти воркера; полный набор лежит в myaso.sql_templates
+    sql_template_cache_max_size: int = 256
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class QueryGovernorSettings(BaseSettings):
+    # Ограничения для SQL, сгенерированного моделью
+    query_governor_statement_timeout_ms: int = 5000
+    query_governor_max_rows: int = 200
+    query_governor_max_bytes: int = 256 * 1024
+    # Потолок стоимости плана по EXPLAIN; 0 отключает проверку
+    query_governor_max_cost: float = 0.0
+    query_governor_fetch_batch: int = 50
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class TextToSqlSettings(BaseSettings):
+    # Спекулятивный режим: K вариантов SQL выполняются параллельно, побеждает первый удачный
+    text_to_sql_speculative_enabled: bool = False
+    text_to_sql_candidates: int = 3
+    # calls - K параллельных запросов к модели, choices - один запрос с n=K
+    text_to_sql_candidate_mode: str = "calls"
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class StreamingSettings(BaseSettings):
+    # Ответ модели уходит клиенту кусками по мере генерации
+    streaming_enabled: bool = False
+    # Кусок отправляется на границе абзаца не раньше min_chars,
+    # длинный абзац режется по концу предложения около max_chars
+    stream_chunk_min_chars: int = 200
+    stream_chunk_max_chars: int = 1000
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class ToolExecutionSettings(BaseSettings):
+    # Таймаут вызова инструмента по умолчанию и переопределения по имени инструмента,
+    # например TOOL_TIMEOUTS_S='{"ShowProductPhotos": 60}'
+    tool_default_timeout_s: float = 30.0
+    # Фото отправляются клиенту по одному, прерывание на середине оставляет часть отправленной
+    tool_timeouts_s: Dict[str, float] = {"ShowProductPhotos": 120.0}
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+    def timeout_for(self, tool_name: str) -> float:
+        return self.tool_timeouts_s.get(tool_name, self.tool_default_timeout_s)
+
+
+class ContextEncoderSettings(BaseSettings):
+    # Контекст первого сообщения рендерится компактными таблицами вместо repr словарей
+    context_compact_enabled: bool = True
+    # Какие поля сущности попадают в таблицу и в каком порядке.
+    # Сущности без списка выводятся целиком, кроме context_drop_fields
+    context_fields: Dict[str, List[str]] = {
+        "profile": [
+            "phone",
+            "name",
+            "org_name",
+            "city",
+            "business_area",
+            "is_it_friend",
+            "UTC",
+            "sep_turnover",
+            "oct_turnover",
+        ],
+        "orders": [
+            "created_at",
+            "title",
+            "weight_kg",
+            "price_out_kg",
+            "price_out",
+            "destination",
+        ],
+        "products": [
+            "title",
+            "supplier_name",
+            "from_region",
+            "order_price_kg",
+            "min_order_weight_kg",
+            "package_type",
+            "package_weight",
+            "product_in_package",
+            "cooled_or_frozen",
+            "ready_made",
+            "discount",
+            "prepayment_1t",
+        ],
+    }
+    context_drop_fields: List[str] = [
+        "id",
+        "created_at",
+        "updated_at",
+        "embedding",
+        "embedding_hash",
+    ]
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
+class PostgresSettings(BaseSettings):
+    # Обязательно: POSTGRES_DSN из окружения или .env
+    postgres_dsn: str
+    pg_pool_min_size: int = 2
+    pg_pool_max_size: int = 10
+    # Сколько секунд ждать свободное соединение из пула
+    pg_acquire_timeout: float = 10.0
+    pg_command_timeout: float = 60.0
+    # 0 отключает кэш prepared statements (нужно для pgbouncer/supavisor в transaction mode)
+    pg_statement_cache_size: int = 100
+    pg_max_inactive_connection_lifetime: float = 300.0
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
+    )
+
+
 class Settings(BaseModel):
     supabase: SupabaseSettings = SupabaseSettings()
     openrouter: OpenRouterSettings = OpenRouterSettings()
     alibaba: AlibabaSettings = AlibabaSettings()
     langfuse: LangFuseSettings = LangFuseSettings()
+    postgres: PostgresSettings = PostgresSettings()
+    embedding_cache: EmbeddingCacheSettings = EmbeddingCacheSettings()
+    catalog_embedding: CatalogEmbeddingSettings = CatalogEmbeddingSettings()
+    vector_index: VectorIndexSettings = VectorIndexSettings()
+    catalog_cache: CatalogCacheSettings = CatalogCacheSettings()
+    config_cache: ConfigCacheSettings = ConfigCacheSettings()
+    gateway: GatewaySettings = GatewaySettings()
+    job_queue: JobQueueSettings = JobQueueSettings()
+    conversation_scheduler: ConversationSchedulerSettings = (
+        ConversationSchedulerSettings()
+    )
+    history_window: HistoryWindowSettings = HistoryWindowSettings()
+    history_cache: HistoryCacheSettings = HistoryCacheSettings()
+    sql_template_cache: SqlTemplateCacheSettings = SqlTemplateCacheSettings()
+    query_governor: QueryGovernorSettings = QueryGovernorSettings()
+    text_to_sql: TextToSqlSettings = TextToSqlSettings()
+    streaming: StreamingSettings = StreamingSettings()
+    tool_execution: ToolExecutionSettings = ToolExecutionSettings()
+    context_encoder: ContextEncoderSettings = ContextEncoderSettings()
 
 
 # Debug environment variables
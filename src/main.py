@@ -1,10 +1,63 @@
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.routers import ai
+from src.services.client_registry import registry
+from src.config.settings import settings
+from src.services.embedding_service import embedding_service
+from src.services.vector_index import product_vector_index
+from src.services.catalog_cache import catalog_cache
+from src.services.pg_listener import pg_listener
+from src.services.gateway_client import gateway
+from src.services.job_queue import job_queue
+from src.services.conversation_scheduler import conversation_scheduler
+from src.services.history_summary import history_summarizer
+from src.services.history_cache import history_cache
+from src.services.config_cache import config_cache
+from src.services.init_context import init_context_metrics
+from src.services.sql_template_cache import sql_template_cache
+from src.services.query_governor import query_governor
+from src.services.streaming import streaming_metrics
+from src.services.tool_executor import tool_executor
+from src.services.llm_calls import llm_calls
+from src.services.llm_tracing import llm_tracer
+from src.services.context_encoder import context_encoder_metrics
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общие клиенты создаются один раз на воркер и закрываются при остановке
+    await registry.start()
+    if settings.vector_index.vector_index_enabled:
+        await product_vector_index.start()
+    if catalog_cache.enabled:
+        catalog_cache.register()
+    if history_cache.enabled:
+        history_cache.register()
+    if config_cache.enabled:
+        config_cache.register()
+        await config_cache.start()
+    if job_queue.enabled:
+        await job_queue.start()
+    await pg_listener.start()
+    llm_tracer.start()
+    try:
+        yield
+    finally:
+        # Сначала дожидаемся задач очереди, пока клиенты ещё открыты
+        await job_queue.stop()
+        await pg_listener.stop()
+        await history_summarizer.close()
+        await config_cache.stop()
+        # Оставшиеся трейсы отправляются до закрытия клиентов
+        await llm_tracer.stop()
+        await product_vector_index.stop()
+        embedding_service.close()
+        await registry.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,3 +74,31 @@ def read_root():
     return {"status": "healthy"}
 
 
+@app.get("/health/db", status_code=200)
+async def db_health():
+    return await registry.pg_health()
+
+
+@app.get("/metrics", status_code=200)
+async def metrics():
+    return {
+        "clients": registry.stats(),
+        "embeddings": embedding_service.stats(),
+        "vector_index": product_vector_index.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "config_cache": config_cache.stats(),
+        "pg_listener": pg_listener.stats(),
+        "gateway": gateway.stats(),
+        "job_queue": await job_queue.stats(),
+        "conversation_scheduler": conversation_scheduler.stats(),
+        "history_summary": history_summarizer.stats(),
+        "history_cache": history_cache.stats(),
+        "init_context": init_context_metrics.stats(),
+        "sql_templates": sql_template_cache.stats(),
+        "query_governor": query_governor.stats(),
+        "streaming": streaming_metrics.stats(),
+        "tools": tool_executor.stats(),
+        "llm_calls": llm_calls.stats(),
+        "llm_tracing": llm_tracer.stats(),
+        "context_encoder": context_encoder_metrics.stats(),
+    }
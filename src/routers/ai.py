@@ -1,4 +1,5 @@
 from fastapi import APIRouter, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from src.schemas import (
     ConversationHistoryMessage,
     LLMRequest,
@@ -10,103 +11,231 @@ from src.schemas import (
 from src.services.llm_service import llm, ShowProductPhotos
 from src.services.history_service import HistoryService
 from src.services.profile_service import ProfileService
-from src.services.orders_service import OrderService
-from src.utils import transorm_history_to_llm_format, remove_markdown_symbols
+from src.services.init_context import build_init_context
+from src.services.context_encoder import encode_init_context
+from src.services.gateway_client import gateway, GatewayError
+from src.services.job_queue import job_queue, JobFailed
+from src.services.conversation_scheduler import (
+    conversation_scheduler,
+    merge_user_message_payloads,
+)
+from src.services.streaming import ChunkedDelivery, streaming_metrics
+from src.config.settings import settings
+from src.utils import remove_markdown_symbols
+import asyncio
 import re
-import requests
 import json
-from typing import Dict, Any, List, Optional
+import time
+import traceback
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional, Set
 
 router = APIRouter(prefix="/ai")
 
 
+def tool_call_fields(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+    """Имя, id и аргументы вызова инструмента из _tool_calls_info ответа модели."""
+    arguments = tool_call.get("arguments") or {}
+    raw_call = arguments.get("tool_call") or {}
+    function_args = raw_call.get("function", {}).get("arguments")
+    if isinstance(function_args, str):
+        try:
+            function_args = json.loads(function_args)
+        except json.JSONDecodeError:
+            function_args = None
+    if not isinstance(function_args, dict):
+        function_args = {
+            key: value for key, value in arguments.items() if key != "tool_call"
+        }
+
+    return {
+        "tool_name": tool_call["name"],
+        "tool_call_id": raw_call.get("id") or f"call_{uuid.uuid4().hex[:24]}",
+        "tool_args": function_args,
+    }
+
+
+def build_turn_history(
+    client_phone: str,
+    ai_response: Dict[str, Any],
+    user_message: Optional[str] = None,
+) -> List[ConversationHistoryMessage]:
+    """Строки истории одного хода диалога в порядке записи."""
+    messages: List[ConversationHistoryMessage] = []
+
+    if user_message:
+        messages.append(
+            ConversationHistoryMessage(
+                client_phone=client_phone,
+                message=user_message,
+                role="user",
+                message_kind="message",
+            )
+        )
+
+    calls = []
+    for tool_call in ai_response.get("tool_calls") or []:
+        if "name" in tool_call and "arguments" in tool_call:
+            fields = tool_call_fields(tool_call)
+            calls.append(fields)
+            messages.append(
+                ConversationHistoryMessage(
+                    client_phone=client_phone,
+                    message=f"Tool call: {fields['tool_name']}",
+                    role="tool",
+                    message_kind="tool_call",
+                    **fields,
+                )
+            )
+        else:
+            # This is a tool call detected from history
+            calls.append(None)
+            messages.append(
+                ConversationHistoryMessage(
+                    client_phone=client_phone,
+                    message=tool_call.get("detected_from_history", "Tool call"),
+                    role="tool",
+                    message_kind="message",
+                )
+            )
+
+    # i-й ответ инструмента - результат i-го вызова
+    for index, tool_response in enumerate(ai_response.get("tool_responses") or []):
+        call = calls[index] if index < len(calls) else None
+        messages.append(
+            ConversationHistoryMessage(
+                client_phone=client_phone,
+                message=tool_response,
+                role="tool",
+                message_kind="tool_result",
+                tool_name=call["tool_name"] if call else None,
+                tool_call_id=call["tool_call_id"] if call else None,
+            )
+        )
+
+    messages.append(
+        ConversationHistoryMessage(
+            client_phone=client_phone,
+            message=ai_response["content"],
+            role="assistant",
+            message_kind="message",
+        )
+    )
+    return messages
+
+
+def start_delivery(client_phone: str, started_at: float) -> Optional[ChunkedDelivery]:
+    """Потоковая отправка ответа в WhatsApp, если она включена."""
+    if not settings.streaming.streaming_enabled:
+        return None
+
+    async def send(text: str):
+        await gateway.send_message(recipient=client_phone, message=text)
+
+    return ChunkedDelivery(send=send, started_at=started_at)
+
+
+async def deliver_answer(
+    client_phone: str,
+    content: str,
+    delivery: Optional[ChunkedDelivery],
+    started_at: float,
+):
+    """Отправляет ответ клиенту; при потоковой отправке - только остаток текста."""
+    if delivery is not None:
+        unsent = await delivery.close()
+        if delivery.sent > 0:
+            if unsent:
+                # Часть ответа уже у клиента - досылаем не ушедшие куски одним сообщением
+                await gateway.send_message(
+                    recipient=client_phone, message="\n\n".join(unsent)
+                )
+            return
+
+    # Без потока (или если модель не выдала текста, например только вызвала инструмент)
+    await gateway.send_message(
+        recipient=client_phone,
+        message=remove_markdown_symbols(content),
+    )
+    streaming_metrics.record_first_message(started_at, streamed=False)
+
+
+async def fail_turn(
+    client_phone: str, error: Exception, handler_name: str, side_effects: bool
+):
+    """
+    Обработка ошибки хода диалога, вызывается из except обработчика.
+
+    Пока ход ничего не отправил клиенту и не записал в историю, ошибка (LLM,
+    база, шлюз) пробрасывается в очередь задач, и ход повторяется целиком с
+    паузой. Если повтора не будет или он продублировал бы уже отправленные
+    сообщения, клиент получает извинение, а задача помечается failed.
+
+    Повтор задачи после падения воркера (истекла аренда) выполняет ход
+    заново: то, что успело уйти клиенту, включая фото из ShowProductPhotos,
+    будет отправлено ещё раз.
+    """
+    print(f"ERROR in {handler_name}: {error}")
+    traceback.print_exc()
+    if not side_effects and job_queue.will_retry():
+        raise error
+
+    try:
+        await gateway.send_message(
+            recipient=client_phone,
+            message="Что-то барахлит вотсап 😞. Пожалуйста, отправьте сообщение ещё раз",
+        )
+    except GatewayError as gateway_error:
+        print(f"ERROR sending fallback message: {gateway_error}")
+
+    if job_queue.in_job():
+        raise JobFailed(str(error)) from error
+    return {"succes": False}
+
+
 async def init_conversation_background(request: InitConverastionRequest):
     hs = await HistoryService()
     # print('HS', await hs.get_history(request.client_phone))
 
+    started_at = time.perf_counter()
+    delivery = start_delivery(request.client_phone, started_at)
+    history_written = False
+
     try:
         # Get AI response first
         ai_response = await ask(
-            LLMRequest(client_phone=request.client_phone, topic=request.topic)
+            LLMRequest(client_phone=request.client_phone, topic=request.topic),
+            on_delta=delivery.feed if delivery else None,
         )
 
         # Add system instructions to history if present
         # if ai_response.get('instructions_with_context'):
         #     await hs.add_message_to_conversation_history(ConversationHistoryMessage(client_phone=request.client_phone, message=ai_response['instructions_with_context'][0]['content'], role=ai_response['instructions_with_context'][0]['role']))
 
-        # Add the RAG context (full_prompt) to history
-        # This ensures the context is saved to Supabase database
-        if ai_response.get("rag_context"):
-            await hs.add_message_to_conversation_history(
-                ConversationHistoryMessage(
-                    client_phone=request.client_phone,
-                    message=ai_response["rag_context"],
-                    role="user",
-                )
-            )
-
-        # Add tool calls to history if present
-        if ai_response.get("tool_calls"):
-            for tool_call in ai_response["tool_calls"]:
-                # Check if this is a tool call with name and arguments or detected from history
-                if "name" in tool_call and "arguments" in tool_call:
-                    tool_message = f"Tool call: {tool_call['name']} with args: {json.dumps(tool_call['arguments'])}"
-                else:
-                    # This is a tool call detected from history
-                    tool_message = tool_call.get("detected_from_history", "Tool call")
-                await hs.add_message_to_conversation_history(
-                    ConversationHistoryMessage(
-                        client_phone=request.client_phone,
-                        message=tool_message,
-                        role="tool",
-                    )
-                )
-
-        # Add tool responses to history if present
-        if ai_response.get("tool_responses"):
-            for tool_response in ai_response["tool_responses"]:
-                await hs.add_message_to_conversation_history(
-                    ConversationHistoryMessage(
-                        client_phone=request.client_phone,
-                        message=tool_response,
-                        role="tool",
-                    )
-                )
-
-        # Add assistant response to history
-        await hs.add_message_to_conversation_history(
-            ConversationHistoryMessage(
+        # RAG контекст (full_prompt), вызовы инструментов и ответ - одной вставкой
+        await hs.add_messages_to_conversation_history(
+            build_turn_history(
                 client_phone=request.client_phone,
-                message=ai_response["content"],
-                role="assistant",
+                ai_response=ai_response,
+                user_message=ai_response.get("rag_context"),
             )
         )
+        history_written = True
 
         # TODO: Перевести контент в формат whatsapp
         # print('ai_response init_conversation_background', remove_markdown_symbols(ai_response['content']))
-        requests.post(
-            "http://51.250.42.45:2026/send-message",
-            json={
-                "recipient": request.client_phone,
-                "message": remove_markdown_symbols(ai_response["content"]),
-            },
+        await deliver_answer(
+            request.client_phone, ai_response["content"], delivery, started_at
         )
         # return {"content": remove_markdown_symbols(ai_response["content"])}
         return {"succes": True}
 
     except Exception as e:
-        requests.post(
-            "http://51.250.42.45:2026/send-message",
-            json={
-                "recipient": request.client_phone,
-                "message": "Что-то барахлит вотсап 😞. Пожалуйста, отправьте сообщение ещё раз",
-            },
-        )
-        print(f"ERROR in init_conversation_background: {e}")
-        import traceback
-
-        traceback.print_exc()
-        return {"succes": False}
+        if delivery is not None:
+            await delivery.abort()
+        side_effects = history_written or (delivery is not None and delivery.sent > 0)
+        return await fail_turn(request.client_phone, e, "init_conversation_background", side_effects)
         # return {
         #     "content": "Произошла ошибка при обработке вашего сообщения. Попробуйте позже."
         # }
@@ -116,82 +245,41 @@ async def process_conversation_background(request: UserMessageRequest):
     hs = await HistoryService()
     enhaced_prompt = request.message
     
+    started_at = time.perf_counter()
+    delivery = start_delivery(request.client_phone, started_at)
+    history_written = False
+
     try:
         # Get AI response first
         ai_response = await ask(
-            LLMRequest(client_phone=request.client_phone, prompt=enhaced_prompt)
+            LLMRequest(client_phone=request.client_phone, prompt=enhaced_prompt),
+            on_delta=delivery.feed if delivery else None,
         )
         print("ai_response process_conversation_background", request.message)
 
-        # Add user message to history
-        await hs.add_message_to_conversation_history(
-            ConversationHistoryMessage(
-                client_phone=request.client_phone, message=enhaced_prompt, role="user"
-            )
-        )
-
-        # Add tool calls to history if present
-        if ai_response.get("tool_calls"):
-            for tool_call in ai_response["tool_calls"]:
-                # Check if this is a tool call with name and arguments or detected from history
-                if "name" in tool_call and "arguments" in tool_call:
-                    tool_message = f"Tool call: {tool_call['name']} with args: {json.dumps(tool_call['arguments'])}"
-                else:
-                    # This is a tool call detected from history
-                    tool_message = tool_call.get("detected_from_history", "Tool call")
-                await hs.add_message_to_conversation_history(
-                    ConversationHistoryMessage(
-                        client_phone=request.client_phone,
-                        message=tool_message,
-                        role="tool",
-                    )
-                )
-
-        # Add tool responses to history if present
-        if ai_response.get("tool_responses"):
-            for tool_response in ai_response["tool_responses"]:
-                await hs.add_message_to_conversation_history(
-                    ConversationHistoryMessage(
-                        client_phone=request.client_phone,
-                        message=tool_response,
-                        role="tool",
-                    )
-                )
-
-        # Add assistant response to history
-        await hs.add_message_to_conversation_history(
-            ConversationHistoryMessage(
+        # Сообщение клиента, вызовы инструментов и ответ - одной вставкой
+        await hs.add_messages_to_conversation_history(
+            build_turn_history(
                 client_phone=request.client_phone,
-                message=ai_response["content"],
-                role="assistant",
+                ai_response=ai_response,
+                user_message=enhaced_prompt,
             )
         )
+        history_written = True
 
         # TODO: Перевести контент в формат whatsapp
         # print('ai_response process_conversation_background', remove_markdown_symbols(ai_response['content']))
-        requests.post(
-            "http://51.250.42.45:2026/send-message",
-            json={
-                "recipient": request.client_phone,
-                "message": remove_markdown_symbols(ai_response["content"]),
-            },
+        await deliver_answer(
+            request.client_phone, ai_response["content"], delivery, started_at
         )
         return {"succes": True}
         # return {"content": remove_markdown_symbols(ai_response["content"])}
 
     except Exception as e:
-        requests.post(
-            "http://51.250.42.45:2026/send-message",
-            json={
-                "recipient": request.client_phone,
-                "message": "Что-то барахлит вотсап 😞. Пожалуйста, отправьте сообщение ещё раз",
-            },
-        )
-        print(f"ERROR in process_conversation_background: {e}")
-        import traceback
-
-        traceback.print_exc()
-        return {"succes": False}
+        if delivery is not None:
+            await delivery.abort()
+        side_effects = history_written or (delivery is not None and delivery.sent > 0)
+        return await fail_turn(request.client_phone, e, "process_conversation_background", side_effects)
         # return {
         #     "content": "Произошла ошибка при обработке вашего сообщения. Попробуйте позже."
         # }
@@ -204,11 +292,35 @@ async def reset_conversation_background(request: ResetConversationRequest):
     return {"succes": True}
 
 
+# Обработчики задач очереди: payload - это model_dump() запроса эндпоинта
+job_queue.register(
+    "init_conversation",
+    lambda payload: init_conversation_background(InitConverastionRequest(**payload)),
+)
+# Подряд пришедшие сообщения клиента склеиваются в один ход диалога
+job_queue.register(
+    "process_conversation",
+    lambda payload: process_conversation_background(UserMessageRequest(**payload)),
+    coalescer=merge_user_message_payloads,
+)
+job_queue.register(
+    "reset_conversation",
+    lambda payload: reset_conversation_background(ResetConversationRequest(**payload)),
+)
+
+
 @router.delete("/resetConversation", status_code=200)
 async def reset_conversation(
     request: ResetConversationRequest, background_tasks: BackgroundTasks
 ):
-    background_tasks.add_task(reset_conversation_background, request)
+    if job_queue.enabled:
+        await job_queue.enqueue(
+            "reset_conversation",
+            request.model_dump(),
+            conversation_key=request.client_phone,
+        )
+    else:
+        background_tasks.add_task(reset_conversation_background, request)
     return {"succes": True}
 
 
@@ -216,7 +328,14 @@ async def reset_conversation(
 async def init_conversation(
     request: InitConverastionRequest, background_tasks: BackgroundTasks
 ):
-    background_tasks.add_task(init_conversation_background, request)
+    if job_queue.enabled:
+        await job_queue.enqueue(
+            "init_conversation",
+            request.model_dump(),
+            conversation_key=request.client_phone,
+        )
+    else:
+        background_tasks.add_task(init_conversation_background, request)
     return {"succes": True}
     # return await init_conversation_background(request)
 
@@ -225,11 +344,109 @@ async def init_conversation(
 async def process_conversation(
     request: UserMessageRequest, background_tasks: BackgroundTasks
 ):
-    background_tasks.add_task(process_conversation_background, request)
+    scheduler_settings = settings.conversation_scheduler
+    if job_queue.enabled:
+        await job_queue.enqueue(
+            "process_conversation",
+            request.model_dump(),
+            delay_s=scheduler_settings.conversation_debounce_s,
+            conversation_key=request.client_phone,
+            max_delay_s=scheduler_settings.conversation_max_wait_s,
+        )
+    else:
+        conversation_scheduler.submit(request, process_conversation_background)
     return {"succes": True}
     # return await process_conversation_background(request)
 
 
+# Ходы /ai/stream, которые доводятся до конца после отключения клиента
+_detached_turns: Set[asyncio.Task] = set()
+
+
+@asynccontextmanager
+async def conversation_turn(request: UserMessageRequest) -> AsyncIterator[None]:
+    """Ход вне очереди задач, по порядку с остальными ходами того же телефона."""
+    if job_queue.enabled:
+        async with job_queue.exclusive(
+            "stream_conversation",
+            request.model_dump(),
+            conversation_key=request.client_phone,
+        ):
+            yield
+    else:
+        async with conversation_scheduler.turn(request.client_phone):
+            yield
+
+
+def sse_event(event: str, text: str) -> str:
+    data = json.dumps({"text": text}, ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.post("/stream", status_code=200)
+async def stream_conversation(request: UserMessageRequest):
+    """
+    Ход диалога с ответом в виде Server-Sent Events для прямых интеграций:
+    event: delta - фрагменты текста модели по мере генерации,
+    event: done - итоговый ответ (без блоков кода), event: error - ошибка.
+    В WhatsApp ничего не отправляется, история пишется как обычно.
+
+    Ход ждёт завершения ходов этого телефона из очереди задач (или
+    планировщика) и не выполняется одновременно с ними. Если клиент
+    отключился, ход не прерывается: инструменты могли уже отправить фото,
+    поэтому он доводится до конца и записывается в историю.
+    """
+    started_at = time.perf_counter()
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def on_delta(text: str):
+        await events.put(("delta", text))
+
+    async def run_turn():
+        try:
+            async with conversation_turn(request):
+                hs = await HistoryService()
+                ai_response = await ask(
+                    LLMRequest(client_phone=request.client_phone, prompt=request.message),
+                    on_delta=on_delta,
+                )
+                await hs.add_messages_to_conversation_history(
+                    build_turn_history(
+                        client_phone=request.client_phone,
+                        ai_response=ai_response,
+                        user_message=request.message,
+                    )
+                )
+            await events.put(("done", ai_response["content"]))
+        except Exception as e:
+            print(f"ERROR in stream_conversation: {e}")
+            await events.put(("error", str(e)))
+
+    async def event_stream():
+        turn = asyncio.create_task(run_turn())
+        first_message = True
+        try:
+            while True:
+                event, text = await events.get()
+                if first_message and event != "error":
+                    first_message = False
+                    streaming_metrics.record_first_message(started_at, streamed=True)
+                yield sse_event(event, text)
+                if event != "delta":
+                    return
+        finally:
+            if not turn.done():
+                # Клиент отключился - ход доводится до конца без него
+                _detached_turns.add(turn)
+                turn.add_done_callback(_detached_turns.discard)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/getProfile", status_code=200)
 async def get_profile(request: Profile):
     profile_service = await ProfileService()
@@ -237,14 +454,16 @@ async def get_profile(request: Profile):
     return profile
 
 
-async def ask(request: LLMRequest) -> Dict[str, Any]:
+async def ask(
+    request: LLMRequest,
+    on_delta: Optional[Callable[[str], Awaitable[Any]]] = None,
+) -> Dict[str, Any]:
     history_service = await HistoryService()
 
-    message_history = await transorm_history_to_llm_format(
-        await history_service.get_history(client_phone=request.client_phone)
-    )
-    system_instructions = await history_service.get_instructions(
-        topic=request.topic if request.topic is not None else "Продать"
+    topic = request.topic if request.topic is not None else "Продать"
+    message_history, system_instructions = await asyncio.gather(
+        history_service.get_llm_history(client_phone=request.client_phone, topic=topic),
+        history_service.get_instructions(topic=topic),
     )
 
     rag_context = None  # Initialize RAG context variable
@@ -252,31 +471,14 @@ async def ask(request: LLMRequest) -> Dict[str, Any]:
     # инициируем общение если не указан prompt
     if not request.prompt:
         if system_instructions:
-            profile_service = await ProfileService()
-            profile = await profile_service.get_profile(
-                client_phone=request.client_phone
-            )
-
-            order_service = await OrderService()
-            orders = await order_service.get_all_orders_by_client_phone(
-                client_phone=request.client_phone
-            )
-            products = await order_service.get_all_products()
-            sys_variables = await order_service.get_sys_variables()
-
-            products = await llm.get_result_from_db_by_ai(
-                user_request=(
-                    await history_service.get_instructions(
-                        topic="Получить товары при инициализации диалога"
-                    )
-                ).get("prompt", ""),
-                top_k_limit=10,
-                client=profile,
-                system_vars=sys_variables,
+            # Профиль, заказы, системные переменные и подбор товаров - одним графом этапов
+            init_context = await build_init_context(
+                client_phone=request.client_phone, history_service=history_service
             )
-
-            if len(products) == 0:
-                products = await order_service.get_random_products(limit=10)
+            profile = init_context["profile"]
+            orders = init_context["orders"]
+            sys_variables = init_context["sys_variables"]
+            products = init_context["products"]
 
             # Handle the case where system_instructions might not be a dict
             if isinstance(system_instructions, dict):
@@ -286,7 +488,18 @@ async def ask(request: LLMRequest) -> Dict[str, Any]:
             else:
                 prompt_content = str(system_instructions)
 
-            full_prompt = f"""
+            if settings.context_encoder.context_compact_enabled:
+                # Таблицы вместо repr: контекст хранится в истории и уходит в каждый ход
+                context_text, context_tokens = encode_init_context(
+                    profile=profile,
+                    sys_variables=sys_variables,
+                    orders=orders,
+                    products=products,
+                )
+                print(f"Init context tokens by section: {context_tokens}")
+                full_prompt = f"{context_text}\n=====\n{prompt_content}"
+            else:
+                full_prompt = f"""
             Профиль клиента: {profile}
             ===============================================
             Системные переменные: {sys_variables}
@@ -311,15 +524,17 @@ async def ask(request: LLMRequest) -> Dict[str, Any]:
     print(f"Router - Prompt type: {type(query_to_send)}")
     print(f"Router - Prompt repr: {repr(query_to_send)}")
     
-    response = await llm.infer(query=query_to_send, history=message_history)
+    response = await llm.infer(
+        query=query_to_send, history=message_history, on_delta=on_delta
+    )
 
     # Extract content from response
     # Handle both direct response and response with tool calls
     content = ""
     try:
-        # Check if this is a tool call response - use the tool result as content
-        tool_result = getattr(response, "_tool_result", None)
-        if tool_result is not None:
+        # Check if this is a tool call response - use the tool results as content
+        tool_results = getattr(response, "_tool_results", None)
+        if tool_results:
             # For tool calls, use the original LLM content + tool result
             response_attr = getattr(response, "response", None)
             if response_attr is not None:
@@ -335,8 +550,8 @@ async def ask(request: LLMRequest) -> Dict[str, Any]:
                 else:
                     llm_content = ""
 
-            # Combine LLM content with tool result
-            content = llm_content if llm_content else str(tool_result)
+            # Combine LLM content with tool results
+            content = llm_content if llm_content else "\n".join(tool_results)
         else:
             # Regular response without tool calls
             response_attr = getattr(response, "response", None)
@@ -364,13 +579,11 @@ async def ask(request: LLMRequest) -> Dict[str, Any]:
 
     try:
         # Check if response has tool information attached by the LLM service
-        tool_call_info = getattr(response, "_tool_call_info", None)
-        if tool_call_info is not None:
-            tool_calls.append(tool_call_info)
-
-        tool_result = getattr(response, "_tool_result", None)
-        if tool_result is not None:
-            tool_responses.append(str(tool_result))
+        tool_calls.extend(getattr(response, "_tool_calls_info", None) or [])
+        tool_responses.extend(
+            str(tool_result)
+            for tool_result in getattr(response, "_tool_results", None) or []
+        )
     except Exception as e:
         tool_responses.append(f"Error processing tools: {str(e)}")
 
@@ -15,6 +15,14 @@ class ConversationHistoryMessage(BaseModel):
     message: str
     role: str
     client_phone: str
+    # Строки одного хода диалога пишутся одной вставкой и упорядочиваются по seq
+    turn_id: Optional[str] = None
+    seq: Optional[int] = None
+    # message | tool_call | tool_result; вызов и ответ инструмента связаны tool_call_id
+    message_kind: Optional[Literal["message", "tool_call", "tool_result"]] = None
+    tool_name: Optional[str] = None
+    tool_call_id: Optional[str] = None
+    tool_args: Optional[Dict[str, Any]] = None
 
 
 class InitConverastionRequest(BaseModel):
@@ -0,0 +1,145 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.services.pg_listener import pg_listener
+from src.services.product_repository import PRODUCT_PROJECTIONS, product_repository
+
+
+CATALOG_CHANNEL = "myaso_catalog_changed"
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога с индексами по id и (title, supplier_name)."""
+
+    def __init__(self, products: List[Dict[str, Any]]):
+        self.products = products
+        self.loaded_at = time.monotonic()
+        self.by_id: Dict[int, Dict[str, Any]] = {
+            product["id"]: product for product in products
+        }
+        self.by_title_supplier: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for product in products:
+            # Как и в запросе к базе, при дублях берётся первая строка
+            self.by_title_supplier.setdefault(
+                (product["title"], product["supplier_name"]), product
+            )
+
+
+def project(product: Dict[str, Any], projection: str) -> Dict[str, Any]:
+    return {column: product.get(column) for column in PRODUCT_PROJECTIONS[projection]}
+
+
+class CatalogCache:
+    """
+    Снимок каталога товаров в памяти воркера.
+
+    Каталог меняется только при импорте прайс-листа, поэтому горячие чтения
+    обслуживаются из словарей. Снимок помечается устаревшим по NOTIFY из
+    триггера на myaso.products (см. add_catalog_notify.sql), а TTL
+    страхует от пропущенных уведомлений.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._stale = True
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.catalog_cache.catalog_cache_enabled
+
+    def invalidate(self, payload: str = ""):
+        self.invalidations += 1
+        self._stale = True
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._snapshot is not None
+            and not self._stale
+            and time.monotonic() - self._snapshot.loaded_at
+            < settings.catalog_cache.catalog_cache_ttl_s
+        )
+
+    async def snapshot(self) -> CatalogSnapshot:
+        if self._is_fresh():
+            self.hits += 1
+            return self._snapshot
+
+        async with self._lock:
+            if not self._is_fresh():
+                # Сбрасываем флаг до загрузки: NOTIFY во время загрузки снова его выставит
+                self._stale = False
+                try:
+                    products = await product_repository.get_all(projection="display")
+                except Exception:
+                    # Инвалидация не должна потеряться: следующий запрос повторит загрузку
+                    self._stale = True
+                    raise
+                self._snapshot = CatalogSnapshot(products)
+                self.reloads += 1
+                print(f"CatalogCache loaded {len(products)} products")
+        return self._snapshot
+
+    async def all_products(self, projection: str = "display") -> List[Dict[str, Any]]:
+        snapshot = await self.snapshot()
+        return [project(product, projection) for product in snapshot.products]
+
+    async def random_products(
+        self, limit: int = 10, projection: str = "display"
+    ) -> List[Dict[str, Any]]:
+        snapshot = await self.snapshot()
+        sample = random.sample(snapshot.products, min(limit, len(snapshot.products)))
+        return [project(product, projection) for product in sample]
+
+    async def get_many(
+        self, product_ids: List[int], projection: str = "display"
+    ) -> List[Dict[str, Any]]:
+        snapshot = await self.snapshot()
+        return [
+            project(snapshot.by_id[product_id], projection)
+            for product_id in product_ids
+            if product_id in snapshot.by_id
+        ]
+
+    async def find(
+        self, title: str, supplier_name: str, projection: str = "display"
+    ) -> Optional[Dict[str, Any]]:
+        snapshot = await self.snapshot()
+        product = snapshot.by_title_supplier.get((title, supplier_name))
+        return project(product, projection) if product is not None else None
+
+    async def find_many(
+        self, pairs: List[Tuple[str, str]], projection: str = "display"
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        snapshot = await self.snapshot()
+        return {
+            pair: project(snapshot.by_title_supplier[pair], projection)
+            for pair in pairs
+            if pair in snapshot.by_title_supplier
+        }
+
+    def register(self):
+        pg_listener.subscribe(CATALOG_CHANNEL, self.invalidate)
+        pg_listener.on_reconnect(self.invalidate)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._snapshot.products) if self._snapshot else 0,
+            "age_s": round(time.monotonic() - self._snapshot.loaded_at, 1)
+            if self._snapshot
+            else None,
+            "stale": self._stale,
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "invalidations": self.invalidations,
+        }
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from tenacity import retry, stop_after_attempt, wait_random_exponential
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+from src.services.embedding_service import embedding_service
+from src.services.vector_index import product_vector_index
+
+
+PRODUCT_DESCRIPTION_COLUMNS = (
+    "id",
+    "title",
+    "from_region",
+    "supplier_name",
+    "cooled_or_frozen",
+    "package_type",
+    "product_in_package",
+    "ready_made",
+    "discount",
+    "embedding_hash",
+)
+
+
+def build_product_description(product: Dict[str, Any]) -> str:
+    return f"""Товар {product['title']} из {product['from_region']} поставщиком которого - компания {product['supplier_name']}, является {product['cooled_or_frozen']} продуктом. Упаковывается в {product['package_type']}. Фасовка продукта {product['product_in_package']}. {"Товар является полуфабрикатом" if product['ready_made'] else "Товар не является полуфабрикатом"}. Скидка на товар - {product['discount']}"""
+
+
+def description_hash(description: str, model_id: str) -> str:
+    # Модель входит в хэш: смена модели эмбеддингов переэмбеддит весь каталог
+    return hashlib.sha256(f"{model_id}\n{description}".encode("utf-8")).hexdigest()
+
+
+class CatalogEmbeddingJob:
+    """
+    Инкрементальный переэмбеддинг каталога.
+
+    Эмбеддятся только товары, у которых изменился хэш текстового описания.
+    Описания отправляются пачками по несколько штук в один запрос к API
+    эмбеддингов с ограниченной параллельностью, а векторы записываются
+    в базу пачками одним UPDATE ... FROM unnest(...).
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        write_batch_size: Optional[int] = None,
+    ):
+        job_settings = settings.catalog_embedding
+        self.batch_size = batch_size or job_settings.catalog_embedding_batch_size
+        self.concurrency = concurrency or job_settings.catalog_embedding_concurrency
+        self.write_batch_size = (
+            write_batch_size or job_settings.catalog_embedding_write_batch_size
+        )
+
+    async def _fetch_pending(self, force: bool) -> Tuple[int, List[Tuple[int, str, str]]]:
+        async with registry.pg_connection() as conn:
+            rows = await conn.fetch(
+                f"SELECT {', '.join(PRODUCT_DESCRIPTION_COLUMNS)} FROM myaso.products"
+            )
+
+        pending = []
+        for row in rows:
+            description = build_product_description(row)
+            new_hash = description_hash(description, embedding_service.model_id)
+            if force or row["embedding_hash"] != new_hash:
+                pending.append((row["id"], description, new_hash))
+
+        return len(rows), pending
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(multiplier=1, max=20),
+        reraise=True,
+    )
+    async def _embed_batch(self, descriptions: List[str]) -> List[List[float]]:
+        return await embedding_service.create_embeddings(descriptions)
+
+    async def _write(self, rows: List[Tuple[int, List[float], str]]):
+        if not rows:
+            return
+
+        async with registry.pg_connection() as conn:
+            await conn.execute(
+                """
+                UPDATE myaso.products AS p
+                SET embedding = v.embedding::vector,
+                    embedding_hash = v.embedding_hash
+                FROM unnest($1::bigint[], $2::text[], $3::text[])
+                    AS v(id, embedding, embedding_hash)
+                WHERE p.id = v.id
+                """,
+                [row[0] for row in rows],
+                [str(row[1]) for row in rows],
+                [row[2] for row in rows],
+            )
+
+        # Индекс этого процесса обновляется сразу, остальные воркеры подхватят
+        # изменения при следующем refresh по embedding_hash
+        await product_vector_index.upsert(rows)
+
+    async def run(self, force: bool = False) -> Dict[str, Any]:
+        started = time.perf_counter()
+        total, pending = await self._fetch_pending(force)
+        print(
+            f"CatalogEmbeddingJob - {len(pending)} of {total} products need re-embedding"
+        )
+
+        batches = [
+            pending[i : i + self.batch_size]
+            for i in range(0, len(pending), self.batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        write_lock = asyncio.Lock()
+        buffer: List[Tuple[int, List[float], str]] = []
+        progress = {"embedded": 0, "failed": 0, "written": 0}
+
+        async def flush(force_flush: bool = False):
+            async with write_lock:
+                if len(buffer) >= self.write_batch_size or (force_flush and buffer):
+                    rows = buffer[:]
+                    buffer.clear()
+                    await self._write(rows)
+                    progress["written"] += len(rows)
+
+        async def process(batch: List[Tuple[int, str, str]]):
+            async with semaphore:
+                try:
+                    vectors = await self._embed_batch([item[1] for item in batch])
+                except Exception as e:
+                    progress["failed"] += len(batch)
+                    print(f"CatalogEmbeddingJob - batch failed: {e}")
+                    return
+
+            buffer.extend(
+                (product_id, vector, new_hash)
+                for (product_id, _, new_hash), vector in zip(batch, vectors)
+            )
+            progress["embedded"] += len(batch)
+            elapsed = time.perf_counter() - started
+            print(
+                f"CatalogEmbeddingJob - {progress['embedded']}/{len(pending)} embedded, "
+                f"{progress['embedded'] / elapsed:.1f} products/s"
+            )
+            await flush()
+
+        await asyncio.gather(*[process(batch) for batch in batches])
+        await flush(force_flush=True)
+
+        elapsed = time.perf_counter() - started
+        report = {
+            "total": total,
+            "pending": len(pending),
+            "embedded": progress["embedded"],
+            "written": progress["written"],
+            "failed": progress["failed"],
+            "api_requests": len(batches),
+            "elapsed_s": round(elapsed, 2),
+            "products_per_s": round(progress["embedded"] / elapsed, 2) if elapsed else None,
+        }
+        print(f"CatalogEmbeddingJob finished: {report}")
+        return report
+
+
+async def main(force: bool):
+    try:
+        await CatalogEmbeddingJob().run(force=force)
+    finally:
+        await registry.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Переэмбеддинг каталога товаров")
+    parser.add_argument(
+        "--force", action="store_true", help="Переэмбеддить все товары, игнорируя хэши"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.force))
@@ -0,0 +1,232 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import asyncpg
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from supabase import acreate_client, AClient, AsyncClientOptions
+
+from src.config.settings import settings
+
+
+def _httpx_pool_stats(http_client) -> Dict[str, Any]:
+    """
+    Best-effort статистика пула соединений httpx клиента.
+    Внутренности httpcore не являются публичным API, поэтому при любых
+    несовпадениях возвращаем пустой словарь.
+    """
+    try:
+        pool = http_client._transport._pool
+        connections = list(pool.connections)
+    except AttributeError:
+        return {}
+
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "in_use": len(connections) - idle,
+    }
+
+
+class ClientRegistry:
+    """
+    Общие клиенты воркера (Supabase, LLM, embedder, пул asyncpg).
+
+    Создаются один раз в lifespan FastAPI и передаются в сервисы, чтобы каждый
+    ход диалога не строил новые клиенты и не открывал новые TLS соединения.
+    Вне приложения (скрипты, test.py) клиенты создаются лениво при первом обращении.
+    """
+
+    def __init__(self):
+        self._supabase: Optional[AClient] = None
+        self._embedder: Optional[AsyncOpenAI] = None
+        self._llm_client: Optional[AsyncOpenAI] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._pg_pool: Optional[asyncpg.Pool] = None
+        self._lock = asyncio.Lock()
+        self._pg_lock = asyncio.Lock()
+        self.started_at: Optional[float] = None
+        self.clients_created = 0
+        self.injections = 0
+
+    async def start(self):
+        await self.get_supabase()
+        self.get_embedder()
+        self.get_llm_client()
+        await self.get_pg_pool()
+        self.started_at = time.time()
+        print("ClientRegistry started")
+
+    async def get_supabase(self) -> AClient:
+        if self._supabase is None:
+            async with self._lock:
+                if self._supabase is None:
+                    self._supabase = await acreate_client(
+                        settings.supabase.supabase_url,
+                        settings.supabase.supabase_service_key,
+                        options=AsyncClientOptions(schema="myaso"),
+                    )
+                    self.clients_created += 1
+        self.injections += 1
+        return self._supabase
+
+    def get_embedder(self) -> AsyncOpenAI:
+        if self._embedder is None:
+            self._embedder = AsyncOpenAI(
+                api_key=settings.alibaba.alibaba_key,
+                base_url=settings.alibaba.base_alibaba_url,
+            )
+            self.clients_created += 1
+        return self._embedder
+
+    def get_llm_client(self) -> AsyncOpenAI:
+        if self._llm_client is None:
+            openrouter = settings.openrouter
+            self._llm_client = AsyncOpenAI(
+                api_key=openrouter.openrouter_api_key,
+                base_url=openrouter.base_url,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=openrouter.llm_max_connections,
+                        max_keepalive_connections=openrouter.llm_max_keepalive_connections,
+                        keepalive_expiry=openrouter.llm_keepalive_expiry,
+                    ),
+                    timeout=openrouter.llm_timeout,
+                ),
+            )
+            self.clients_created += 1
+        return self._llm_client
+
+    def get_http_client(self) -> httpx.AsyncClient:
+        """Общий keep-alive HTTP клиент для WhatsApp шлюза."""
+        if self._http_client is None:
+            gateway = settings.gateway
+            self._http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    gateway.gateway_timeout_s, connect=gateway.gateway_connect_timeout_s
+                ),
+                limits=httpx.Limits(
+                    max_connections=gateway.gateway_max_in_flight,
+                    max_keepalive_connections=gateway.gateway_max_in_flight,
+                ),
+            )
+            self.clients_created += 1
+        return self._http_client
+
+    async def get_pg_pool(self) -> asyncpg.Pool:
+        if self._pg_pool is None:
+            async with self._pg_lock:
+                if self._pg_pool is None:
+                    pg = settings.postgres
+                    self._pg_pool = await asyncpg.create_pool(
+                        dsn=pg.postgres_dsn,
+                        min_size=pg.pg_pool_min_size,
+                        max_size=pg.pg_pool_max_size,
+                        command_timeout=pg.pg_command_timeout,
+                        statement_cache_size=pg.pg_statement_cache_size,
+                        max_inactive_connection_lifetime=pg.pg_max_inactive_connection_lifetime,
+                    )
+                    self.clients_created += 1
+        return self._pg_pool
+
+    @asynccontextmanager
+    async def pg_connection(self):
+        """
+        Соединение из общего пула с таймаутом ожидания из настроек.
+        Соединение всегда возвращается в пул, даже при ошибке запроса.
+        """
+        pool = await self.get_pg_pool()
+        async with pool.acquire(
+            timeout=settings.postgres.pg_acquire_timeout
+        ) as connection:
+            yield connection
+
+    def pg_pool_stats(self) -> Dict[str, Any]:
+        if self._pg_pool is None:
+            return {}
+
+        size = self._pg_pool.get_size()
+        idle = self._pg_pool.get_idle_size()
+        return {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "min_size": self._pg_pool.get_min_size(),
+            "max_size": self._pg_pool.get_max_size(),
+        }
+
+    async def pg_health(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            async with self.pg_connection() as connection:
+                await connection.fetchval("SELECT 1")
+        except Exception as e:
+            return {"status": "unhealthy", "error": str(e), **self.pg_pool_stats()}
+
+        return {
+            "status": "healthy",
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            **self.pg_pool_stats(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        supabase_pool = {}
+        if self._supabase is not None:
+            session = getattr(self._supabase.postgrest, "session", None)
+            if session is not None:
+                supabase_pool = _httpx_pool_stats(session)
+
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1)
+            if self.started_at
+            else None,
+            "clients_created": self.clients_created,
+            "injections": self.injections,
+            "supabase_pool": supabase_pool,
+            "embedder_pool": _httpx_pool_stats(self._embedder._client)
+            if self._embedder is not None
+            else {},
+            "llm_pool": _httpx_pool_stats(self._llm_client._client)
+            if self._llm_client is not None
+            else {},
+            "http_pool": _httpx_pool_stats(self._http_client)
+            if self._http_client is not None
+            else {},
+            "pg_pool": self.pg_pool_stats(),
+        }
+
+    async def close(self):
+        if self._supabase is not None:
+            try:
+                await self._supabase.postgrest.aclose()
+            except Exception as e:
+                print(f"ClientRegistry - error closing Supabase client: {e}")
+            self._supabase = None
+
+        if self._embedder is not None:
+            await self._embedder.close()
+            self._embedder = None
+
+        if self._llm_client is not None:
+            await self._llm_client.close()
+            self._llm_client = None
+
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+        if self._pg_pool is not None:
+            try:
+                await asyncio.wait_for(self._pg_pool.close(), timeout=10)
+            except Exception as e:
+                print(f"ClientRegistry - error closing Postgres pool: {e}")
+                self._pg_pool.terminate()
+            self._pg_pool = None
+
+        print("ClientRegistry closed")
+
+
+registry = ClientRegistry()
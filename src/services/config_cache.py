@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+from src.services.pg_listener import pg_listener
+from src.utils import normalise_topic
+
+
+CONFIG_CHANNEL = "myaso_config_changed"
+
+
+class ConfigSnapshot:
+    """Неизменяемый снимок таблиц prompts и system."""
+
+    def __init__(self, prompts: List[Dict[str, Any]], system: List[Dict[str, Any]]):
+        self.prompts = prompts
+        self.system = system
+        self.loaded_at = time.monotonic()
+        self.prompts_by_topic: Dict[str, Dict[str, Any]] = {}
+        for prompt in prompts:
+            # Как и в запросе к базе, при дублях берётся первая строка
+            self.prompts_by_topic.setdefault(normalise_topic(prompt["topic"] or ""), prompt)
+
+
+class ConfigCache:
+    """
+    Снимок конфигурационных таблиц prompts и system в памяти воркера.
+
+    Загружается при старте, после чего get_instructions и get_sys_variables
+    не ходят в сеть. NOTIFY из триггеров (см. add_config_notify.sql) и TTL
+    запускают перечитывание в фоне, а до его завершения отдаётся прежний снимок.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._stale = True
+        self._lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.reloads = 0
+        self.invalidations = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.config_cache.config_cache_enabled
+
+    def invalidate(self, payload: str = ""):
+        self.invalidations += 1
+        self._stale = True
+        self._schedule_reload()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._snapshot is not None
+            and not self._stale
+            and time.monotonic() - self._snapshot.loaded_at
+            < settings.config_cache.config_cache_ttl_s
+        )
+
+    async def _load(self):
+        # Сбрасываем флаг до загрузки: NOTIFY во время загрузки снова его выставит
+        self._stale = False
+        try:
+            supabase = await registry.get_supabase()
+            prompts, system = await asyncio.gather(
+                supabase.table("prompts").select("*").execute(),
+                supabase.table("system").select("*").execute(),
+            )
+        except Exception:
+            self._stale = True
+            self.failures += 1
+            raise
+        self._snapshot = ConfigSnapshot(prompts.data, system.data)
+        self.reloads += 1
+
+    async def _reload(self):
+        async with self._lock:
+            await self._load()
+
+    async def _reload_in_background(self):
+        try:
+            await self._reload()
+        except Exception as e:
+            print(f"ConfigCache reload failed, serving previous snapshot: {e}")
+
+    def _schedule_reload(self):
+        # Пока снимка нет, его загрузит первый же запрос
+        if self._snapshot is None:
+            return
+        if self._reload_task is not None and not self._reload_task.done():
+            return
+        self._reload_task = asyncio.create_task(self._reload_in_background())
+
+    async def snapshot(self) -> ConfigSnapshot:
+        if self._snapshot is None:
+            async with self._lock:
+                if self._snapshot is None:
+                    await self._load()
+        elif not self._is_fresh():
+            self._schedule_reload()
+
+        self.hits += 1
+        return self._snapshot
+
+    async def get_prompt(self, topic: str):
+        snapshot = await self.snapshot()
+        return snapshot.prompts_by_topic.get(normalise_topic(topic), [])
+
+    async def get_system(self) -> List[Dict[str, Any]]:
+        snapshot = await self.snapshot()
+        return list(snapshot.system)
+
+    def register(self):
+        pg_listener.subscribe(CONFIG_CHANNEL, self.invalidate)
+        pg_listener.on_reconnect(self.invalidate)
+
+    async def start(self):
+        """Загружает снимок при старте воркера; ошибка не мешает старту."""
+        try:
+            await self._reload()
+            print(
+                f"ConfigCache loaded {len(self._snapshot.prompts)} prompts and "
+                f"{len(self._snapshot.system)} system rows"
+            )
+        except Exception as e:
+            print(f"ConfigCache initial load failed: {e}")
+
+    async def stop(self):
+        if self._reload_task is not None and not self._reload_task.done():
+            self._reload_task.cancel()
+            await asyncio.gather(self._reload_task, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "prompts": len(self._snapshot.prompts) if self._snapshot else 0,
+            "system": len(self._snapshot.system) if self._snapshot else 0,
+            "age_s": round(time.monotonic() - self._snapshot.loaded_at, 1)
+            if self._snapshot
+            else None,
+            "stale": self._stale,
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "invalidations": self.invalidations,
+            "failures": self.failures,
+        }
+
+
+config_cache = ConfigCache()
@@ -0,0 +1,141 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+from src.config.settings import settings
+from src.utils import estimate_tokens
+
+
+EMPTY_SECTION = "нет данных"
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "да" if value else "нет"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    # Разделитель колонок и переносы строк внутри значения ломают таблицу
+    return " ".join(str(value).split()).replace("|", "/")
+
+
+def _rows(data: Any) -> List[Dict[str, Any]]:
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, (list, tuple)):
+        return [row for row in data if isinstance(row, dict)]
+    return []
+
+
+class ContextEncoder:
+    """
+    Компактное представление контекста для промпта: каждая сущность -
+    таблица из строки заголовка и строк значений через " | ".
+
+    Поля берутся из белого списка сущности (settings.context_encoder); если
+    ни одно поле из списка в строках не заполнено, выводятся все поля, кроме
+    context_drop_fields. Колонки, пустые во всех строках, и пустые значения
+    отбрасываются.
+    Ключи не повторяются в каждой строке, как в repr списка словарей.
+    """
+
+    def columns(self, entity: str, rows: List[Dict[str, Any]]) -> List[str]:
+        encoder_settings = settings.context_encoder
+
+        def filled(candidates: List[str]) -> List[str]:
+            return [
+                column
+                for column in candidates
+                if any(row.get(column) not in (None, "") for row in rows)
+            ]
+
+        whitelist = encoder_settings.context_fields.get(entity)
+        if whitelist is not None:
+            columns = filled(list(whitelist))
+            if columns:
+                return columns
+            # Строки не той формы (например, товары из SQL модели с алиасами
+            # product, price) - выводим их поля, а не пустую секцию
+
+        drop = set(encoder_settings.context_drop_fields)
+        candidates: List[str] = []
+        for row in rows:
+            candidates.extend(
+                key for key in row if key not in drop and key not in candidates
+            )
+        return filled(candidates)
+
+    def encode_table(self, entity: str, data: Any) -> str:
+        rows = _rows(data)
+        columns = self.columns(entity, rows)
+        if not columns:
+            return EMPTY_SECTION
+
+        lines = [" | ".join(columns)]
+        for row in rows:
+            values = [row.get(column) for column in columns]
+            if all(value in (None, "") for value in values):
+                continue
+            lines.append(
+                " | ".join("" if value is None else _format_value(value) for value in values)
+            )
+        return "\n".join(lines)
+
+    def encode(
+        self, sections: Sequence[Tuple[str, str, Any]]
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        sections - (сущность, заголовок, данные). Возвращает текст контекста
+        и оценку числа токенов каждой секции.
+        """
+        parts = []
+        tokens: Dict[str, int] = {}
+        for entity, title, data in sections:
+            part = f"{title}:\n{self.encode_table(entity, data)}"
+            tokens[entity] = estimate_tokens(part)
+            parts.append(part)
+        return "\n=====\n".join(parts), tokens
+
+
+class ContextEncoderMetrics:
+    """Токены секций контекста в компактном виде против repr - для /metrics."""
+
+    def __init__(self):
+        self.encoded = 0
+        self.compact_tokens: Dict[str, int] = {}
+        self.raw_tokens: Dict[str, int] = {}
+
+    def record(self, compact: Dict[str, int], raw: Dict[str, int]):
+        self.encoded += 1
+        for entity, value in compact.items():
+            self.compact_tokens[entity] = self.compact_tokens.get(entity, 0) + value
+        for entity, value in raw.items():
+            self.raw_tokens[entity] = self.raw_tokens.get(entity, 0) + value
+
+    def stats(self) -> Dict[str, Any]:
+        compact_total = sum(self.compact_tokens.values())
+        raw_total = sum(self.raw_tokens.values())
+        return {
+            "enabled": settings.context_encoder.context_compact_enabled,
+            "encoded": self.encoded,
+            "compact_tokens": dict(self.compact_tokens),
+            "raw_tokens": dict(self.raw_tokens),
+            "saved_ratio": round(1 - compact_total / raw_total, 3) if raw_total else None,
+        }
+
+
+context_encoder = ContextEncoder()
+context_encoder_metrics = ContextEncoderMetrics()
+
+
+def encode_init_context(
+    profile: Any, sys_variables: Any, orders: Any, products: Any
+) -> Tuple[str, Dict[str, int]]:
+    """Секции контекста первого сообщения в порядке прежнего full_prompt."""
+    sections = [
+        ("profile", "Профиль клиента", profile),
+        ("sys_variables", "Системные переменные", sys_variables),
+        ("orders", "Предыдущие заказы клиента", orders),
+        ("products", "Подходящие товары", products),
+    ]
+    text, tokens = context_encoder.encode(sections)
+    raw_tokens = {entity: estimate_tokens(repr(data)) for entity, _, data in sections}
+    context_encoder_metrics.record(tokens, raw_tokens)
+    return text, tokens
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Set
+
+from src.config.settings import settings
+from src.schemas import UserMessageRequest
+
+
+def merge_user_messages(requests: List[UserMessageRequest]) -> UserMessageRequest:
+    """Склеивает подряд пришедшие сообщения клиента в одно, в порядке поступления."""
+    if len(requests) == 1:
+        return requests[0]
+
+    return UserMessageRequest(
+        client_phone=requests[-1].client_phone,
+        topic=requests[-1].topic,
+        message="\n".join(request.message for request in requests),
+    )
+
+
+def merge_user_message_payloads(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Коалесер для задач process_conversation в JobQueue."""
+    return merge_user_messages(
+        [UserMessageRequest(**payload) for payload in payloads]
+    ).model_dump()
+
+
+class ConversationScheduler:
+    """
+    Последовательная обработка сообщений одного client_phone внутри воркера.
+
+    Используется, когда очередь задач выключена (в очереди то же самое
+    делают conversation_key и coalescer). Сообщения, пришедшие в пределах
+    debounce окна, склеиваются в один UserMessageRequest, а следующий ход
+    диалога начинается только после завершения предыдущего. Ходы не из
+    submit (потоковый /ai/stream) встают в ту же очередь через turn().
+    """
+
+    def __init__(self):
+        scheduler_settings = settings.conversation_scheduler
+        self.debounce_s = scheduler_settings.conversation_debounce_s
+        self.max_wait_s = scheduler_settings.conversation_max_wait_s
+        self._buffers: Dict[str, List[UserMessageRequest]] = defaultdict(list)
+        self._first_seen: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._handlers: Dict[str, Callable[[UserMessageRequest], Awaitable[Any]]] = {}
+        # Все задачи _flush до завершения: _timers отпускает задачу, когда ход
+        # уже начался, а event loop хранит на задачи только слабые ссылки
+        self._tasks: Set[asyncio.Task] = set()
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Сколько ходов держат или ждут блокировку диалога; при нуле она удаляется
+        self._waiting: Dict[str, int] = defaultdict(int)
+        self.submitted = 0
+        self.turns = 0
+
+    def submit(
+        self,
+        request: UserMessageRequest,
+        handler: Callable[[UserMessageRequest], Awaitable[Any]],
+    ):
+        phone = request.client_phone
+        self.submitted += 1
+        self._buffers[phone].append(request)
+        self._handlers[phone] = handler
+        self._first_seen.setdefault(phone, time.monotonic())
+
+        timer = self._timers.get(phone)
+        if timer is not None and not timer.done():
+            timer.cancel()
+
+        # Скользящее окно, но не дольше max_wait от первого сообщения пачки
+        waited = time.monotonic() - self._first_seen[phone]
+        delay = max(0.0, min(self.debounce_s, self.max_wait_s - waited))
+        task = asyncio.create_task(self._flush(phone, delay, handler))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._timers[phone] = task
+
+    async def _flush(
+        self,
+        phone: str,
+        delay: float,
+        handler: Callable[[UserMessageRequest], Awaitable[Any]],
+    ):
+        await asyncio.sleep(delay)
+
+        # Пачка фиксируется до ожидания блокировки: новые сообщения пойдут в следующий ход
+        requests = self._take_batch(phone)
+        if not requests:
+            return
+
+        async with self._conversation_lock(phone):
+            self.turns += 1
+            await handler(merge_user_messages(requests))
+
+    def _take_batch(self, phone: str) -> List[UserMessageRequest]:
+        self._first_seen.pop(phone, None)
+        self._timers.pop(phone, None)
+        self._handlers.pop(phone, None)
+        return self._buffers.pop(phone, [])
+
+    @asynccontextmanager
+    async def _conversation_lock(self, phone: str) -> AsyncIterator[None]:
+        self._waiting[phone] += 1
+        try:
+            async with self._locks[phone]:
+                yield
+        finally:
+            self._waiting[phone] -= 1
+            if self._waiting[phone] == 0:
+                del self._waiting[phone]
+                del self._locks[phone]
+
+    @asynccontextmanager
+    async def turn(self, phone: str) -> AsyncIterator[None]:
+        """
+        Ход диалога вне submit: ждёт ходы, начатые раньше, а сообщения,
+        ждущие конца debounce окна, выполняет до себя под той же блокировкой.
+        """
+        timer = self._timers.get(phone)
+        handler = self._handlers.get(phone)
+        requests: List[UserMessageRequest] = []
+        if timer is not None and not timer.done():
+            timer.cancel()
+            requests = self._take_batch(phone)
+
+        async with self._conversation_lock(phone):
+            if requests and handler is not None:
+                self.turns += 1
+                await handler(merge_user_messages(requests))
+            self.turns += 1
+            yield
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "turns": self.turns,
+            "pending_conversations": len(self._buffers),
+            "running": len(self._tasks),
+        }
+
+
+conversation_scheduler = ConversationScheduler()
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+
+
+def normalise_query(text: str) -> str:
+    """
+    Нормализует текст запроса для ключа кэша: регистр, ё/е, пробелы и
+    пунктуация по краям не влияют на смысл поискового запроса.
+    """
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" \t\n.,!?;:\"'«»")
+
+
+class _OwnerCancelled(Exception):
+    """Запрос, которого ждали одновременные вызовы, отменён у его владельца."""
+
+
+class DiskEmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов в sqlite. Векторы хранятся как float32.
+    Все методы блокирующие, вызываются через asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl_s: float):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            created_at, blob = row
+            if time.time() - created_at > self.ttl_s:
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def set(self, key: str, model: str, vector: List[float]):
+        blob = array("f", vector).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, created_at, vector) VALUES (?, ?, ?, ?)",
+                (key, model, time.time(), blob),
+            )
+            # Вытесняем самые старые записи сверх лимита
+            self._conn.execute(
+                """
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_size,),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingService:
+    """
+    Асинхронные эмбеддинги запросов с LRU кэшем в памяти и опциональным
+    дисковым кэшем. Ключ кэша - модель + нормализованный текст запроса, поэтому
+    повторные поиски вроде "говядина вырезка" не ходят в API эмбеддингов.
+    """
+
+    def __init__(self, model_id: Optional[str] = None):
+        cache_settings = settings.embedding_cache
+        self.model_id = model_id or settings.alibaba.embedding_model_id
+        self.max_size = cache_settings.embedding_cache_max_size
+        self.ttl_s = cache_settings.embedding_cache_ttl_s
+        self._memory: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._disk: Optional[DiskEmbeddingCache] = None
+        if cache_settings.embedding_cache_path:
+            self._disk = DiskEmbeddingCache(
+                cache_settings.embedding_cache_path,
+                max_size=cache_settings.embedding_disk_cache_max_size,
+                ttl_s=self.ttl_s,
+            )
+
+        self.memory_hits = 0
+        self.in_flight_waits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    def cache_key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_id}\n{normalise_query(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def _memory_get(self, key: str) -> Optional[List[float]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+
+        created_at, vector = entry
+        if time.monotonic() - created_at > self.ttl_s:
+            del self._memory[key]
+            return None
+
+        self._memory.move_to_end(key)
+        return vector
+
+    def _memory_set(self, key: str, vector: List[float]):
+        self._memory[key] = (time.monotonic(), vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    async def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги пачки текстов одним запросом к API, без кэша."""
+        self.api_calls += 1
+        completion = await registry.get_embedder().embeddings.create(
+            model=self.model_id, input=texts
+        )
+        data = sorted(completion.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    async def embed(self, text: str) -> List[float]:
+        key = self.cache_key(text)
+
+        vector = self._memory_get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector
+
+        # Одинаковые запросы, пришедшие одновременно, ждут один вызов API
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.in_flight_waits += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except _OwnerCancelled:
+                # Владельца отменили (например, по таймауту инструмента), а этот
+                # вызов никто не отменял - запрашиваем эмбеддинг сами
+                return await self.embed(text)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            vector = None
+            if self._disk is not None:
+                vector = await asyncio.to_thread(self._disk.get, key)
+                if vector is not None:
+                    self.disk_hits += 1
+
+            if vector is None:
+                self.misses += 1
+                vector = (await self.create_embeddings([text]))[0]
+                if self._disk is not None:
+                    await asyncio.to_thread(self._disk.set, key, self.model_id, vector)
+
+            self._memory_set(key, vector)
+            future.set_result(vector)
+            return vector
+        except asyncio.CancelledError:
+            # Ожидающим - обычное исключение, а не CancelledError: их ход не отменён
+            future.set_exception(_OwnerCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже возвращено вызывающему, ожидающих может не быть
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.in_flight_waits + self.disk_hits + self.misses
+        return {
+            "model_id": self.model_id,
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "in_flight_waits": self.in_flight_waits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "api_calls": self.api_calls,
+            "hit_rate": round((lookups - self.misses) / lookups, 3) if lookups else None,
+            "disk_enabled": self._disk is not None,
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+embedding_service = EmbeddingService()
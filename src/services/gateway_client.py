@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+from src.utils import percentile
+
+
+class GatewayError(Exception):
+    """Шлюз не принял сообщение после всех повторов"""
+
+    def __init__(self, message: str, path: str, status_code: Optional[int] = None):
+        self.message = message
+        self.path = path
+        self.status_code = status_code
+        super().__init__(message)
+
+
+# Ошибки, при которых запрос точно не ушёл в шлюз. Отправка сообщения не идемпотентна:
+# после ReadTimeout или 5xx шлюз мог уже доставить сообщение, повтор дал бы дубль
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUS_CODES = (429, 503)
+
+
+def _is_retryable(exception: BaseException) -> bool:
+    if isinstance(exception, NOT_SENT_ERRORS):
+        return True
+    if isinstance(exception, GatewayError):
+        return exception.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class WhatsAppGateway:
+    """
+    Клиент WhatsApp шлюза (/send-message, /sendImage).
+
+    Работает поверх одного keep-alive httpx клиента из ClientRegistry,
+    ограничивает число одновременных отправок, повторяет запрос со случайной
+    паузой только если он не дошёл до шлюза (ошибка соединения) или шлюз
+    ответил 429/503, и собирает задержки отправки.
+    """
+
+    def __init__(self, base_url: Optional[str] = None):
+        gateway_settings = settings.gateway
+        self.base_url = (base_url or gateway_settings.gateway_base_url).rstrip("/")
+        self.retries = gateway_settings.gateway_retries
+        self.retry_max_wait_s = gateway_settings.gateway_retry_max_wait_s
+        self._semaphore = asyncio.Semaphore(gateway_settings.gateway_max_in_flight)
+        self._latencies_ms = deque(maxlen=1000)
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def _post_once(self, path: str, payload: Dict[str, Any]):
+        # Слот занимается только на время запроса, паузы между повторами его не держат
+        async with self._semaphore:
+            response = await registry.get_http_client().post(
+                f"{self.base_url}{path}", json=payload
+            )
+        if response.status_code >= 400:
+            raise GatewayError(
+                f"Gateway responded {response.status_code}: {response.text[:200]}",
+                path=path,
+                status_code=response.status_code,
+            )
+        return response
+
+    async def _post(self, path: str, payload: Dict[str, Any]):
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            async for attempt in AsyncRetrying(
+                # gateway_retries - число повторов после первой попытки
+                stop=stop_after_attempt(self.retries + 1),
+                wait=wait_random_exponential(multiplier=0.5, max=self.retry_max_wait_s),
+                retry=retry_if_exception(_is_retryable),
+                reraise=True,
+            ):
+                with attempt:
+                    if attempt.retry_state.attempt_number > 1:
+                        self.retried += 1
+                    response = await self._post_once(path, payload)
+        except GatewayError:
+            self.failed += 1
+            raise
+        except httpx.HTTPError as e:
+            self.failed += 1
+            raise GatewayError(f"Gateway request failed: {e}", path=path) from e
+        finally:
+            self.in_flight -= 1
+
+        self.sent += 1
+        self._latencies_ms.append((time.perf_counter() - started) * 1000)
+        return response
+
+    async def send_message(self, recipient: str, message: str):
+        return await self._post(
+            "/send-message", {"recipient": recipient, "message": message}
+        )
+
+    async def send_image(self, recipient: str, image_url: str, caption: str):
+        return await self._post(
+            "/sendImage",
+            {"recipient": recipient, "image_url": image_url, "caption": caption},
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self._latencies_ms)
+        return {
+            "base_url": self.base_url,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "latency_ms_p50": percentile(latencies, 0.5),
+            "latency_ms_p95": percentile(latencies, 0.95),
+            "latency_ms_max": max(latencies) if latencies else None,
+        }
+
+
+gateway = WhatsAppGateway()
@@ -0,0 +1,228 @@
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from src.config.settings import settings
+from src.services.history_summary import history_summarizer
+from src.services.pg_listener import pg_listener
+from src.utils import group_history_units, history_row_tokens, history_rows_to_llm_format
+
+
+HISTORY_CHANNEL = "myaso_history_changed"
+
+# Сколько своих последних ходов помнить, чтобы не сбрасывать кэш на собственный NOTIFY
+OWN_TURNS_LIMIT = 32
+
+
+def _messages_size(messages: List[Dict[str, Any]]) -> int:
+    return len(json.dumps(messages, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class HistoryUnit:
+    """Неделимый кусок окна истории: строки и их представление для модели."""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.messages = history_rows_to_llm_format(rows)
+        self.tokens = sum(history_row_tokens(row) for row in rows)
+        self.size = _messages_size(self.messages)
+
+
+class CachedConversation:
+    def __init__(
+        self,
+        topic: Optional[str],
+        head: List[Dict[str, Any]],
+        window: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]],
+        budget: Optional[int],
+        max_rows: Optional[int],
+    ):
+        self.topic = topic
+        self.summary = summary
+        self.budget = budget
+        self.max_rows = max_rows
+        self.head_messages = history_rows_to_llm_format(head)
+        self.head_tokens = sum(history_row_tokens(row) for row in head)
+        self.head_size = _messages_size(self.head_messages)
+        self.units = deque(HistoryUnit(unit) for unit in group_history_units(window))
+        self.own_turns = deque(maxlen=OWN_TURNS_LIMIT)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def tokens(self) -> int:
+        return self.head_tokens + sum(unit.tokens for unit in self.units)
+
+    @property
+    def size(self) -> int:
+        return self.head_size + sum(unit.size for unit in self.units)
+
+    @property
+    def row_count(self) -> int:
+        return sum(len(unit.rows) for unit in self.units)
+
+    def messages(self) -> List[Dict[str, Any]]:
+        # Новый список на каждый вызов: ask() дописывает в него контекст хода
+        return [
+            *self.head_messages,
+            *(message for unit in self.units for message in unit.messages),
+        ]
+
+    def trim(self) -> bool:
+        """Сдвигает окно так же, как HistoryService.get_history. True, если что-то ушло."""
+        trimmed = False
+        while len(self.units) > 1 and (
+            (self.budget is not None and self.tokens > self.budget)
+            or (self.max_rows is not None and self.row_count > self.max_rows)
+        ):
+            self.units.popleft()
+            trimmed = True
+        return trimmed
+
+
+class ConversationHistoryCache:
+    """
+    LRU кэш окна истории диалога в формате сообщений для модели, по client_phone.
+
+    При попадании ход не читает conversation_history и не разбирает строки
+    заново: строки, записанные обработчиками, дописываются в кэш. Записи и
+    удаления истории из других воркеров приходят NOTIFY из триггера
+    (см. add_history_cache_notify.sql), TTL страхует от пропущенных уведомлений.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, CachedConversation]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.appends = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.history_cache.history_cache_enabled
+
+    def get(self, client_phone: str, topic: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(client_phone)
+        if (
+            entry is None
+            or entry.topic != topic
+            or time.monotonic() - entry.loaded_at > settings.history_cache.history_cache_ttl_s
+        ):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(client_phone)
+        self.hits += 1
+        return entry.messages()
+
+    def load(
+        self,
+        client_phone: str,
+        topic: Optional[str],
+        head: List[Dict[str, Any]],
+        window: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+        budget: Optional[int] = None,
+        max_rows: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        entry = CachedConversation(topic, head, window, summary, budget, max_rows)
+        self._entries[client_phone] = entry
+        self._entries.move_to_end(client_phone)
+        self._evict()
+        return entry.messages()
+
+    def append(self, client_phone: str, rows: List[Dict[str, Any]]):
+        """Дописывает строки, только что вставленные в conversation_history."""
+        entry = self._entries.get(client_phone)
+        if entry is None or not rows:
+            return
+
+        if (
+            entry.max_rows is not None
+            and settings.history_window.history_pin_first_message
+            and not entry.head_messages
+            and not entry.units
+        ):
+            # Диалог был пуст: первое сообщение закрепляется, как в get_history
+            entry.head_messages = history_rows_to_llm_format(rows[:1])
+            entry.head_tokens = history_row_tokens(rows[0])
+            entry.head_size = _messages_size(entry.head_messages)
+            rows = rows[1:]
+
+        for unit in group_history_units(rows):
+            entry.units.append(HistoryUnit(unit))
+        self.appends += 1
+
+        if entry.trim() and entry.units:
+            history_summarizer.schedule(
+                client_phone, entry.units[0].rows[0]["created_at"], entry.summary
+            )
+        self._evict()
+
+    def expect_turn(self, client_phone: str, turn_id: str):
+        """Вызывается до вставки хода, чтобы свой NOTIFY не сбросил запись."""
+        entry = self._entries.get(client_phone)
+        if entry is not None:
+            entry.own_turns.append(turn_id)
+
+    def invalidate(self, client_phone: str):
+        if self._entries.pop(client_phone, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def _on_notify(self, payload: str):
+        try:
+            change = json.loads(payload)
+        except (TypeError, ValueError):
+            self.clear()
+            return
+
+        entry = self._entries.get(change.get("client_phone"))
+        if entry is None:
+            return
+        # Свой ход уже дописан в кэш в append()
+        if change.get("op") == "INSERT" and change.get("turn_id") in entry.own_turns:
+            return
+
+        self.remote_invalidations += 1
+        self.invalidate(change["client_phone"])
+
+    def _evict(self):
+        cache_settings = settings.history_cache
+        size = sum(entry.size for entry in self._entries.values())
+        while self._entries and (
+            len(self._entries) > cache_settings.history_cache_max_conversations
+            or size > cache_settings.history_cache_max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            size -= entry.size
+            self.evictions += 1
+
+    def register(self):
+        pg_listener.subscribe(HISTORY_CHANNEL, self._on_notify)
+        pg_listener.on_reconnect(self.clear)
+        history_summarizer.on_update(self.invalidate)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "conversations": len(self._entries),
+            "bytes": sum(entry.size for entry in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "appends": self.appends,
+            "invalidations": self.invalidations,
+            "remote_invalidations": self.remote_invalidations,
+            "evictions": self.evictions,
+        }
+
+
+history_cache = ConversationHistoryCache()
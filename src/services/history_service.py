@@ -1,31 +1,155 @@
 from src.config.settings import settings
-from supabase import acreate_client, AClient, AsyncClientOptions
+from supabase import AClient
 from src.schemas import Message, ConversationHistoryMessage
-from typing import Optional
-from src.utils import AsyncMixin
-import re
+from typing import List, Optional
+from src.utils import (
+    AsyncMixin,
+    fit_history_units,
+    group_history_units,
+    history_row_tokens,
+    normalise_topic,
+    transorm_history_to_llm_format,
+)
+from src.services.client_registry import registry
+from src.services.history_summary import history_summarizer, parse_timestamp
+from src.services.history_cache import history_cache
+from src.services.config_cache import config_cache
+import asyncio
+import uuid
+
+
+def _history_budget(topic: Optional[str]) -> int:
+    window_settings = settings.history_window
+    return window_settings.max_tokens_for(normalise_topic(topic)) if topic else window_settings.history_max_tokens
+
+
+def _row_key(row):
+    return (row.get('created_at'), row.get('seq'), row['role'], row['message'])
+
 
 class HistoryService(AsyncMixin):
-    async def __ainit__(self):
-        self.supabase: AClient = await acreate_client(
-            settings.supabase.supabase_url, settings.supabase.supabase_service_key, options=AsyncClientOptions(schema='myaso'))
+    async def __ainit__(self, supabase: Optional[AClient] = None):
+        self.supabase: AClient = supabase or await registry.get_supabase()
+
+    async def get_history(self, client_phone: str, topic: Optional[str] = None) -> list[Message]:
+        """
+        Окно истории для модели: последние history_max_rows строк в пределах бюджета
+        токенов темы. Ходы и пары вызов/ответ инструмента не разрезаются, более
+        старые ходы заменяются сводкой (см. HistorySummarizer).
+        """
+        if not settings.history_window.history_window_enabled:
+            return await self._get_full_history(client_phone)
 
-    async def get_history(self, client_phone: str) -> list[Message]:
-        response = await self.supabase.table('conversation_history').select('*').eq('client_phone', client_phone).order('created_at', desc=False).execute()
+        response, head, window, _ = await self._load_window(client_phone, topic)
+        response.data = head + window
         return response
 
+    async def get_llm_history(self, client_phone: str, topic: Optional[str] = None) -> List[dict]:
+        """Окно истории в формате сообщений модели, через кэш воркера (см. ConversationHistoryCache)."""
+        if not history_cache.enabled:
+            return await transorm_history_to_llm_format(await self.get_history(client_phone, topic))
+
+        messages = history_cache.get(client_phone, topic)
+        if messages is not None:
+            return messages
+
+        window_settings = settings.history_window
+        if not window_settings.history_window_enabled:
+            response = await self._get_full_history(client_phone)
+            return history_cache.load(client_phone, topic, head=[], window=response.data)
+
+        _, head, window, summary = await self._load_window(client_phone, topic)
+        return history_cache.load(
+            client_phone,
+            topic,
+            head=head,
+            window=window,
+            summary=summary,
+            budget=_history_budget(topic),
+            max_rows=window_settings.history_max_rows,
+        )
+
+    async def _get_full_history(self, client_phone: str):
+        return await self.supabase.table('conversation_history').select('*').eq('client_phone', client_phone).order('created_at', desc=False).order('seq', desc=False).execute()
+
+    async def _load_window(self, client_phone: str, topic: Optional[str]):
+        """(ответ PostgREST, закреплённые строки: сводка и первое сообщение, окно, сводка)"""
+        max_rows = settings.history_window.history_max_rows
+        response, first_row, summary = await asyncio.gather(
+            self.supabase.table('conversation_history').select('*').eq('client_phone', client_phone).order('created_at', desc=True).order('seq', desc=True).limit(max_rows + 1).execute(),
+            self._get_first_message(client_phone),
+            history_summarizer.get_summary(client_phone),
+        )
+
+        rows = list(reversed(response.data))
+        has_older = len(rows) > max_rows
+        if first_row is not None:
+            rows = [row for row in rows if _row_key(row) != _row_key(first_row)]
+        units = group_history_units(rows)
+        if has_older:
+            # Самый старый кусок мог обрезаться лимитом
+            units = units[1:]
+        if summary is not None:
+            summarized_until = parse_timestamp(summary['summarized_until'])
+            units = [unit for unit in units if parse_timestamp(unit[-1]['created_at']) > summarized_until]
+
+        head = []
+        if summary is not None:
+            head.append({'role': 'system', 'message': f"Краткое содержание более ранней части диалога:\n{summary['summary']}"})
+        if first_row is not None:
+            head.append(first_row)
+
+        kept_units = fit_history_units(units, _history_budget(topic), used=sum(history_row_tokens(row) for row in head))
+        window = [row for unit in kept_units for row in unit]
+
+        if window and (has_older or len(kept_units) < len(units)):
+            history_summarizer.schedule(client_phone, window[0]['created_at'], summary)
+
+        return response, head, window, summary
+
+    async def _get_first_message(self, client_phone: str):
+        if not settings.history_window.history_pin_first_message:
+            return None
+        response = await self.supabase.table('conversation_history').select('*').eq('client_phone', client_phone).order('created_at', desc=False).order('seq', desc=False).limit(1).execute()
+        return response.data[0] if response.data else None
+
     async def get_instructions(self, topic: str):
-        topic =  re.sub(r'\s*\([^)]*\)', '', topic).strip()
+        if config_cache.enabled:
+            return await config_cache.get_prompt(topic)
+        topic = normalise_topic(topic)
         response = await self.supabase.table('prompts').select('*').eq('topic', topic).execute()
         return response.data[0] if len(response.data) else []
 
 
     async def add_message_to_conversation_history(self, message: ConversationHistoryMessage):
-        message_dict = message.model_dump()
+        message_dict = message.model_dump(exclude_none=True)
         
         result = await self.supabase.table('conversation_history').insert(message_dict).execute()
+        history_cache.append(message.client_phone, result.data)
+        return result
+
+    async def add_messages_to_conversation_history(self, messages: List[ConversationHistoryMessage]):
+        """
+        Записывает все строки одного хода диалога одной вставкой (один запрос,
+        один оператор INSERT). Порядок строк внутри хода задаётся seq, так как
+        у строк одной вставки одинаковый created_at.
+        """
+        if not messages:
+            return None
+
+        turn_id = str(uuid.uuid4())
+        rows = [
+            message.model_copy(update={'turn_id': turn_id, 'seq': seq}).model_dump()
+            for seq, message in enumerate(messages)
+        ]
+        client_phone = messages[0].client_phone
+        history_cache.expect_turn(client_phone, turn_id)
+        result = await self.supabase.table('conversation_history').insert(rows).execute()
+        history_cache.append(client_phone, result.data)
         return result
 
     async def delete_conversation_history(self, client_phone: str):
         print('delete_conversation_history', client_phone)
+        history_cache.invalidate(client_phone)
+        await history_summarizer.forget(client_phone)
         await self.supabase.table('conversation_history').delete().eq('client_phone', client_phone).execute()
\ No newline at end of file
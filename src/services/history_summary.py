@@ -0,0 +1,224 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+from src.utils import group_history_units
+
+
+SUMMARY_TABLE = "conversation_summaries"
+
+SUMMARY_PROMPT = """
+Ты ведёшь краткую сводку переписки менеджера по продажам с B2B клиентом.
+Обнови текущую сводку с учётом новых сообщений. Сохрани то, что нужно для
+продолжения диалога: какие товары клиент искал и заказывал, объёмы, цены,
+договорённости, показанные товары и фото, возражения и открытые вопросы.
+Пиши по-русски, сжато, без приветствий и без фактов, которых нет в переписке.
+"""
+
+# Сколько символов одного сообщения уходит в модель при сворачивании
+SUMMARY_MESSAGE_MAX_CHARS = 2000
+
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class HistorySummarizer:
+    """
+    Сворачивает ходы диалога, вышедшие за окно истории, в сводку
+    (таблица myaso.conversation_summaries, см. add_history_summaries.sql).
+
+    Сводка обновляется инкрементально: в модель уходит прошлая сводка и
+    только строки после summarized_until. Обновление запускается в фоне из
+    HistoryService.get_history, не больше одной задачи на client_phone.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._update_callbacks: List[Callable[[str], Any]] = []
+        self.scheduled = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.rows_folded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.history_window.history_summary_enabled
+
+    async def get_summary(self, client_phone: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+
+        supabase = await registry.get_supabase()
+        response = (
+            await supabase.table(SUMMARY_TABLE)
+            .select("*")
+            .eq("client_phone", client_phone)
+            .limit(1)
+            .execute()
+        )
+        return response.data[0] if response.data else None
+
+    def on_update(self, callback: Callable[[str], Any]):
+        """callback(client_phone) после сохранения новой сводки."""
+        self._update_callbacks.append(callback)
+
+    def schedule(
+        self,
+        client_phone: str,
+        window_start: str,
+        summary: Optional[Dict[str, Any]],
+    ):
+        """Свернуть строки между summarized_until и началом окна истории."""
+        if not self.enabled:
+            return
+        if summary is not None and parse_timestamp(window_start) <= parse_timestamp(
+            summary["summarized_until"]
+        ):
+            return
+
+        task = self._tasks.get(client_phone)
+        if task is not None and not task.done():
+            return
+
+        self.scheduled += 1
+        self._tasks[client_phone] = asyncio.create_task(
+            self._update(client_phone, window_start, summary)
+        )
+
+    async def forget(self, client_phone: str):
+        """Сброс диалога: отменяет фоновое обновление и удаляет сводку."""
+        task = self._tasks.pop(client_phone, None)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        supabase = await registry.get_supabase()
+        await supabase.table(SUMMARY_TABLE).delete().eq(
+            "client_phone", client_phone
+        ).execute()
+
+    async def _fetch_rows(
+        self,
+        client_phone: str,
+        window_start: str,
+        summary: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        window_settings = settings.history_window
+        batch_rows = window_settings.history_summary_batch_rows
+
+        supabase = await registry.get_supabase()
+        query = (
+            supabase.table("conversation_history")
+            .select("*")
+            .eq("client_phone", client_phone)
+            .lt("created_at", window_start)
+        )
+        if summary is not None:
+            query = query.gt("created_at", summary["summarized_until"])
+        response = (
+            await query.order("created_at", desc=False)
+            .order("seq", desc=False)
+            .limit(batch_rows + 1)
+            .execute()
+        )
+        rows = response.data
+
+        # Первое сообщение диалога остаётся в окне как есть (history_pin_first_message)
+        if summary is None and window_settings.history_pin_first_message:
+            rows = rows[1:]
+
+        if len(rows) > batch_rows:
+            # Последний кусок мог обрезаться лимитом - свернём его в следующий раз
+            units = group_history_units(rows)[:-1]
+            rows = [row for unit in units for row in unit] or rows[:batch_rows]
+        return rows
+
+    async def _summarise(
+        self, previous_summary: Optional[str], rows: List[Dict[str, Any]]
+    ) -> str:
+        window_settings = settings.history_window
+        transcript = "\n".join(
+            f"{row['role']}: {row['message'][:SUMMARY_MESSAGE_MAX_CHARS]}"
+            for row in rows
+        )
+        response = await registry.get_llm_client().chat.completions.create(
+            model=window_settings.history_summary_model
+            or settings.openrouter.model_id,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Текущая сводка:\n{previous_summary or 'нет'}\n\nНовые сообщения:\n{transcript}",
+                },
+            ],
+            max_tokens=window_settings.history_summary_max_tokens,
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    async def _update(
+        self,
+        client_phone: str,
+        window_start: str,
+        summary: Optional[Dict[str, Any]],
+    ):
+        try:
+            rows = await self._fetch_rows(client_phone, window_start, summary)
+            if len(rows) < settings.history_window.history_summary_min_rows:
+                self.skipped += 1
+                return
+
+            new_summary = await self._summarise(
+                summary["summary"] if summary else None, rows
+            )
+            if not new_summary:
+                self.skipped += 1
+                return
+
+            supabase = await registry.get_supabase()
+            await supabase.table(SUMMARY_TABLE).upsert(
+                {
+                    "client_phone": client_phone,
+                    "summary": new_summary,
+                    "summarized_until": rows[-1]["created_at"],
+                    "rows_folded": (summary["rows_folded"] if summary else 0)
+                    + len(rows),
+                    "updated_at": datetime.now(timezone.utc).isoformat(),
+                }
+            ).execute()
+            self.updated += 1
+            self.rows_folded += len(rows)
+            for callback in self._update_callbacks:
+                callback(client_phone)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            print(f"ERROR updating history summary for {client_phone}: {e}")
+        finally:
+            if self._tasks.get(client_phone) is asyncio.current_task():
+                del self._tasks[client_phone]
+
+    async def close(self):
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_progress": sum(not task.done() for task in self._tasks.values()),
+            "scheduled": self.scheduled,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "rows_folded": self.rows_folded,
+        }
+
+
+history_summarizer = HistorySummarizer()
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.services.history_service import HistoryService
+from src.services.llm_service import llm
+from src.services.orders_service import OrderService
+from src.services.profile_service import ProfileService
+from src.utils import percentile
+
+
+# Тема промпта, по которому модель пишет SQL для подбора товаров при инициализации
+INIT_PRODUCTS_TOPIC = "Получить товары при инициализации диалога"
+
+
+class ContextGraph:
+    """
+    Граф этапов сборки контекста. Этап стартует, как только готовы его
+    зависимости, независимые этапы выполняются одновременно. Результаты
+    зависимостей передаются в этап именованными аргументами.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Sequence[str]]] = {}
+
+    def add(
+        self,
+        name: str,
+        stage: Callable[..., Awaitable[Any]],
+        depends_on: Sequence[str] = (),
+    ):
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self._stages[name] = (stage, tuple(depends_on))
+
+    async def run(self) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """Возвращает результаты этапов и время каждого этапа в мс (без ожидания зависимостей)."""
+        tasks: Dict[str, asyncio.Task] = {}
+        timings_ms: Dict[str, float] = {}
+
+        async def run_stage(name: str):
+            stage, depends_on = self._stages[name]
+            inputs = {dependency: await tasks[dependency] for dependency in depends_on}
+            started = time.perf_counter()
+            try:
+                return await stage(**inputs)
+            finally:
+                timings_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+
+        # Этапы добавляются после своих зависимостей, так что порядок уже топологический
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(run_stage(name))
+
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return dict(zip(tasks, results)), timings_ms
+
+
+class InitContextMetrics:
+    """Время этапов сборки контекста инициализации для /metrics."""
+
+    def __init__(self):
+        self._timings_ms: Dict[str, deque] = defaultdict(lambda: deque(maxlen=500))
+        self.builds = 0
+        self.failures = 0
+
+    def record(self, timings_ms: Dict[str, float]):
+        self.builds += 1
+        for name, value in timings_ms.items():
+            self._timings_ms[name].append(value)
+
+    def stats(self) -> Dict[str, Any]:
+        stages = {}
+        for name, values in self._timings_ms.items():
+            stages[name] = {
+                "p50_ms": percentile(values, 0.5),
+                "p95_ms": percentile(values, 0.95),
+            }
+        return {"builds": self.builds, "failures": self.failures, "stages": stages}
+
+
+init_context_metrics = InitContextMetrics()
+
+
+async def build_init_context(
+    client_phone: str, history_service: Optional[HistoryService] = None
+) -> Dict[str, Any]:
+    """
+    Контекст первого сообщения диалога: профиль, заказы, системные переменные
+    и подходящие товары. От профиля, системных переменных и промпта подбора
+    зависит только text-to-SQL этап, остальное читается параллельно.
+    """
+    order_service = await OrderService()
+    history_service = history_service or await HistoryService()
+
+    async def profile():
+        profile_service = await ProfileService()
+        return await profile_service.get_profile(client_phone=client_phone)
+
+    async def orders():
+        return await order_service.get_all_orders_by_client_phone(client_phone=client_phone)
+
+    async def sys_variables():
+        return await order_service.get_sys_variables()
+
+    async def products_prompt():
+        instructions = await history_service.get_instructions(topic=INIT_PRODUCTS_TOPIC)
+        return instructions.get("prompt", "") if isinstance(instructions, dict) else ""
+
+    async def products(profile, sys_variables, products_prompt):
+        found: List[Dict[str, Any]] = await llm.get_result_from_db_by_ai(
+            user_request=products_prompt,
+            top_k_limit=10,
+            client=profile,
+            system_vars=sys_variables,
+            # Промпт один на всех клиентов - SQL переиспользуется по шаблону
+            use_template_cache=True,
+        )
+        if len(found) == 0:
+            found = await order_service.get_random_products(limit=10)
+        return found
+
+    graph = ContextGraph()
+    graph.add("profile", profile)
+    graph.add("orders", orders)
+    graph.add("sys_variables", sys_variables)
+    graph.add("products_prompt", products_prompt)
+    graph.add(
+        "products",
+        products,
+        depends_on=("profile", "sys_variables", "products_prompt"),
+    )
+
+    started = time.perf_counter()
+    try:
+        context, timings_ms = await graph.run()
+    except Exception:
+        init_context_metrics.failures += 1
+        raise
+    timings_ms["total"] = round((time.perf_counter() - started) * 1000, 1)
+    init_context_metrics.record(timings_ms)
+    print(f"Init context for {client_phone} built, timings ms: {timings_ms}")
+
+    context["timings_ms"] = timings_ms
+    return context
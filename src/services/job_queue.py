@@ -0,0 +1,539 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+from src.services.pg_listener import pg_listener
+from src.utils import percentile
+
+
+JOBS_CHANNEL = "myaso_jobs"
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+# Склеивает payload'ы нескольких задач одного диалога (в порядке поступления) в один
+JobCoalescer = Callable[[List[Dict[str, Any]]], Dict[str, Any]]
+
+# Задача, которую выполняет текущий обработчик (None вне очереди)
+_current_job: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_job", default=None)
+
+
+class JobFailed(Exception):
+    """Обработчик сообщает, что задачу нельзя повторять: она сразу помечается failed."""
+
+
+class JobQueue:
+    """
+    Очередь задач на Postgres (таблица myaso.jobs, см. add_job_queue.sql).
+
+    Задачи забираются через FOR UPDATE SKIP LOCKED, поэтому несколько воркеров
+    uvicorn делят одну очередь без двойной выдачи. Пока задача выполняется,
+    аренда (locked_until) продлевается; если процесс упал, аренда истекает
+    и задача выдаётся снова (at-least-once). При остановке новые задачи не
+    берутся, а незавершённые за drain_timeout возвращаются в очередь.
+
+    Задачи с conversation_key выполняются строго по одной на диалог во всех
+    процессах (уникальный индекс по running задачам) и в порядке постановки:
+    задача не выдаётся, пока в очереди есть более ранняя задача диалога. Для
+    видов задач с coalescer очередные задачи того же диалога забираются
+    вместе с текущей и склеиваются в одну.
+    """
+
+    def __init__(self):
+        queue_settings = settings.job_queue
+        self.worker_count = queue_settings.job_queue_workers
+        self.visibility_timeout_s = queue_settings.job_queue_visibility_timeout_s
+        self.poll_interval_s = queue_settings.job_queue_poll_interval_s
+        self.max_attempts = queue_settings.job_queue_max_attempts
+        self.retry_backoff_s = queue_settings.job_queue_retry_backoff_s
+        self.drain_timeout_s = queue_settings.job_queue_drain_timeout_s
+        self.retention_h = queue_settings.job_queue_retention_h
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._handlers: Dict[str, JobHandler] = {}
+        self._coalescers: Dict[str, JobCoalescer] = {}
+        self._workers: List[asyncio.Task] = []
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.merged = 0
+        self.claim_conflicts = 0
+        self._wait_ms = deque(maxlen=1000)
+        self._run_ms = deque(maxlen=1000)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.job_queue.job_queue_enabled
+
+    def in_job(self) -> bool:
+        """Вызван ли код из обработчика задачи очереди."""
+        return _current_job.get() is not None
+
+    def will_retry(self) -> bool:
+        """Будет ли задача выполнена снова, если обработчик сейчас упадёт."""
+        job = _current_job.get()
+        return job is not None and job["attempts"] < job["max_attempts"]
+
+    def register(
+        self, kind: str, handler: JobHandler, coalescer: Optional[JobCoalescer] = None
+    ):
+        self._handlers[kind] = handler
+        if coalescer is not None:
+            self._coalescers[kind] = coalescer
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        delay_s: float = 0.0,
+        conversation_key: Optional[str] = None,
+        max_delay_s: Optional[float] = None,
+    ) -> int:
+        """
+        Ставит задачу в очередь. Если задан conversation_key и delay_s, это
+        скользящее окно: ожидающие задачи того же вида и диалога сдвигаются на
+        delay_s от текущего момента, но не дальше max_delay_s от их создания.
+        """
+        async with registry.pg_connection() as conn:
+            async with conn.transaction():
+                job_id = await conn.fetchval(
+                    """
+                    INSERT INTO myaso.jobs
+                        (kind, payload, max_attempts, available_at, conversation_key)
+                    VALUES ($1, $2::jsonb, $3, NOW() + make_interval(secs => $4), $5)
+                    RETURNING id
+                    """,
+                    kind,
+                    json.dumps(payload, ensure_ascii=False),
+                    self.max_attempts,
+                    delay_s,
+                    conversation_key,
+                )
+                if conversation_key is not None and delay_s > 0:
+                    await conn.execute(
+                        """
+                        UPDATE myaso.jobs
+                        SET available_at = LEAST(
+                            created_at + make_interval(secs => $4),
+                            NOW() + make_interval(secs => $3)
+                        )
+                        WHERE conversation_key = $1 AND kind = $2
+                          AND status = 'queued' AND id <> $5
+                        """,
+                        conversation_key,
+                        kind,
+                        delay_s,
+                        max_delay_s if max_delay_s is not None else delay_s,
+                        job_id,
+                    )
+            # Будим воркеры во всех процессах
+            await conn.execute("SELECT pg_notify($1, $2)", JOBS_CHANNEL, str(job_id))
+        self._wakeup.set()
+        return job_id
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        try:
+            async with registry.pg_connection() as conn:
+                row = await conn.fetchrow(
+                    """
+                    UPDATE myaso.jobs AS j
+                    SET status = 'running',
+                        attempts = j.attempts + 1,
+                        locked_until = NOW() + make_interval(secs => $1),
+                        locked_by = $2,
+                        started_at = NOW()
+                    WHERE j.id = (
+                        SELECT c.id FROM myaso.jobs AS c
+                        WHERE ((c.status = 'queued' AND c.available_at <= NOW())
+                            OR (c.status = 'running' AND c.locked_until < NOW()))
+                          AND (c.conversation_key IS NULL OR NOT EXISTS (
+                              SELECT 1 FROM myaso.jobs AS r
+                              WHERE r.conversation_key = c.conversation_key
+                                AND r.status = 'running'
+                                AND r.id <> c.id
+                          ))
+                          -- Задачи диалога строго по порядку: более ранняя задача,
+                          -- отложенная debounce или паузой повтора, не обгоняется
+                          AND (c.conversation_key IS NULL OR NOT EXISTS (
+                              SELECT 1 FROM myaso.jobs AS q
+                              WHERE q.conversation_key = c.conversation_key
+                                AND q.status = 'queued'
+                                AND q.id < c.id
+                          ))
+                        ORDER BY c.id
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING j.id, j.kind, j.payload, j.attempts, j.max_attempts,
+                        j.conversation_key,
+                        EXTRACT(EPOCH FROM (NOW() - j.created_at)) * 1000 AS wait_ms
+                    """,
+                    self.visibility_timeout_s,
+                    self.worker_id,
+                )
+        except asyncpg.UniqueViolationError:
+            # Другой воркер одновременно взял задачу того же диалога
+            self.claim_conflicts += 1
+            return None
+        return dict(row) if row else None
+
+    async def _start_exclusive(
+        self, kind: str, payload: Dict[str, Any], conversation_key: str
+    ) -> Optional[Dict[str, Any]]:
+        """Ставит задачу сразу выполняющейся, если у диалога нет других задач."""
+        try:
+            async with registry.pg_connection() as conn:
+                row = await conn.fetchrow(
+                    """
+                    INSERT INTO myaso.jobs
+                        (kind, payload, status, attempts, max_attempts,
+                         locked_until, locked_by, started_at, conversation_key)
+                    SELECT $1, $2::jsonb, 'running', 1, 1,
+                        NOW() + make_interval(secs => $3), $4, NOW(), $5
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM myaso.jobs
+                        WHERE conversation_key = $5 AND status IN ('queued', 'running')
+                    )
+                    RETURNING id, kind, attempts, max_attempts
+                    """,
+                    kind,
+                    json.dumps(payload, ensure_ascii=False),
+                    self.visibility_timeout_s,
+                    self.worker_id,
+                    conversation_key,
+                )
+        except asyncpg.UniqueViolationError:
+            # Другой воркер одновременно взял задачу того же диалога
+            self.claim_conflicts += 1
+            return None
+        return dict(row) if row else None
+
+    @asynccontextmanager
+    async def exclusive(
+        self, kind: str, payload: Dict[str, Any], conversation_key: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ход диалога, который выполняется здесь же, а не воркером очереди
+        (например, потоковый ответ /ai/stream), но не одновременно с задачами
+        того же conversation_key: ждёт, пока у диалога не останется задач в
+        очереди и выполняющихся, и записывается выполняющейся задачей.
+
+        Аренда продлевается, пока ход идёт. Повтора нет (max_attempts = 1):
+        если процесс упал, после истечения аренды задача помечается failed.
+        """
+        started = time.perf_counter()
+        job = await self._start_exclusive(kind, payload, conversation_key)
+        while job is None:
+            await asyncio.sleep(self.poll_interval_s)
+            job = await self._start_exclusive(kind, payload, conversation_key)
+
+        self._wait_ms.append((time.perf_counter() - started) * 1000)
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        started = time.perf_counter()
+        try:
+            yield job
+        except BaseException as e:
+            await self._finish(job, error=str(e) or type(e).__name__, retry=False)
+            raise
+        else:
+            self.processed += 1
+            await self._finish(job)
+        finally:
+            heartbeat.cancel()
+            self._run_ms.append((time.perf_counter() - started) * 1000)
+
+    async def _coalesce(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Забирает ожидающие задачи того же диалога и склеивает их с текущей."""
+        payload = json.loads(job["payload"])
+        coalescer = self._coalescers.get(job["kind"])
+        if coalescer is None or job["conversation_key"] is None:
+            return payload
+
+        async with registry.pg_connection() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                    UPDATE myaso.jobs
+                    SET status = 'merged', finished_at = NOW(),
+                        last_error = 'merged into job ' || $3::text
+                    WHERE id IN (
+                        SELECT id FROM myaso.jobs
+                        WHERE conversation_key = $1 AND kind = $2
+                          AND status = 'queued' AND id > $3
+                          -- Не перескакиваем через задачи другого вида (например, сброс диалога)
+                          AND id < COALESCE((
+                              SELECT MIN(o.id) FROM myaso.jobs AS o
+                              WHERE o.conversation_key = $1 AND o.kind <> $2
+                                AND o.status = 'queued' AND o.id > $3
+                          ), 9223372036854775807)
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, payload
+                    """,
+                    job["conversation_key"],
+                    job["kind"],
+                    job["id"],
+                )
+                if not rows:
+                    return payload
+
+                rows = sorted(rows, key=lambda row: row["id"])
+                payload = coalescer(
+                    [payload] + [json.loads(row["payload"]) for row in rows]
+                )
+                # Склеенный payload сохраняется, чтобы повтор задачи его не потерял
+                await conn.execute(
+                    "UPDATE myaso.jobs SET payload = $2::jsonb WHERE id = $1",
+                    job["id"],
+                    json.dumps(payload, ensure_ascii=False),
+                )
+
+        self.merged += len(rows)
+        print(f"JobQueue - merged {len(rows)} jobs into job {job['id']}")
+        return payload
+
+    async def _heartbeat(self, job_id: int):
+        interval = self.visibility_timeout_s / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with registry.pg_connection() as conn:
+                    await conn.execute(
+                        """
+                        UPDATE myaso.jobs
+                        SET locked_until = NOW() + make_interval(secs => $2)
+                        WHERE id = $1 AND locked_by = $3 AND status = 'running'
+                        """,
+                        job_id,
+                        self.visibility_timeout_s,
+                        self.worker_id,
+                    )
+            except Exception as e:
+                print(f"JobQueue - heartbeat for job {job_id} failed: {e}")
+
+    async def _finish(
+        self, job: Dict[str, Any], error: Optional[str] = None, retry: bool = True
+    ):
+        if error is None:
+            query = """
+            UPDATE myaso.jobs
+            SET status = 'done', finished_at = NOW(), locked_until = NULL
+            WHERE id = $1 AND locked_by = $2
+            """
+            args = (job["id"], self.worker_id)
+        elif retry and job["attempts"] < job["max_attempts"]:
+            self.retried += 1
+            query = """
+            UPDATE myaso.jobs
+            SET status = 'queued', last_error = $3, locked_until = NULL,
+                available_at = NOW() + make_interval(secs => $4)
+            WHERE id = $1 AND locked_by = $2
+            """
+            args = (
+                job["id"],
+                self.worker_id,
+                error,
+                self.retry_backoff_s * job["attempts"],
+            )
+        else:
+            self.failed += 1
+            query = """
+            UPDATE myaso.jobs
+            SET status = 'failed', last_error = $3, finished_at = NOW(), locked_until = NULL
+            WHERE id = $1 AND locked_by = $2
+            """
+            args = (job["id"], self.worker_id, error)
+
+        async with registry.pg_connection() as conn:
+            await conn.execute(query, *args)
+
+    async def _release(self, job_id: int):
+        """Возвращает незавершённую задачу в очередь без ожидания истечения аренды."""
+        async with registry.pg_connection() as conn:
+            await conn.execute(
+                """
+                UPDATE myaso.jobs
+                SET status = 'queued', locked_until = NULL, available_at = NOW(),
+                    attempts = GREATEST(attempts - 1, 0)
+                WHERE id = $1 AND locked_by = $2 AND status = 'running'
+                """,
+                job_id,
+                self.worker_id,
+            )
+
+    async def _execute(self, job: Dict[str, Any]):
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            await self._finish(job, error=f"No handler for job kind {job['kind']}")
+            return
+
+        if job["attempts"] > job["max_attempts"]:
+            # Аренда истекла слишком много раз (воркер падал на этой задаче)
+            await self._finish(job, error="Lease expired on every attempt")
+            return
+
+        self._wait_ms.append(float(job["wait_ms"]))
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        started = time.perf_counter()
+        token = _current_job.set(job)
+        try:
+            await handler(await self._coalesce(job))
+        except asyncio.CancelledError:
+            raise
+        except JobFailed as e:
+            print(f"JobQueue - job {job['id']} ({job['kind']}) failed without retry: {e}")
+            await self._finish(job, error=str(e), retry=False)
+        except Exception as e:
+            print(f"JobQueue - job {job['id']} ({job['kind']}) failed: {e}")
+            await self._finish(job, error=str(e))
+        else:
+            self.processed += 1
+            await self._finish(job)
+        finally:
+            _current_job.reset(token)
+            heartbeat.cancel()
+            self._run_ms.append((time.perf_counter() - started) * 1000)
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"JobQueue - claim failed: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._execute(job))
+            self._running[job["id"]] = task
+            try:
+                # shield: остановка воркера не прерывает задачу, её дожидается stop()
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    raise
+            finally:
+                if task.done():
+                    self._running.pop(job["id"], None)
+
+    async def _maintenance(self):
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                async with registry.pg_connection() as conn:
+                    await conn.execute(
+                        """
+                        DELETE FROM myaso.jobs
+                        WHERE status IN ('done', 'failed', 'merged')
+                          AND finished_at < NOW() - make_interval(hours => $1)
+                        """,
+                        int(self.retention_h),
+                    )
+            except Exception as e:
+                print(f"JobQueue - cleanup failed: {e}")
+
+    async def start(self):
+        if self._workers:
+            return
+
+        self._stopping = False
+        pg_listener.subscribe(JOBS_CHANNEL, lambda payload: self._wakeup.set())
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.worker_count)
+        ]
+        self._maintenance_task = asyncio.create_task(self._maintenance())
+        print(f"JobQueue started {self.worker_count} workers ({self.worker_id})")
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+
+        running = dict(self._running)
+        if running:
+            print(f"JobQueue - draining {len(running)} running jobs")
+            _, pending = await asyncio.wait(
+                running.values(), timeout=self.drain_timeout_s
+            )
+            for job_id, task in running.items():
+                if task in pending:
+                    task.cancel()
+                    try:
+                        await self._release(job_id)
+                    except Exception as e:
+                        print(f"JobQueue - release of job {job_id} failed: {e}")
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        self._running.clear()
+        print("JobQueue stopped")
+
+    async def stats(self) -> Dict[str, Any]:
+        depth: Dict[str, Any] = {}
+        try:
+            async with registry.pg_connection() as conn:
+                rows = await conn.fetch(
+                    """
+                    SELECT status, COUNT(*) AS count,
+                        EXTRACT(EPOCH FROM (NOW() - MIN(created_at))) AS oldest_s
+                    FROM myaso.jobs
+                    WHERE status IN ('queued', 'running')
+                    GROUP BY status
+                    """
+                )
+            depth = {
+                row["status"]: {
+                    "count": row["count"],
+                    "oldest_s": round(float(row["oldest_s"]), 1),
+                }
+                for row in rows
+            }
+        except Exception as e:
+            depth = {"error": str(e)}
+
+        wait_ms = list(self._wait_ms)
+        run_ms = list(self._run_ms)
+        return {
+            "enabled": self.enabled,
+            "workers": len(self._workers),
+            "running_here": len(self._running),
+            "depth": depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "merged": self.merged,
+            "claim_conflicts": self.claim_conflicts,
+            "wait_ms_p50": percentile(wait_ms, 0.5, ndigits=1),
+            "wait_ms_p95": percentile(wait_ms, 0.95, ndigits=1),
+            "run_ms_p50": percentile(run_ms, 0.5, ndigits=1),
+            "run_ms_p95": percentile(run_ms, 0.95, ndigits=1),
+        }
+
+
+job_queue = JobQueue()
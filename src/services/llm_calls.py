@@ -0,0 +1,63 @@
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple, Type
+
+from mirascope.core import BaseMessageParam, BaseTool, openai
+from openai import AsyncOpenAI
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class CallWrapperCache:
+    """
+    Обёртки @openai.call, собранные один раз на процесс.
+
+    Ключ - модель, набор инструментов, call_params, режим stream и сам
+    клиент: если клиент подменили (как в benchmarks/llm_concurrency.py),
+    для него строится новая обёртка.
+    """
+
+    def __init__(self):
+        self._wrappers: Dict[Tuple[Hashable, ...], Callable] = {}
+        self.built = 0
+        self.hits = 0
+
+    def get(
+        self,
+        model: str,
+        client: AsyncOpenAI,
+        tools: Sequence[Type[BaseTool]] = (),
+        call_params: Optional[Dict[str, Any]] = None,
+        stream: bool = False,
+    ) -> Callable:
+        call_params = call_params or {}
+        key = (model, client, tuple(tools), _freeze(call_params), stream)
+
+        wrapper = self._wrappers.get(key)
+        if wrapper is not None:
+            self.hits += 1
+            return wrapper
+
+        @openai.call(
+            model=model,
+            client=client,
+            tools=list(tools) or None,
+            call_params=dict(call_params),
+            stream=stream,
+        )
+        async def _call(messages: list[BaseMessageParam]):
+            return messages
+
+        self._wrappers[key] = _call
+        self.built += 1
+        return _call
+
+    def stats(self) -> Dict[str, Any]:
+        return {"wrappers": len(self._wrappers), "built": self.built, "hits": self.hits}
+
+
+llm_calls = CallWrapperCache()
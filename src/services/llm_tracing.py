@@ -0,0 +1,172 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+from src.config.settings import settings
+
+
+def _message_dump(message: Any) -> Any:
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude_none=True)
+    return message
+
+
+def _timestamp(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+class LLMTracer:
+    """
+    Трейсы вызовов модели в Langfuse вне пути запроса.
+
+    record() только кладёт ссылки на сообщения и ответ в ограниченную
+    очередь; сериализация и отправка выполняются фоновой задачей пачками
+    в отдельном потоке. При переполнении очереди трейс отбрасывается.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._langfuse = None
+        self.recorded = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.exported = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.langfuse.langfuse_enabled
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=settings.langfuse.langfuse_queue_size)
+        return self._queue
+
+    def record(
+        self,
+        name: str,
+        model: str,
+        messages: Sequence[Any],
+        started_at: float,
+        response: Any = None,
+        error: Optional[BaseException] = None,
+        session_id: Optional[str] = None,
+    ):
+        if not self.enabled:
+            return
+        if random.random() >= settings.langfuse.langfuse_sample_rate:
+            self.sampled_out += 1
+            return
+
+        trace = {
+            "name": name,
+            "model": model,
+            # Список сообщений дополняется после вызова - сохраняем его срез
+            "messages": list(messages),
+            "response": response,
+            "error": error,
+            "session_id": session_id,
+            "started_at": started_at,
+            "ended_at": time.time(),
+        }
+        try:
+            self._get_queue().put_nowait(trace)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        self.recorded += 1
+
+    def _get_langfuse(self):
+        if self._langfuse is None:
+            from langfuse import Langfuse
+
+            langfuse_settings = settings.langfuse
+            self._langfuse = Langfuse(
+                public_key=langfuse_settings.langfuse_public_key,
+                secret_key=langfuse_settings.langfuse_secret_key,
+                host=langfuse_settings.langfuse_host,
+            )
+        return self._langfuse
+
+    def _export(self, batch: List[Dict[str, Any]]):
+        langfuse = self._get_langfuse()
+        for trace in batch:
+            response = trace["response"]
+            error = trace["error"]
+            messages = [_message_dump(message) for message in trace["messages"]]
+            output = None
+            usage = None
+            if response is not None:
+                output = _message_dump(response.message_param)
+                usage = {
+                    "input": response.input_tokens,
+                    "output": response.output_tokens,
+                }
+
+            trace_client = langfuse.trace(
+                name=trace["name"],
+                session_id=trace["session_id"],
+                input=messages,
+                output=output,
+            )
+            trace_client.generation(
+                name=trace["name"],
+                model=trace["model"],
+                input=messages,
+                output=output,
+                usage=usage,
+                start_time=_timestamp(trace["started_at"]),
+                end_time=_timestamp(trace["ended_at"]),
+                level="ERROR" if error is not None else "DEFAULT",
+                status_message=str(error) if error is not None else None,
+            )
+        langfuse.flush()
+
+    async def _flush(self):
+        queue = self._get_queue()
+        batch_size = settings.langfuse.langfuse_batch_size
+        while not queue.empty():
+            batch = []
+            while len(batch) < batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._export, batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"LLMTracer export failed, {len(batch)} traces lost: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(settings.langfuse.langfuse_flush_interval_s)
+            await self._flush()
+
+    def start(self):
+        if self.enabled and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и отправляет то, что осталось в очереди."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self._queue is not None:
+            await self._flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "recorded": self.recorded,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "exported": self.exported,
+            "failed": self.failed,
+        }
+
+
+llm_tracer = LLMTracer()
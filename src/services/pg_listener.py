@@ -0,0 +1,105 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+from src.config.settings import settings
+
+
+class PgListener:
+    """
+    LISTEN/NOTIFY на отдельном соединении (не из пула: LISTEN привязан к сессии).
+
+    Подписчики регистрируются через subscribe(channel, callback). После
+    переподключения вызываются on_reconnect колбэки: уведомления, пришедшие
+    пока соединения не было, потеряны, и кэши должны считать себя устаревшими.
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[str, List[Callable[[str], Any]]] = defaultdict(list)
+        self._reconnect_callbacks: List[Callable[[], Any]] = []
+        self._connection: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lost = asyncio.Event()
+        self.notifications = 0
+        self.reconnects = 0
+
+    def subscribe(self, channel: str, callback: Callable[[str], Any]):
+        self._callbacks[channel].append(callback)
+
+    def on_reconnect(self, callback: Callable[[], Any]):
+        self._reconnect_callbacks.append(callback)
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None and not self._connection.is_closed()
+
+    def _dispatch(self, connection, pid, channel: str, payload: str):
+        self.notifications += 1
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"PgListener - callback for {channel} failed: {e}")
+
+    def _on_connection_lost(self, connection):
+        self._lost.set()
+
+    async def _connect(self):
+        connection = await asyncpg.connect(dsn=settings.postgres.postgres_dsn)
+        connection.add_termination_listener(self._on_connection_lost)
+        for channel in self._callbacks:
+            await connection.add_listener(channel, self._dispatch)
+        self._connection = connection
+        self._lost.clear()
+
+    async def _run(self):
+        delay = 1.0
+        first = True
+        while True:
+            try:
+                await self._connect()
+                if not first:
+                    self.reconnects += 1
+                    for callback in self._reconnect_callbacks:
+                        callback()
+                first = False
+                delay = 1.0
+                print(f"PgListener listening on {list(self._callbacks)}")
+                await self._lost.wait()
+                print("PgListener - connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"PgListener - connect failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                if self._connection is not None and not self._connection.is_closed():
+                    await self._connection.close()
+                self._connection = None
+
+    async def start(self):
+        if self._task is None and self._callbacks:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "channels": list(self._callbacks),
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "reconnects": self.reconnects,
+        }
+
+
+pg_listener = PgListener()
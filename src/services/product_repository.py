@@ -0,0 +1,146 @@
+import json
+from typing import Any, Dict, List, Sequence, Tuple
+
+from src.services.client_registry import registry
+from src.utils import records_to_json
+
+
+# Колонки, которые никогда не нужны в ответах: вектор занимает несколько КБ на строку
+VECTOR_COLUMNS = ("embedding", "embedding_hash")
+
+# Явные проекции myaso.products под конкретные сценарии
+PRODUCT_PROJECTIONS: Dict[str, Sequence[str]] = {
+    # Всё, что показывается модели и клиенту
+    "display": (
+        "id",
+        "title",
+        "from_region",
+        "photo",
+        "pricelist_date",
+        "supplier_name",
+        "package_weight",
+        "prepayment_1t",
+        "order_price_kg",
+        "min_order_weight_kg",
+        "discount",
+        "ready_made",
+        "package_type",
+        "cooled_or_frozen",
+        "product_in_package",
+    ),
+    # Поиск фотографии товара для ShowProductPhotos
+    "photo": ("id", "title", "supplier_name", "photo"),
+}
+
+# Результаты семантического поиска для ответа на запрос клиента: те же поля,
+# что модель видела до проекций (всё, кроме векторов), то есть display
+PRODUCT_PROJECTIONS["search"] = PRODUCT_PROJECTIONS["display"]
+
+
+def projection_columns(projection: str, alias: str = "") -> str:
+    prefix = f"{alias}." if alias else ""
+    try:
+        return ", ".join(f"{prefix}{column}" for column in PRODUCT_PROJECTIONS[projection])
+    except KeyError:
+        raise ValueError(f"Unknown product projection: {projection}")
+
+
+def exclude_vector_columns(sql: str) -> str:
+    """
+    Оборачивает сгенерированный моделью запрос так, чтобы векторные колонки
+    не уходили по сети, даже если модель написала SELECT *.
+    Порядок строк внутреннего запроса сохраняется, так как внешний запрос
+    только проецирует строки подзапроса.
+    """
+    sql = sql.strip().rstrip(";").strip()
+    removed = " ".join(f"- '{column}'" for column in VECTOR_COLUMNS)
+    # Перевод строки перед скобкой защищает от комментария "--" в конце запроса
+    return f"SELECT to_jsonb(q) {removed} AS row FROM (\n{sql}\n) AS q"
+
+
+def unwrap_rows(records) -> List[Dict[str, Any]]:
+    """Разбирает строки запроса, обёрнутого exclude_vector_columns."""
+    return [json.loads(record["row"]) for record in records]
+
+
+class ProductRepository:
+    """Чтение товаров из myaso.products с явной проекцией колонок."""
+
+    async def get_all(self, projection: str = "display") -> List[Dict[str, Any]]:
+        async with registry.pg_connection() as conn:
+            result = await conn.fetch(
+                f"SELECT {projection_columns(projection)} FROM myaso.products ORDER BY id"
+            )
+        return records_to_json(result)
+
+    async def get_by_ids(
+        self, product_ids: List[int], projection: str = "display"
+    ) -> List[Dict[str, Any]]:
+        """Товары по id в том же порядке, что и product_ids."""
+        if not product_ids:
+            return []
+
+        async with registry.pg_connection() as conn:
+            result = await conn.fetch(
+                f"SELECT {projection_columns(projection)} FROM myaso.products WHERE id = ANY($1::bigint[])",
+                product_ids,
+            )
+        products_by_id = {product["id"]: product for product in records_to_json(result)}
+        return [
+            products_by_id[product_id]
+            for product_id in product_ids
+            if product_id in products_by_id
+        ]
+
+    async def get_by_title_supplier(
+        self, pairs: List[Tuple[str, str]], projection: str = "photo"
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Один запрос на все пары (title, supplier_name); при дублях берётся первая строка."""
+        if not pairs:
+            return {}
+
+        async with registry.pg_connection() as conn:
+            result = await conn.fetch(
+                f"""
+                SELECT DISTINCT ON (p.title, p.supplier_name) {projection_columns(projection, alias="p")}
+                FROM myaso.products AS p
+                JOIN unnest($1::text[], $2::text[]) AS q(title, supplier_name)
+                    ON p.title = q.title AND p.supplier_name = q.supplier_name
+                ORDER BY p.title, p.supplier_name, p.id
+                """,
+                [pair[0] for pair in pairs],
+                [pair[1] for pair in pairs],
+            )
+        return {
+            (product["title"], product["supplier_name"]): product
+            for product in records_to_json(result)
+        }
+
+    async def get_nearest(
+        self, query_vector: List[float], limit: int = 10, projection: str = "search"
+    ) -> List[Dict[str, Any]]:
+        async with registry.pg_connection() as conn:
+            result = await conn.fetch(
+                f"""
+                SELECT {projection_columns(projection)}
+                FROM myaso.products
+                ORDER BY embedding <-> $1::text::vector
+                LIMIT $2
+                """,
+                str(query_vector),
+                limit,
+            )
+        return records_to_json(result)
+
+    async def get_random(
+        self, limit: int = 10, projection: str = "display"
+    ) -> List[Dict[str, Any]]:
+        async with registry.pg_connection() as conn:
+            result = await conn.fetch(
+                f"SELECT {projection_columns(projection)} FROM myaso.products ORDER BY RANDOM() LIMIT $1",
+                limit,
+            )
+        return records_to_json(result)
+
+
+product_repository = ProductRepository()
@@ -1,15 +1,14 @@
 import asyncio
-from src.config.settings import settings
-from supabase import acreate_client, AClient, AsyncClientOptions
+from supabase import AClient
 from src.schemas import Profile
 from typing import Optional
 from src.utils import AsyncMixin
+from src.services.client_registry import registry
 
 
 class ProfileService(AsyncMixin):
-    async def __ainit__(self):
-        self.supabase: AClient = await acreate_client(
-            settings.supabase.supabase_url, settings.supabase.supabase_service_key, options=AsyncClientOptions(schema='myaso'))
+    async def __ainit__(self, supabase: Optional[AClient] = None):
+        self.supabase: AClient = supabase or await registry.get_supabase()
 
     async def add_profile(self, form_data: Profile):
         result = await self.supabase.table('clients').insert(form_data.model_dump()).execute()
@@ -0,0 +1,135 @@
+import json
+import re
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Sequence
+
+import asyncpg
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+from src.services.product_repository import exclude_vector_columns
+from src.utils import percentile
+
+
+# Запрос модели выполняется в read-only транзакции, это лишь ранний и понятный отказ
+FORBIDDEN_STATEMENT = re.compile(
+    r"\b(insert|update|delete|merge|drop|alter|truncate|create|grant|revoke|copy)\b",
+    re.IGNORECASE,
+)
+SQL_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+class QueryRejected(Exception):
+    """Запрос модели остановлен губернатором; reason уходит модели в SQLError."""
+
+    def __init__(self, reason: str, kind: str):
+        self.reason = reason
+        self.kind = kind
+        super().__init__(reason)
+
+
+class QueryGovernor:
+    """
+    Выполнение SQL, сгенерированного моделью, с ограничениями:
+    read-only транзакция, statement_timeout, потолок строк и байт при чтении
+    курсором и (опционально) потолок стоимости плана по EXPLAIN.
+    """
+
+    def __init__(self):
+        self._durations_ms = deque(maxlen=1000)
+        self.executed = 0
+        self.rejected: Counter = Counter()
+
+    def check_statement(self, sql: str):
+        # Ключевые слова ищутся вне комментариев и строковых литералов
+        code = SQL_STRING_LITERAL.sub("''", SQL_COMMENT.sub(" ", sql))
+        match = FORBIDDEN_STATEMENT.search(code)
+        if match:
+            self._reject(
+                f"Only read-only SELECT queries are allowed, found {match.group(1).upper()}",
+                "statement",
+            )
+
+    def _reject(self, reason: str, kind: str):
+        self.rejected[kind] += 1
+        raise QueryRejected(reason, kind)
+
+    async def _check_cost(self, conn, sql: str, params: Sequence[Any]):
+        max_cost = settings.query_governor.query_governor_max_cost
+        if max_cost <= 0:
+            return
+
+        plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *params)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        cost = plan[0]["Plan"]["Total Cost"]
+        if cost > max_cost:
+            self._reject(
+                f"Estimated plan cost {cost:.0f} exceeds the limit of {max_cost:.0f}. "
+                "Avoid cross joins and full scans of large tables, filter and LIMIT earlier",
+                "cost",
+            )
+
+    async def run(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        governor_settings = settings.query_governor
+        max_rows = governor_settings.query_governor_max_rows
+        max_bytes = governor_settings.query_governor_max_bytes
+        timeout_ms = governor_settings.query_governor_statement_timeout_ms
+
+        self.check_statement(sql)
+        wrapped = exclude_vector_columns(sql)
+        started = time.perf_counter()
+
+        rows: List[Dict[str, Any]] = []
+        size = 0
+        async with registry.pg_connection() as conn:
+            try:
+                async with conn.transaction(readonly=True):
+                    await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+                    await self._check_cost(conn, wrapped, params)
+
+                    async for record in conn.cursor(
+                        wrapped,
+                        *params,
+                        prefetch=governor_settings.query_governor_fetch_batch,
+                    ):
+                        size += len(record["row"].encode("utf-8"))
+                        if len(rows) >= max_rows:
+                            self._reject(
+                                f"Query returned more than {max_rows} rows. "
+                                "Add a LIMIT or aggregate the result",
+                                "rows",
+                            )
+                        if size > max_bytes:
+                            self._reject(
+                                f"Query result exceeds {max_bytes} bytes. "
+                                "Select fewer columns or fewer rows",
+                                "bytes",
+                            )
+                        rows.append(json.loads(record["row"]))
+            except asyncpg.exceptions.QueryCanceledError:
+                self._reject(
+                    f"Query exceeded the statement timeout of {timeout_ms} ms. "
+                    "Simplify it: avoid cross joins, filter and LIMIT earlier",
+                    "timeout",
+                )
+            except asyncpg.exceptions.ReadOnlySQLTransactionError as e:
+                self._reject(f"Only read-only queries are allowed: {e}", "statement")
+
+        self.executed += 1
+        self._durations_ms.append((time.perf_counter() - started) * 1000)
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        durations = list(self._durations_ms)
+        return {
+            "executed": self.executed,
+            "rejected": dict(self.rejected),
+            "duration_ms_p50": percentile(durations, 0.5),
+            "duration_ms_p95": percentile(durations, 0.95),
+        }
+
+
+query_governor = QueryGovernor()
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+
+
+# Строковый литерал SQL: '...' с экранированием ''
+SQL_STRING_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+
+# Короткие значения ("ИП", "1") выносятся в параметр только при точном совпадении
+# литерала: внутри другого литерала они совпадают слишком легко
+MIN_TEMPLATED_VALUE_LENGTH = 3
+
+BOOLEAN_LITERAL = re.compile(r"\b(true|false)\b", re.IGNORECASE)
+
+
+class SqlTemplate:
+    """Проверенный параметризованный запрос: $n::text - значения атрибутов клиента params[n-1]."""
+
+    def __init__(self, sql: str, params: List[str]):
+        self.sql = sql
+        self.params = params
+
+    def bind(self, client: Dict[str, Any]) -> List[str]:
+        return [str(client[attribute]) for attribute in self.params]
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def client_shape(client: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Какие атрибуты клиента заполнены и какого они типа - от этого зависит SQL модели."""
+    return sorted(
+        (attribute, type(value).__name__)
+        for attribute, value in client.items()
+        if value is not None and value != ""
+    )
+
+
+def template_key(
+    prompt: str,
+    schema_version: str,
+    client: Dict[str, Any],
+    top_k_limit: Optional[int],
+    system_vars: Any,
+) -> str:
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "schema_version": schema_version,
+            "client_shape": client_shape(client),
+            "top_k_limit": top_k_limit,
+            # Системные переменные модель вписывает в SQL как константы
+            "system_vars": system_vars,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def templatize(
+    sql: str, client: Dict[str, Any], top_k_limit: Optional[int] = None
+) -> Optional[SqlTemplate]:
+    """
+    Заменяет строковые литералы со значениями атрибутов клиента на параметры.
+    Возвращает None, если запрос нельзя безопасно переиспользовать для другого
+    клиента: любое непустое значение клиента (строка любой длины, число,
+    булево) осталось в тексте запроса.
+    """
+    values = sorted(
+        (
+            (attribute, value)
+            for attribute, value in client.items()
+            if isinstance(value, str) and value != ""
+        ),
+        key=lambda item: len(item[1]),
+        reverse=True,
+    )
+    params: List[str] = []
+
+    def parameter(attribute: str) -> str:
+        if attribute not in params:
+            params.append(attribute)
+        return f"${params.index(attribute) + 1}::text"
+
+    def replace_literal(match: re.Match) -> str:
+        literal = match.group(1).replace("''", "'")
+        for attribute, value in values:
+            if literal == value:
+                return parameter(attribute)
+        for attribute, value in values:
+            # Шаблоны вида ILIKE '%Москва%'; короткие значения внутри литерала не выделяем
+            if len(value) >= MIN_TEMPLATED_VALUE_LENGTH and value in literal:
+                prefix, _, suffix = literal.partition(value)
+                parts = [_quote(prefix)] if prefix else []
+                parts.append(parameter(attribute))
+                if suffix:
+                    parts.append(_quote(suffix))
+                return "(" + " || ".join(parts) + ")"
+        return match.group(0)
+
+    template_sql = SQL_STRING_LITERAL.sub(replace_literal, sql)
+
+    # Значение клиента вне параметров (комментарий, идентификатор, часть литерала) - не кэшируем
+    lowered = template_sql.lower()
+    literals = [
+        literal.replace("''", "'").lower()
+        for literal in SQL_STRING_LITERAL.findall(template_sql)
+    ]
+    for _, value in values:
+        value = value.lower()
+        if len(value) >= MIN_TEMPLATED_VALUE_LENGTH:
+            if value in lowered:
+                return None
+        elif any(value in literal for literal in literals):
+            return None
+
+    # Булевы атрибуты модель пишет как true/false - их не отличить от прочих условий
+    has_bool = any(isinstance(value, bool) for value in client.values())
+    if has_bool and BOOLEAN_LITERAL.search(template_sql):
+        return None
+
+    # Числовые атрибуты модель пишет числами - их не отличить от прочих констант
+    numbers = set(re.findall(r"\b\d+(?:\.\d+)?\b", template_sql))
+    for value in client.values():
+        if (
+            isinstance(value, (int, float))
+            and not isinstance(value, bool)
+            and value != top_k_limit
+            and str(value) in numbers
+        ):
+            return None
+
+    return SqlTemplate(template_sql, params)
+
+
+class SqlTemplateCache:
+    """
+    Кэш SQL, сгенерированного моделью для одного и того же промпта.
+
+    Ключ - текст промпта, версия схемы, форма атрибутов клиента, top_k и
+    системные переменные. Значения атрибутов клиента вынесены в параметры,
+    поэтому следующий клиент с той же формой атрибутов получает результат
+    без вызова модели. Шаблоны хранятся в myaso.sql_templates (см.
+    add_sql_templates.sql) и в LRU воркера.
+    """
+
+    def __init__(self):
+        self._templates: "OrderedDict[str, SqlTemplate]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.uncacheable = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.sql_template_cache.sql_template_cache_enabled
+
+    def _remember(self, key: str, template: SqlTemplate):
+        self._templates[key] = template
+        self._templates.move_to_end(key)
+        while len(self._templates) > settings.sql_template_cache.sql_template_cache_max_size:
+            self._templates.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[SqlTemplate]:
+        template = self._templates.get(key)
+        if template is None:
+            async with registry.pg_connection() as conn:
+                row = await conn.fetchrow(
+                    "SELECT sql, params FROM myaso.sql_templates WHERE cache_key = $1",
+                    key,
+                )
+            if row is not None:
+                template = SqlTemplate(row["sql"], json.loads(row["params"]))
+                self._remember(key, template)
+
+        if template is None:
+            self.misses += 1
+            return None
+
+        self._templates.move_to_end(key)
+        self.hits += 1
+        return template
+
+    async def store(self, key: str, template: SqlTemplate, schema_version: str):
+        self._remember(key, template)
+        async with registry.pg_connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO myaso.sql_templates (cache_key, sql, params, schema_version)
+                VALUES ($1, $2, $3::jsonb, $4)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET sql = EXCLUDED.sql, params = EXCLUDED.params, created_at = now()
+                """,
+                key,
+                template.sql,
+                json.dumps(template.params),
+                schema_version,
+            )
+        self.stored += 1
+
+    async def invalidate(self, key: str):
+        self._templates.pop(key, None)
+        self.invalidations += 1
+        async with registry.pg_connection() as conn:
+            await conn.execute("DELETE FROM myaso.sql_templates WHERE cache_key = $1", key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stored": self.stored,
+            "uncacheable": self.uncacheable,
+            "invalidations": self.invalidations,
+        }
+
+
+sql_template_cache = SqlTemplateCache()
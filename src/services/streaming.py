@@ -0,0 +1,192 @@
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.config.settings import settings
+from src.utils import percentile, remove_markdown_symbols
+
+
+FENCE = "```"
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"[.!?…](?:[\"»)]*)\s+")
+
+
+class TextChunker:
+    """
+    Режет поток токенов на готовые к отправке куски: по абзацам, а если абзац
+    затянулся - по концу предложения. Блоки кода (```...```) вырезаются, как
+    и в ask(), поэтому незакрытый блок придерживается до закрывающей тройки.
+    """
+
+    def __init__(self, min_chars: int, max_chars: int):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def _cut_position(self) -> Optional[int]:
+        text = self._buffer
+
+        # Внутри блока кода резать нельзя, за незакрытым блоком - тоже
+        fences = [match.start() for match in re.finditer(FENCE, text)]
+        blocks = list(zip(fences[::2], fences[1::2]))
+        limit = fences[-1] if len(fences) % 2 == 1 else len(text)
+
+        def allowed(position: int) -> bool:
+            return position <= limit and not any(
+                start < position <= end for start, end in blocks
+            )
+
+        for match in PARAGRAPH_BREAK.finditer(text, 0, min(limit, self.max_chars)):
+            if match.start() >= self.min_chars and allowed(match.end()):
+                return match.end()
+
+        if limit >= self.max_chars:
+            sentence_ends = [
+                match.end()
+                for match in SENTENCE_END.finditer(text, 0, self.max_chars)
+                if match.end() >= self.min_chars and allowed(match.end())
+            ]
+            if sentence_ends:
+                return sentence_ends[-1]
+            space = text.rfind(" ", self.min_chars, self.max_chars)
+            if space != -1 and allowed(space + 1):
+                return space + 1
+            if allowed(self.max_chars):
+                return self.max_chars
+        return None
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        chunks = []
+        while True:
+            position = self._cut_position()
+            if position is None:
+                break
+            chunk, self._buffer = self._buffer[:position], self._buffer[position:]
+            chunks.append(chunk)
+        return [text for text in map(self._clean, chunks) if text]
+
+    def flush(self) -> List[str]:
+        text, self._buffer = self._clean(self._buffer), ""
+        return [text] if text else []
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
+        # Незакрытый блок в конце ответа тоже не отправляется
+        if FENCE in text:
+            text = text[: text.index(FENCE)]
+        return remove_markdown_symbols(text.strip())
+
+
+class StreamingMetrics:
+    """Время до первого сообщения клиенту и до первого токена модели."""
+
+    def __init__(self):
+        self._first_message_ms = deque(maxlen=1000)
+        self._first_token_ms = deque(maxlen=1000)
+        self.turns = 0
+        self.streamed_turns = 0
+        self.chunks_sent = 0
+        self.chunks_failed = 0
+
+    def record_first_message(self, started_at: float, streamed: bool):
+        self.turns += 1
+        if streamed:
+            self.streamed_turns += 1
+        self._first_message_ms.append((time.perf_counter() - started_at) * 1000)
+
+    def record_first_token(self, started_at: float):
+        self._first_token_ms.append((time.perf_counter() - started_at) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        first_message = list(self._first_message_ms)
+        first_token = list(self._first_token_ms)
+        return {
+            "enabled": settings.streaming.streaming_enabled,
+            "turns": self.turns,
+            "streamed_turns": self.streamed_turns,
+            "chunks_sent": self.chunks_sent,
+            "chunks_failed": self.chunks_failed,
+            "time_to_first_message_ms_p50": percentile(first_message, 0.5),
+            "time_to_first_message_ms_p95": percentile(first_message, 0.95),
+            "time_to_first_token_ms_p50": percentile(first_token, 0.5),
+            "time_to_first_token_ms_p95": percentile(first_token, 0.95),
+        }
+
+
+streaming_metrics = StreamingMetrics()
+
+
+class ChunkedDelivery:
+    """
+    Отправляет готовые куски ответа, пока модель продолжает генерацию.
+
+    feed() вызывается на каждый фрагмент текста модели и не ждёт отправки:
+    куски уходят по очереди из отдельной задачи, порядок сохраняется.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[Any]], started_at: float):
+        streaming_settings = settings.streaming
+        self._send = send
+        self._started_at = started_at
+        self._chunker = TextChunker(
+            streaming_settings.stream_chunk_min_chars,
+            streaming_settings.stream_chunk_max_chars,
+        )
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._sender: Optional[asyncio.Task] = None
+        self._first_token_seen = False
+        self.sent = 0
+        # Куски, не ушедшие клиенту: первый неудачный и все после него
+        self.unsent: List[str] = []
+
+    async def feed(self, delta: str):
+        if not self._first_token_seen:
+            self._first_token_seen = True
+            streaming_metrics.record_first_token(self._started_at)
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_loop())
+        for chunk in self._chunker.feed(delta):
+            self._queue.put_nowait(chunk)
+
+    async def _send_loop(self):
+        while True:
+            chunk = await self._queue.get()
+            if chunk is None:
+                return
+            if self.unsent:
+                # После неудачной отправки остальные куски копятся, чтобы не нарушить порядок
+                self.unsent.append(chunk)
+                continue
+            try:
+                await self._send(chunk)
+            except Exception as e:
+                streaming_metrics.chunks_failed += 1
+                print(f"ERROR sending streamed chunk: {e}")
+                self.unsent.append(chunk)
+                continue
+            if self.sent == 0:
+                streaming_metrics.record_first_message(self._started_at, streamed=True)
+            self.sent += 1
+            streaming_metrics.chunks_sent += 1
+
+    async def close(self) -> List[str]:
+        """
+        Отправляет остаток текста и ждёт отправки всех кусков. Возвращает
+        куски, которые не удалось отправить, - их нужно доставить иначе.
+        """
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_loop())
+        for chunk in self._chunker.flush():
+            self._queue.put_nowait(chunk)
+        self._queue.put_nowait(None)
+        await self._sender
+        return list(self.unsent)
+
+    async def abort(self):
+        if self._sender is not None and not self._sender.done():
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
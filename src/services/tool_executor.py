@@ -0,0 +1,98 @@
+import asyncio
+import inspect
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, List, Sequence
+
+from src.config.settings import settings
+from src.utils import percentile
+
+
+class ToolOutcome:
+    """Результат одного вызова инструмента: то, что уходит модели и в историю."""
+
+    def __init__(self, tool: Any, result: str, status: str, duration_ms: float):
+        self.tool = tool
+        self.result = result
+        self.status = status
+        self.duration_ms = duration_ms
+
+    @property
+    def name(self) -> str:
+        return self.tool.__class__.__name__
+
+    def call_info(self) -> Dict[str, Any]:
+        return {"name": self.name, "arguments": self.tool.model_dump()}
+
+
+class ToolExecutor:
+    """
+    Выполняет все вызовы инструментов из ответа модели одновременно.
+
+    Асинхронные инструменты выполняются в event loop, синхронные - в пуле
+    потоков (asyncio.to_thread), чтобы не блокировать другие диалоги. У каждого
+    вызова свой таймаут; таймаут или ошибка инструмента не роняют ход диалога,
+    а возвращаются модели текстом вместо результата.
+
+    Таймаут отменяет корутину инструмента, но не поток: синхронный инструмент
+    продолжит работать в пуле до конца, его результат просто будет отброшен.
+    """
+
+    def __init__(self):
+        self._durations_ms: Dict[str, deque] = defaultdict(lambda: deque(maxlen=500))
+        self.calls: Counter = Counter()
+        self.timeouts: Counter = Counter()
+        self.failures: Counter = Counter()
+
+    async def _invoke(self, tool: Any) -> Any:
+        if inspect.iscoroutinefunction(tool.call):
+            return await tool.call()
+        result = await asyncio.to_thread(tool.call)
+        # Синхронная обёртка могла вернуть корутину
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _run_one(self, tool: Any) -> ToolOutcome:
+        name = tool.__class__.__name__
+        timeout_s = settings.tool_execution.timeout_for(name)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._invoke(tool), timeout=timeout_s)
+            result, status = str(result), "ok"
+        except asyncio.TimeoutError:
+            self.timeouts[name] += 1
+            result, status = f"Tool {name} timed out after {timeout_s:g} s", "timeout"
+            # Инструмент с побочными эффектами сообщает, что успел сделать,
+            # чтобы модель не повторила вызов целиком
+            partial_result = getattr(tool, "partial_result", None)
+            if partial_result is not None:
+                result += f". {partial_result()}"
+        except Exception as e:
+            self.failures[name] += 1
+            result, status = f"Tool {name} failed: {e}", "error"
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        self.calls[name] += 1
+        self._durations_ms[name].append(duration_ms)
+        print(f"Tool {name} finished ({status}) in {duration_ms:.0f} ms with result: {result}")
+        return ToolOutcome(tool, result, status, duration_ms)
+
+    async def run(self, tools: Sequence[Any]) -> List[ToolOutcome]:
+        """Результаты в порядке вызовов модели."""
+        return list(await asyncio.gather(*[self._run_one(tool) for tool in tools]))
+
+    def stats(self) -> Dict[str, Any]:
+        tools = {}
+        for name, values in self._durations_ms.items():
+            tools[name] = {
+                "calls": self.calls[name],
+                "timeouts": self.timeouts[name],
+                "failures": self.failures[name],
+                "duration_ms_p50": percentile(values, 0.5),
+                "duration_ms_p95": percentile(values, 0.95),
+            }
+        return {"tools": tools}
+
+
+tool_executor = ToolExecutor()
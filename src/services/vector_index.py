@@ -0,0 +1,300 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.config.settings import settings
+from src.services.client_registry import registry
+
+try:
+    # Опциональная зависимость: нужна только для backend "hnsw"
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+def parse_vector(text: str) -> np.ndarray:
+    # pgvector отдаёт вектор в текстовом виде "[0.1,0.2,...]"
+    return np.asarray(json.loads(text), dtype=np.float32)
+
+
+class ExactBackend:
+    """
+    Точный top-k по L2 расстоянию (как оператор <-> в pgvector).
+
+    ‖a - b‖² = ‖a‖² - 2a·b + ‖b‖², ‖b‖² у запроса общий, поэтому ранжируем по
+    ‖a‖² - 2a·b: нормы строк считаются заранее, на запрос - одно умножение
+    матрицы на вектор без промежуточной матрицы разностей.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._ids: List[int] = []
+        self._positions: Dict[int, int] = {}
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def upsert(self, ids: List[int], vectors: np.ndarray):
+        new_rows = []
+        for product_id, vector in zip(ids, vectors):
+            position = self._positions.get(product_id)
+            if position is not None:
+                self._matrix[position] = vector
+                self._norms[position] = np.dot(vector, vector)
+            else:
+                self._positions[product_id] = len(self._ids) + len(new_rows)
+                new_rows.append((product_id, vector))
+
+        if new_rows:
+            added = np.stack([vector for _, vector in new_rows]).astype(np.float32)
+            self._matrix = np.vstack([self._matrix, added])
+            self._norms = np.concatenate([self._norms, np.einsum("ij,ij->i", added, added)])
+            self._ids.extend(product_id for product_id, _ in new_rows)
+
+    def remove(self, ids: Iterable[int]):
+        for product_id in ids:
+            position = self._positions.pop(product_id, None)
+            if position is None:
+                continue
+            # Переносим последнюю строку на место удалённой
+            last = len(self._ids) - 1
+            if position != last:
+                last_id = self._ids[last]
+                self._matrix[position] = self._matrix[last]
+                self._norms[position] = self._norms[last]
+                self._ids[position] = last_id
+                self._positions[last_id] = position
+            self._ids.pop()
+            self._matrix = self._matrix[:last]
+            self._norms = self._norms[:last]
+
+    def search(self, vector: np.ndarray, k: int) -> List[int]:
+        if not self._ids:
+            return []
+
+        distances = self._norms - 2.0 * (self._matrix @ vector)
+        k = min(k, len(self._ids))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [self._ids[position] for position in top]
+
+
+class HnswBackend:
+    """Приближённый top-k по HNSW графу hnswlib для больших каталогов."""
+
+    def __init__(self, dim: int, capacity: int):
+        index_settings = settings.vector_index
+        self.dim = dim
+        self._labels = set()
+        self._index = hnswlib.Index(space="l2", dim=dim)
+        self._index.init_index(
+            max_elements=max(capacity, 1024),
+            ef_construction=index_settings.vector_index_hnsw_ef_construction,
+            M=index_settings.vector_index_hnsw_m,
+            allow_replace_deleted=True,
+        )
+        self._index.set_ef(index_settings.vector_index_hnsw_ef_search)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def upsert(self, ids: List[int], vectors: np.ndarray):
+        required = len(self._labels | set(ids))
+        if required > self._index.get_max_elements():
+            self._index.resize_index(required * 2)
+        # add_items для существующей метки обновляет её вектор
+        self._index.add_items(vectors, ids, replace_deleted=True)
+        self._labels.update(ids)
+
+    def remove(self, ids: Iterable[int]):
+        for product_id in ids:
+            if product_id in self._labels:
+                self._index.mark_deleted(product_id)
+                self._labels.discard(product_id)
+
+    def search(self, vector: np.ndarray, k: int) -> List[int]:
+        if not self._labels:
+            return []
+
+        labels, _ = self._index.knn_query(vector, k=min(k, len(self._labels)))
+        return [int(label) for label in labels[0]]
+
+
+class ProductVectorIndex:
+    """
+    Индекс эмбеддингов товаров в памяти воркера.
+
+    Строится из колонки embedding при старте приложения и обновляется
+    инкрементально: периодически сравниваются embedding_hash товаров, и
+    загружаются только изменившиеся векторы. Задание переэмбеддинга каталога
+    обновляет индекс своего процесса сразу после записи.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._hashes: Dict[int, Optional[str]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._update_lock = asyncio.Lock()
+        self.built_at: Optional[float] = None
+        self.refreshed_at: Optional[float] = None
+        self.searches = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._backend is not None
+
+    def _make_backend(self, dim: int, size: int):
+        backend = settings.vector_index.vector_index_backend
+        use_hnsw = backend == "hnsw" or (
+            backend == "auto" and size >= settings.vector_index.vector_index_hnsw_min_size
+        )
+        if use_hnsw and hnswlib is None:
+            print("ProductVectorIndex - hnswlib is not installed, using exact backend")
+            use_hnsw = False
+
+        return HnswBackend(dim, capacity=size * 2) if use_hnsw else ExactBackend(dim)
+
+    async def _load_vectors(
+        self, ids: Optional[List[int]] = None
+    ) -> Tuple[List[int], np.ndarray, Dict[int, Optional[str]]]:
+        query = """
+        SELECT id, embedding::text AS embedding, embedding_hash
+        FROM myaso.products
+        WHERE embedding IS NOT NULL
+        """
+        async with registry.pg_connection() as conn:
+            if ids is None:
+                rows = await conn.fetch(query)
+            else:
+                rows = await conn.fetch(query + " AND id = ANY($1::bigint[])", ids)
+
+        if not rows:
+            return [], np.empty((0, 0), dtype=np.float32), {}
+
+        # Разбор тысяч векторов не должен блокировать event loop
+        vectors = await asyncio.to_thread(
+            lambda: np.stack([parse_vector(row["embedding"]) for row in rows])
+        )
+        return (
+            [row["id"] for row in rows],
+            vectors,
+            {row["id"]: row["embedding_hash"] for row in rows},
+        )
+
+    async def build(self):
+        started = time.perf_counter()
+        async with self._update_lock:
+            ids, vectors, hashes = await self._load_vectors()
+            if not ids:
+                print("ProductVectorIndex - no embeddings found, index disabled")
+                return
+
+            backend = self._make_backend(vectors.shape[1], len(ids))
+            await asyncio.to_thread(backend.upsert, ids, vectors)
+            self._backend = backend
+            self._hashes = hashes
+            self.built_at = self.refreshed_at = time.time()
+
+        print(
+            f"ProductVectorIndex built: {len(ids)} vectors, "
+            f"{type(self._backend).__name__}, {time.perf_counter() - started:.2f}s"
+        )
+
+    async def refresh(self):
+        """Подгружает только изменившиеся по embedding_hash векторы."""
+        if not self.ready:
+            await self.build()
+            return
+
+        async with registry.pg_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT id, embedding_hash FROM myaso.products WHERE embedding IS NOT NULL"
+            )
+        current = {row["id"]: row["embedding_hash"] for row in rows}
+
+        changed = [
+            product_id
+            for product_id, embedding_hash in current.items()
+            if product_id not in self._hashes or self._hashes[product_id] != embedding_hash
+        ]
+        removed = [product_id for product_id in self._hashes if product_id not in current]
+
+        async with self._update_lock:
+            if changed:
+                ids, vectors, hashes = await self._load_vectors(changed)
+                if ids:
+                    self._backend.upsert(ids, vectors)
+                    self._hashes.update(hashes)
+            if removed:
+                self._backend.remove(removed)
+                for product_id in removed:
+                    self._hashes.pop(product_id, None)
+            self.refreshed_at = time.time()
+
+        if changed or removed:
+            print(
+                f"ProductVectorIndex refreshed: {len(changed)} changed, {len(removed)} removed"
+            )
+
+    async def upsert(self, items: List[Tuple[int, List[float], Optional[str]]]):
+        if not self.ready or not items:
+            return
+
+        async with self._update_lock:
+            vectors = np.asarray([item[1] for item in items], dtype=np.float32)
+            self._backend.upsert([item[0] for item in items], vectors)
+            self._hashes.update({item[0]: item[2] for item in items})
+
+    def search(self, vector: List[float], k: int = 10) -> List[int]:
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape != (self._backend.dim,):
+            raise ValueError(
+                f"Query vector has shape {query.shape}, index dimension is "
+                f"{self._backend.dim}: embedding model and stored embeddings differ"
+            )
+        self.searches += 1
+        return self._backend.search(query, k)
+
+    async def _refresh_loop(self):
+        interval = settings.vector_index.vector_index_refresh_interval_s
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"ProductVectorIndex - refresh failed: {e}")
+
+    async def start(self):
+        try:
+            await self.build()
+        except Exception as e:
+            print(f"ProductVectorIndex - build failed, falling back to SQL search: {e}")
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.vector_index.vector_index_enabled,
+            "ready": self.ready,
+            "backend": type(self._backend).__name__ if self.ready else None,
+            "size": len(self._backend) if self.ready else 0,
+            "searches": self.searches,
+            "built_at": self.built_at,
+            "refreshed_at": self.refreshed_at,
+        }
+
+
+product_vector_index = ProductVectorIndex()
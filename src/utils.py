@@ -5,7 +5,7 @@ from mistune.plugins.formatting import strikethrough
 from mistune_telegram import TelegramHTMLRenderer
 import json
 
-from typing import Any, TypeVar
+from typing import Any, Optional, TypeVar
 
 T = TypeVar("T", bound="AsyncMixin")
 
@@ -73,12 +73,13 @@ def tansform_files_to_context(file_paths: List[str] = [], path_map={}):
     system_prompt += "В следующем сообщении будет запрос пользователя: "
     return system_prompt
 
-async def transorm_history_to_llm_format(history):
+def _legacy_history_rows_to_llm_format(rows):
+    # Строки до add_history_tool_columns.sql: вызовы инструментов разбираются из текста
     llm_history = []
     i = 0
     
-    while i < len(history.data):
-        record = history.data[i]
+    while i < len(rows):
+        record = rows[i]
         
         if record['role'] == 'tool':
             message_content = record['message']
@@ -124,8 +125,8 @@ async def transorm_history_to_llm_format(history):
                         llm_history.append(tool_call_entry)
                         
                         # Look for the corresponding tool response in the next record
-                        if i + 1 < len(history.data):
-                            next_record = history.data[i + 1]
+                        if i + 1 < len(rows):
+                            next_record = rows[i + 1]
                             if next_record['role'] == 'tool' and not next_record['message'].startswith("Tool call:"):
                                 # This is the tool response
                                 tool_response_content = next_record['message']
@@ -182,6 +183,73 @@ async def transorm_history_to_llm_format(history):
     
     return llm_history
 
+def history_rows_to_llm_format(rows):
+    """
+    Строки conversation_history -> сообщения для модели.
+    
+    Строки со структурными колонками (message_kind, tool_name, tool_call_id,
+    tool_args) проецируются напрямую; подряд идущие вызовы инструментов
+    становятся одним сообщением ассистента с несколькими tool_calls.
+    Строки без message_kind разбираются прежним текстовым парсером.
+    
+    Args:
+        rows: Строки истории в хронологическом порядке
+        
+    Returns:
+        Список сообщений в формате OpenAI chat
+    """
+    llm_history = []
+    legacy_rows = []
+    previous_kind = None
+    
+    for row in rows:
+        kind = row.get('message_kind')
+        if kind is None:
+            legacy_rows.append(row)
+            previous_kind = None
+            continue
+        
+        if legacy_rows:
+            llm_history.extend(_legacy_history_rows_to_llm_format(legacy_rows))
+            legacy_rows = []
+        
+        if kind == 'tool_call':
+            tool_call = {
+                'id': row['tool_call_id'],
+                'function': {
+                    'name': row['tool_name'],
+                    # The arguments field must be a string for the LLM API
+                    'arguments': json.dumps(row.get('tool_args') or {}, ensure_ascii=False),
+                },
+                'type': 'function',
+            }
+            if previous_kind == 'tool_call':
+                llm_history[-1]['tool_calls'].append(tool_call)
+            else:
+                llm_history.append({'role': 'assistant', 'tool_calls': [tool_call]})
+        elif kind == 'tool_result':
+            llm_history.append({
+                'role': 'tool',
+                'content': row['message'],
+                'tool_call_id': row.get('tool_call_id') or '',
+                'name': row.get('tool_name') or 'unknown_tool',
+            })
+        else:
+            llm_history.append({'role': row['role'], 'content': row['message']})
+        previous_kind = kind
+    
+    if legacy_rows:
+        llm_history.extend(_legacy_history_rows_to_llm_format(legacy_rows))
+    
+    return llm_history
+
+async def transorm_history_to_llm_format(history):
+    return history_rows_to_llm_format(history.data)
+
+def normalise_topic(topic: str) -> str:
+    # "Продать (опт)" -> "Продать": уточнения в скобках не входят в prompts.topic
+    return re.sub(r'\s*\([^)]*\)', '', topic).strip()
+
 def remove_markdown_symbols(text: str) -> str:
     """
     Удаляет markdown символы из текста, оставляя только чистый текст.
@@ -277,3 +345,106 @@ def records_to_json(records):
     
     return json_result
 
+
+def percentile(values, fraction: float, ndigits: Optional[int] = None) -> Optional[float]:
+    """
+    Перцентиль выборки задержек для /metrics (ближайший ранг, без интерполяции).
+
+    Args:
+        values: Значения (deque или список)
+        fraction: Доля, например 0.5 или 0.95
+        ndigits: До скольких знаков округлить, None - без округления
+
+    Returns:
+        Значение перцентиля или None для пустой выборки
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    value = ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+    return value if ndigits is None else round(value, ndigits)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенайзера модели.
+    
+    Для смеси кириллицы, латиницы и JSON выходит около 3 символов на токен;
+    оценка нужна только для бюджетов контекста, а не для биллинга.
+    
+    Args:
+        text: Текст сообщения
+        
+    Returns:
+        Примерное число токенов
+    """
+    if not text:
+        return 0
+    
+    return len(text) // 3 + 1
+
+def is_tool_call_row(row) -> bool:
+    if row.get('message_kind') is not None:
+        return row['message_kind'] == 'tool_call'
+    return row['role'] == 'tool' and row['message'].startswith("Tool call:")
+
+def is_tool_response_row(row) -> bool:
+    if row.get('message_kind') is not None:
+        return row['message_kind'] == 'tool_result'
+    return row['role'] == 'tool' and not row['message'].startswith("Tool call:")
+
+def history_row_tokens(row) -> int:
+    # +4 на служебную разметку сообщения (роль, разделители)
+    tokens = estimate_tokens(row['message']) + 4
+    if row.get('tool_args'):
+        tokens += estimate_tokens(json.dumps(row['tool_args'], ensure_ascii=False))
+    return tokens
+
+def group_history_units(rows):
+    """
+    Группирует строки conversation_history в неделимые куски: строки одного хода
+    (общий turn_id) и пару "вызов инструмента - ответ инструмента".
+    Окно истории и сводка режут историю только по границам этих кусков.
+    
+    Args:
+        rows: Строки истории в хронологическом порядке
+        
+    Returns:
+        Список кусков, каждый - список строк
+    """
+    units = []
+    for row in rows:
+        if units:
+            previous = units[-1][-1]
+            same_turn = row.get('turn_id') is not None and row.get('turn_id') == previous.get('turn_id')
+            answers_call = is_tool_response_row(row) and is_tool_call_row(previous)
+            if same_turn or answers_call:
+                units[-1].append(row)
+                continue
+        units.append([row])
+    
+    return units
+
+def fit_history_units(units, budget: int, used: int = 0):
+    """
+    Оставляет самые новые куски истории (см. group_history_units), которые
+    помещаются в бюджет токенов. Последний кусок остаётся даже сверх бюджета.
+    
+    Args:
+        units: Куски истории в хронологическом порядке
+        budget: Бюджет токенов окна
+        used: Токены, уже занятые сводкой и закреплёнными сообщениями
+        
+    Returns:
+        Оставленные куски в хронологическом порядке
+    """
+    kept = []
+    for unit in reversed(units):
+        cost = sum(history_row_tokens(row) for row in unit)
+        if kept and used + cost > budget:
+            break
+        kept.append(unit)
+        used += cost
+    kept.reverse()
+    
+    return kept
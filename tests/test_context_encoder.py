@@ -0,0 +1,47 @@
+from src.services.context_encoder import EMPTY_SECTION, ContextEncoder
+
+
+encoder = ContextEncoder()
+
+
+def test_columns_follow_whitelist_order_and_skip_empty_columns():
+    rows = [
+        {"supplier_name": "Мираторг", "title": "Вырезка", "discount": None, "id": 1},
+        {"supplier_name": "Агро", "title": "Фарш", "discount": ""},
+    ]
+
+    assert encoder.columns("products", rows) == ["title", "supplier_name"]
+
+
+def test_columns_fall_back_to_row_fields_when_whitelist_is_empty():
+    # Товары из SQL модели с алиасами: ни одного поля из белого списка
+    rows = [
+        {"id": 1, "product": "Вырезка", "price": 900, "embedding": "[0.1]"},
+        {"id": 2, "product": "Фарш", "price": 400, "note": None, "supplier": "Агро"},
+    ]
+
+    assert encoder.columns("products", rows) == ["product", "price", "supplier"]
+
+
+def test_columns_of_entity_without_whitelist():
+    rows = [{"created_at": "2024-01-01", "topic": "Продать", "empty": ""}]
+
+    assert encoder.columns("dialog", rows) == ["topic"]
+
+
+def test_encode_table_renders_fallback_columns():
+    rows = [
+        {"product": "Вырезка", "price": 900.0, "frozen": True},
+        {"product": "Фарш | охл.", "price": None, "frozen": False},
+    ]
+
+    assert encoder.encode_table("products", rows) == (
+        "product | price | frozen\n"
+        "Вырезка | 900 | да\n"
+        "Фарш / охл. |  | нет"
+    )
+
+
+def test_encode_table_without_data():
+    assert encoder.encode_table("orders", []) == EMPTY_SECTION
+    assert encoder.encode_table("orders", [{"title": None}]) == EMPTY_SECTION
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from src.config.settings import settings
+from src.schemas import UserMessageRequest
+from src.services.conversation_scheduler import (
+    ConversationScheduler,
+    merge_user_message_payloads,
+    merge_user_messages,
+)
+
+
+PHONE = "79990000001"
+
+
+def message(text, phone=PHONE, topic="Продать"):
+    return UserMessageRequest(client_phone=phone, topic=topic, message=text)
+
+
+@pytest.fixture
+def scheduler_settings(monkeypatch):
+    scheduler_settings = settings.conversation_scheduler
+    monkeypatch.setattr(scheduler_settings, "conversation_debounce_s", 0.05)
+    monkeypatch.setattr(scheduler_settings, "conversation_max_wait_s", 1.0)
+    return scheduler_settings
+
+
+def test_merge_user_messages_keeps_order_and_last_topic():
+    merged = merge_user_messages(
+        [message("Здравствуйте"), message("Есть вырезка?", topic="Купить")]
+    )
+
+    assert merged.message == "Здравствуйте\nЕсть вырезка?"
+    assert merged.topic == "Купить"
+    assert merge_user_message_payloads([message("Один").model_dump()]) == message(
+        "Один"
+    ).model_dump()
+
+
+def test_burst_is_merged_into_one_turn(scheduler_settings):
+    handled = []
+
+    async def handler(request):
+        handled.append(request.message)
+
+    async def scenario():
+        scheduler = ConversationScheduler()
+        for text in ("Привет", "Нужна говядина", "500 кг"):
+            scheduler.submit(message(text), handler)
+            await asyncio.sleep(0.01)
+        scheduler.submit(message("Другой клиент", phone="79990000002"), handler)
+        await asyncio.sleep(0.2)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert sorted(handled) == ["Другой клиент", "Привет\nНужна говядина\n500 кг"]
+    assert scheduler.stats() == {
+        "submitted": 4,
+        "turns": 2,
+        "pending_conversations": 0,
+        "running": 0,
+    }
+
+
+def test_max_wait_bounds_the_debounce_window(scheduler_settings, monkeypatch):
+    monkeypatch.setattr(scheduler_settings, "conversation_debounce_s", 0.2)
+    monkeypatch.setattr(scheduler_settings, "conversation_max_wait_s", 0.3)
+    handled = []
+
+    async def handler(request):
+        handled.append(request.message)
+
+    async def scenario():
+        scheduler = ConversationScheduler()
+        for text in "12345":
+            scheduler.submit(message(text), handler)
+            await asyncio.sleep(0.12)
+        await asyncio.sleep(0.4)
+
+    asyncio.run(scenario())
+
+    assert handled == ["1\n2\n3", "4\n5"]
+
+
+def test_turns_of_one_phone_do_not_overlap(scheduler_settings):
+    events = []
+
+    async def handler(request):
+        events.append(("start", request.message))
+        await asyncio.sleep(0.1)
+        events.append(("end", request.message))
+
+    async def scenario():
+        scheduler = ConversationScheduler()
+        scheduler.submit(message("первое"), handler)
+        await asyncio.sleep(0.08)
+        # Первый ход уже идёт: второе сообщение - отдельный ход после него
+        scheduler.submit(message("второе"), handler)
+        await asyncio.sleep(0.4)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert events == [
+        ("start", "первое"),
+        ("end", "первое"),
+        ("start", "второе"),
+        ("end", "второе"),
+    ]
+    assert scheduler._locks == {}
+
+
+def test_turn_runs_pending_batch_first(scheduler_settings, monkeypatch):
+    monkeypatch.setattr(scheduler_settings, "conversation_debounce_s", 10.0)
+    events = []
+
+    async def handler(request):
+        events.append(request.message)
+
+    async def scenario():
+        scheduler = ConversationScheduler()
+        scheduler.submit(message("из очереди"), handler)
+        scheduler.submit(message("ещё"), handler)
+        async with scheduler.turn(PHONE):
+            events.append("stream")
+        await asyncio.sleep(0)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert events == ["из очереди\nещё", "stream"]
+    assert scheduler.stats()["pending_conversations"] == 0
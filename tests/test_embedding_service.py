@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from src.services.embedding_service import EmbeddingService, normalise_query
+
+
+class FakeEmbedder:
+    """Подменяет create_embeddings: запросы к API ждут release."""
+
+    def __init__(self):
+        self.requests = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, texts):
+        self.requests.append(texts)
+        await self.release.wait()
+        return [[float(len(text))] for text in texts]
+
+
+def make_service(monkeypatch):
+    service = EmbeddingService(model_id="test-model")
+    embedder = FakeEmbedder()
+    monkeypatch.setattr(service, "create_embeddings", embedder)
+    return service, embedder
+
+
+def test_normalise_query():
+    assert normalise_query("  Говядина   ВЫРЕЗКА?! ") == "говядина вырезка"
+    assert normalise_query("Ёлка") == normalise_query("елка")
+
+
+def test_concurrent_lookups_share_one_request(monkeypatch):
+    async def scenario():
+        service, embedder = make_service(monkeypatch)
+        tasks = [
+            asyncio.create_task(service.embed(text))
+            for text in ("говядина вырезка", "Говядина  вырезка", "говядина вырезка.")
+        ]
+        await asyncio.sleep(0)
+        embedder.release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert embedder.requests == [["говядина вырезка"]]
+        assert results == [[16.0]] * 3
+        assert service.in_flight_waits == 2
+        assert service.memory_hits == 0
+
+        assert await service.embed("ГОВЯДИНА ВЫРЕЗКА") == [16.0]
+        assert service.memory_hits == 1
+        assert len(embedder.requests) == 1
+        assert service.stats()["hit_rate"] == 0.75
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_owner_does_not_cancel_waiters(monkeypatch):
+    async def scenario():
+        service, embedder = make_service(monkeypatch)
+        owner = asyncio.create_task(service.embed("фарш"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(service.embed("Фарш"))
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        await asyncio.sleep(0)
+        embedder.release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        assert await waiter == [4.0]
+        # Ожидающий сам повторил запрос за отменённого владельца
+        assert embedder.requests == [["фарш"], ["Фарш"]]
+
+    asyncio.run(scenario())
+
+
+def test_owner_error_is_raised_to_waiters(monkeypatch):
+    async def scenario():
+        service, embedder = make_service(monkeypatch)
+
+        async def failing(texts):
+            embedder.requests.append(texts)
+            await embedder.release.wait()
+            raise RuntimeError("rate limit")
+
+        monkeypatch.setattr(service, "create_embeddings", failing)
+        tasks = [asyncio.create_task(service.embed("фарш")) for _ in range(2)]
+        await asyncio.sleep(0)
+        embedder.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert [str(result) for result in results] == ["rate limit", "rate limit"]
+        assert len(embedder.requests) == 1
+        assert service._in_flight == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from src.config.settings import settings
+from src.services.history_cache import ConversationHistoryCache
+from src.services.history_service import HistoryService
+from src.services.history_summary import history_summarizer
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """Минимум PostgREST запроса, который использует HistoryService._load_window."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.desc = None
+        self.count = None
+
+    def select(self, *_):
+        return self
+
+    def eq(self, column, value):
+        self.rows = [row for row in self.rows if row[column] == value]
+        return self
+
+    def order(self, column, desc=False):
+        if self.desc is None:
+            self.desc = desc
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    async def execute(self):
+        rows = list(reversed(self.rows)) if self.desc else list(self.rows)
+        return FakeResponse(rows[: self.count] if self.count is not None else rows)
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, _):
+        return FakeQuery(self.rows)
+
+
+def make_turns(count):
+    turns = []
+    for turn in range(count):
+        size = 2 + turn % 3
+        turns.append([
+            {
+                "client_phone": "79990000001",
+                "role": "user" if index == 0 else "assistant",
+                "message": f"ход {turn} строка {index} " + "слово " * (turn % 4 * 5),
+                "turn_id": f"turn-{turn}",
+                "message_kind": "message",
+                "created_at": f"2024-01-01T00:{turn:02d}:00+00:00",
+                "seq": index,
+            }
+            for index in range(size)
+        ])
+    return turns
+
+
+@pytest.fixture
+def window_settings(monkeypatch):
+    async def no_summary(_):
+        return None
+
+    monkeypatch.setattr(history_summarizer, "get_summary", no_summary)
+    monkeypatch.setattr(history_summarizer, "schedule", lambda *args: None)
+    monkeypatch.setattr(settings.history_window, "history_pin_first_message", False)
+    monkeypatch.setattr(settings.history_window, "history_max_rows", 7)
+    return settings.history_window
+
+
+@pytest.mark.parametrize("budget", [40, 90, 10_000])
+def test_trim_matches_load_window(window_settings, monkeypatch, budget):
+    monkeypatch.setattr(window_settings, "history_max_tokens", budget)
+    turns = make_turns(12)
+    phone = turns[0][0]["client_phone"]
+
+    async def scenario():
+        cache = ConversationHistoryCache()
+        stored = list(turns[0])
+        service = await HistoryService(supabase=FakeSupabase(stored))
+        _, head, window, _ = await service._load_window(phone, None)
+        cache.load(phone, None, head=head, window=window, budget=budget, max_rows=7)
+
+        for turn in turns[1:]:
+            stored.extend(turn)
+            cache.append(phone, turn)
+            _, _, window, _ = await service._load_window(phone, None)
+
+            entry = cache._entries[phone]
+            assert [row for unit in entry.units for row in unit.rows] == window
+
+    asyncio.run(scenario())
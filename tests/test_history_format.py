@@ -0,0 +1,103 @@
+import json
+
+from src.utils import history_rows_to_llm_format
+
+
+def test_structured_rows_merge_consecutive_tool_calls():
+    rows = [
+        {"role": "user", "message": "Фото и цены", "message_kind": "message"},
+        {
+            "role": "tool",
+            "message": "Tool call: ShowProductPhotos",
+            "message_kind": "tool_call",
+            "tool_name": "ShowProductPhotos",
+            "tool_call_id": "call_1",
+            "tool_args": {"titles": ["Вырезка"]},
+        },
+        {
+            "role": "tool",
+            "message": "Tool call: GetPrices",
+            "message_kind": "tool_call",
+            "tool_name": "GetPrices",
+            "tool_call_id": "call_2",
+            "tool_args": None,
+        },
+        {
+            "role": "tool",
+            "message": "Фотографии отправлены",
+            "message_kind": "tool_result",
+            "tool_name": "ShowProductPhotos",
+            "tool_call_id": "call_1",
+        },
+        {"role": "tool", "message": "500 руб/кг", "message_kind": "tool_result"},
+        {"role": "assistant", "message": "Готово", "message_kind": "message"},
+    ]
+
+    messages = history_rows_to_llm_format(rows)
+
+    assert messages[0] == {"role": "user", "content": "Фото и цены"}
+    assert messages[1]["role"] == "assistant"
+    calls = messages[1]["tool_calls"]
+    assert [call["id"] for call in calls] == ["call_1", "call_2"]
+    assert json.loads(calls[0]["function"]["arguments"]) == {"titles": ["Вырезка"]}
+    assert calls[1]["function"]["arguments"] == "{}"
+    assert messages[2] == {
+        "role": "tool",
+        "content": "Фотографии отправлены",
+        "tool_call_id": "call_1",
+        "name": "ShowProductPhotos",
+    }
+    assert messages[3] == {
+        "role": "tool",
+        "content": "500 руб/кг",
+        "tool_call_id": "",
+        "name": "unknown_tool",
+    }
+    assert messages[4] == {"role": "assistant", "content": "Готово"}
+
+
+def test_legacy_rows_are_parsed_from_text():
+    args = {
+        "tool_call": {
+            "id": "call_9",
+            "function": {"arguments": '{"titles": ["Вырезка"]}'},
+        }
+    }
+    rows = [
+        {"role": "user", "message": "Покажите фото"},
+        {"role": "tool", "message": f"Tool call: ShowProductPhotos with args: {json.dumps(args)}"},
+        {"role": "tool", "message": "Tool Фотографии успешно отправлены."},
+        {"role": "assistant", "message": "Отправил"},
+    ]
+
+    messages = history_rows_to_llm_format(rows)
+
+    assert len(messages) == 4
+    call = messages[1]["tool_calls"][0]
+    assert call["id"] == "call_9"
+    assert call["function"] == {"name": "ShowProductPhotos", "arguments": '{"titles": ["Вырезка"]}'}
+    assert messages[2] == {
+        "role": "tool",
+        "content": "Фотографии успешно отправлены.",
+        "tool_call_id": "call_9",
+        "name": "ShowProductPhotos",
+    }
+    assert messages[3] == {"role": "assistant", "content": "Отправил"}
+
+
+def test_legacy_and_structured_rows_keep_order():
+    rows = [
+        {"role": "user", "message": "Старое"},
+        {"role": "assistant", "message": "Старый ответ"},
+        {"role": "user", "message": "Новое", "message_kind": "message"},
+        {"role": "assistant", "message": "Новый ответ", "message_kind": "message"},
+    ]
+
+    messages = history_rows_to_llm_format(rows)
+
+    assert [message["content"] for message in messages] == [
+        "Старое",
+        "Старый ответ",
+        "Новое",
+        "Новый ответ",
+    ]
@@ -0,0 +1,63 @@
+from src.utils import fit_history_units, group_history_units, history_row_tokens
+
+
+def row(role, message, turn_id=None, kind=None):
+    return {"role": role, "message": message, "turn_id": turn_id, "message_kind": kind}
+
+
+def test_group_history_units_keeps_turn_rows_together():
+    rows = [
+        row("user", "Здравствуйте", turn_id="a", kind="message"),
+        row("assistant", "Добрый день", turn_id="a", kind="message"),
+        row("user", "Есть говядина?", turn_id="b", kind="message"),
+        row("tool", "Tool call: SearchProducts", turn_id="b", kind="tool_call"),
+        row("tool", "[...]", turn_id="b", kind="tool_result"),
+        row("assistant", "Есть", turn_id="b", kind="message"),
+    ]
+
+    units = group_history_units(rows)
+
+    assert [len(unit) for unit in units] == [2, 4]
+    assert [r for unit in units for r in unit] == rows
+
+
+def test_group_history_units_pairs_legacy_tool_call_and_response():
+    rows = [
+        row("user", "Покажите фото"),
+        row("tool", 'Tool call: ShowProductPhotos with args: {"tool_call": {}}'),
+        row("tool", "Tool Фотографии успешно отправлены."),
+        row("assistant", "Отправил"),
+    ]
+
+    units = group_history_units(rows)
+
+    assert [len(unit) for unit in units] == [1, 2, 1]
+    assert units[1] == rows[1:3]
+
+
+def test_group_history_units_does_not_join_rows_without_turn_id():
+    rows = [row("user", "Привет"), row("assistant", "Привет")]
+
+    assert group_history_units(rows) == [[rows[0]], [rows[1]]]
+
+
+def test_fit_history_units_keeps_newest_units_within_budget():
+    units = [[row("user", "x" * 30)], [row("user", "y" * 30)], [row("user", "z" * 30)]]
+    cost = history_row_tokens(units[0][0])
+
+    kept = fit_history_units(units, budget=2 * cost)
+
+    assert kept == units[1:]
+
+
+def test_fit_history_units_counts_pinned_tokens():
+    units = [[row("user", "x" * 30)], [row("user", "y" * 30)]]
+    cost = history_row_tokens(units[0][0])
+
+    assert fit_history_units(units, budget=2 * cost, used=cost) == units[1:]
+
+
+def test_fit_history_units_keeps_last_unit_over_budget():
+    units = [[row("user", "x" * 300)], [row("user", "y" * 300)]]
+
+    assert fit_history_units(units, budget=1) == units[1:]
@@ -0,0 +1,78 @@
+from src.services.sql_template_cache import client_shape, template_key, templatize
+
+
+CLIENT = {
+    "phone": "79990000001",
+    "name": "Иван",
+    "city": "Москва",
+    "org_name": "ИП",
+    "is_it_friend": None,
+    "UTC": None,
+}
+
+
+def test_templatize_parameterises_client_literals():
+    sql = (
+        "SELECT p.title FROM myaso.products p "
+        "WHERE p.from_region ILIKE '%Москва%' AND p.supplier_name <> 'Иван' LIMIT 10"
+    )
+
+    template = templatize(sql, CLIENT, top_k_limit=10)
+
+    assert template is not None
+    assert "Москва" not in template.sql
+    assert "Иван" not in template.sql
+    assert template.bind(CLIENT) == ["Москва", "Иван"]
+    other = dict(CLIENT, city="Казань", name="Пётр")
+    assert template.bind(other) == ["Казань", "Пётр"]
+
+
+def test_templatize_parameterises_short_exact_literal():
+    template = templatize("SELECT 1 WHERE c.org_name = 'ИП'", CLIENT)
+
+    assert template is not None
+    assert "'ИП'" not in template.sql
+    assert template.params == ["org_name"]
+
+
+def test_templatize_rejects_short_value_inside_literal():
+    sql = "SELECT * FROM myaso.products WHERE title ILIKE '%ИП%'"
+
+    assert templatize(sql, CLIENT) is None
+
+
+def test_templatize_rejects_boolean_literal_for_boolean_client():
+    client = dict(CLIENT, is_it_friend=True)
+    sql = "SELECT * FROM myaso.clients c WHERE c.is_it_friend = true AND c.org_name = 'ИП'"
+
+    assert templatize(sql, client) is None
+
+
+def test_templatize_rejects_client_number_in_sql():
+    client = dict(CLIENT, UTC=5)
+
+    assert templatize("SELECT now() + interval '5 hours'", client) is None
+    assert templatize("SELECT * FROM myaso.products LIMIT 5", client, top_k_limit=5)
+
+
+def test_templatize_rejects_value_outside_literal():
+    sql = "SELECT * FROM myaso.products -- клиент из Москва\nLIMIT 10"
+
+    assert templatize(sql, CLIENT, top_k_limit=10) is None
+
+
+def test_template_key_depends_on_shape_not_values():
+    other = dict(CLIENT, city="Казань", name="Пётр")
+    key = template_key("prompt", "v1", CLIENT, 10, [])
+
+    assert key == template_key("prompt", "v1", other, 10, [])
+    assert key != template_key("prompt", "v1", dict(CLIENT, UTC=3), 10, [])
+    assert key != template_key("prompt", "v2", CLIENT, 10, [])
+    assert key != template_key("prompt", "v1", CLIENT, 5, [])
+
+
+def test_client_shape_skips_empty_values():
+    assert client_shape({"a": None, "b": "", "c": "x", "d": 1}) == [
+        ("c", "str"),
+        ("d", "int"),
+    ]
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import pytest
+
+from src.config.settings import settings
+from src.routers import ai
+from src.services.streaming import ChunkedDelivery, TextChunker
+
+
+def test_chunker_cuts_on_paragraphs():
+    chunker = TextChunker(min_chars=10, max_chars=100)
+
+    assert chunker.feed("Первый абзац текста.\n\nВтор") == ["Первый абзац текста."]
+    assert chunker.feed("ой абзац.") == []
+    assert chunker.flush() == ["Второй абзац."]
+
+
+def test_chunker_skips_paragraph_break_before_min_chars():
+    chunker = TextChunker(min_chars=10, max_chars=100)
+
+    assert chunker.feed("Да.\n\nКонечно, есть.\n\n") == ["Да.\n\nКонечно, есть."]
+
+
+def test_chunker_cuts_long_paragraph_on_sentences():
+    chunker = TextChunker(min_chars=10, max_chars=40)
+
+    chunks = chunker.feed(
+        "Первое предложение тут. Второе предложение. Третье длинное предложение без конца"
+    )
+
+    assert chunks == ["Первое предложение тут.", "Второе предложение."]
+    assert chunker.flush() == ["Третье длинное предложение без конца"]
+
+
+def test_chunker_drops_code_blocks_and_waits_for_closing_fence():
+    chunker = TextChunker(min_chars=3, max_chars=100)
+
+    assert chunker.feed("Текст до кода.\n\n```sql\nSELECT 1;\n\nSEL") == ["Текст до кода."]
+    assert chunker.feed("ECT 2;\n```\n\nПосле кода.\n\n") == ["После кода."]
+    assert chunker.flush() == []
+
+
+def test_chunker_does_not_send_unclosed_code_block():
+    chunker = TextChunker(min_chars=3, max_chars=100)
+
+    assert chunker.feed("Ответ.\n\n```\nкод") == ["Ответ."]
+    assert chunker.flush() == []
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(settings.streaming, "stream_chunk_min_chars", 5)
+    monkeypatch.setattr(settings.streaming, "stream_chunk_max_chars", 100)
+
+
+def test_delivery_keeps_chunks_after_failed_send(small_chunks):
+    calls = []
+
+    async def send(text):
+        calls.append(text)
+        if len(calls) == 2:
+            raise RuntimeError("gateway is down")
+
+    async def scenario():
+        delivery = ChunkedDelivery(send=send, started_at=time.perf_counter())
+        await delivery.feed("Первый абзац.\n\nВторой абзац.\n\nТретий ")
+        await delivery.feed("абзац.")
+        unsent = await delivery.close()
+        return delivery, unsent
+
+    delivery, unsent = asyncio.run(scenario())
+
+    assert calls == ["Первый абзац.", "Второй абзац."]
+    assert delivery.sent == 1
+    assert unsent == ["Второй абзац.", "Третий абзац."]
+
+
+def test_deliver_answer_resends_unsent_chunks_in_one_message(small_chunks, monkeypatch):
+    calls = []
+    messages = []
+
+    async def send(text):
+        calls.append(text)
+        if len(calls) > 1:
+            raise RuntimeError("gateway is down")
+
+    async def send_message(recipient, message):
+        messages.append((recipient, message))
+
+    monkeypatch.setattr(ai.gateway, "send_message", send_message)
+
+    async def scenario():
+        started_at = time.perf_counter()
+        delivery = ChunkedDelivery(send=send, started_at=started_at)
+        content = "Первый абзац.\n\nВторой абзац.\n\nТретий абзац."
+        await delivery.feed(content)
+        await ai.deliver_answer("79990000001", content, delivery, started_at)
+
+    asyncio.run(scenario())
+
+    assert calls[0] == "Первый абзац."
+    assert messages == [("79990000001", "Второй абзац.\n\nТретий абзац.")]
+
+
+def test_deliver_answer_sends_whole_answer_when_nothing_streamed(small_chunks, monkeypatch):
+    messages = []
+
+    async def send(text):
+        raise RuntimeError("gateway is down")
+
+    async def send_message(recipient, message):
+        messages.append(message)
+
+    monkeypatch.setattr(ai.gateway, "send_message", send_message)
+
+    async def scenario():
+        started_at = time.perf_counter()
+        delivery = ChunkedDelivery(send=send, started_at=started_at)
+        await delivery.feed("Первый абзац.\n\nВторой абзац.")
+        await ai.deliver_answer(
+            "79990000001", "Первый абзац.\n\nВторой абзац.", delivery, started_at
+        )
+
+    asyncio.run(scenario())
+
+    assert messages == ["Первый абзац.\n\nВторой абзац."]
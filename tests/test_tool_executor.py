@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from src.config.settings import settings
+from src.services.tool_executor import ToolExecutor
+
+
+class SlowTool:
+    def __init__(self, delay_s=1.0):
+        self.delay_s = delay_s
+
+    async def call(self):
+        await asyncio.sleep(self.delay_s)
+        return "готово"
+
+    def model_dump(self):
+        return {"delay_s": self.delay_s}
+
+
+class SendPhotos:
+    """Инструмент с побочными эффектами: сообщает, сколько успел отправить."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def call(self):
+        self.sent += 1
+        await asyncio.sleep(1.0)
+        self.sent += 1
+
+    def partial_result(self):
+        return f"Отправлено фото: {self.sent}"
+
+
+class SyncTool:
+    def call(self):
+        time.sleep(0.05)
+        return 42
+
+
+class BrokenTool:
+    async def call(self):
+        raise ValueError("нет такого товара")
+
+
+@pytest.fixture
+def short_timeouts(monkeypatch):
+    monkeypatch.setattr(settings.tool_execution, "tool_default_timeout_s", 5.0)
+    monkeypatch.setattr(
+        settings.tool_execution, "tool_timeouts_s", {"SlowTool": 0.05, "SendPhotos": 0.05}
+    )
+
+
+def test_timeout_is_returned_to_the_model(short_timeouts):
+    executor = ToolExecutor()
+
+    [outcome] = asyncio.run(executor.run([SlowTool()]))
+
+    assert outcome.status == "timeout"
+    assert outcome.result == "Tool SlowTool timed out after 0.05 s"
+    assert outcome.call_info() == {"name": "SlowTool", "arguments": {"delay_s": 1.0}}
+    assert executor.timeouts["SlowTool"] == 1
+
+
+def test_timeout_appends_partial_result(short_timeouts):
+    [outcome] = asyncio.run(ToolExecutor().run([SendPhotos()]))
+
+    assert outcome.status == "timeout"
+    assert outcome.result == "Tool SendPhotos timed out after 0.05 s. Отправлено фото: 1"
+
+
+def test_results_keep_call_order_and_do_not_fail_the_turn(short_timeouts):
+    executor = ToolExecutor()
+
+    outcomes = asyncio.run(executor.run([BrokenTool(), SyncTool(), SlowTool(delay_s=0)]))
+
+    assert [outcome.status for outcome in outcomes] == ["error", "ok", "ok"]
+    assert outcomes[0].result == "Tool BrokenTool failed: нет такого товара"
+    assert outcomes[1].result == "42"
+    assert outcomes[2].result == "готово"
+    assert executor.stats()["tools"]["SyncTool"]["calls"] == 1
+
+
+def test_tools_run_concurrently(short_timeouts, monkeypatch):
+    monkeypatch.setattr(settings.tool_execution, "tool_timeouts_s", {})
+    started = time.perf_counter()
+
+    outcomes = asyncio.run(ToolExecutor().run([SlowTool(0.2), SlowTool(0.2), SlowTool(0.2)]))
+
+    assert all(outcome.status == "ok" for outcome in outcomes)
+    assert time.perf_counter() - started < 0.5
@@ -0,0 +1,55 @@
+import numpy as np
+
+from src.services.vector_index import ExactBackend
+
+
+DIM = 16
+
+
+def brute_force(vectors, query, k):
+    ids = list(vectors)
+    distances = [float(np.linalg.norm(vectors[product_id] - query)) for product_id in ids]
+    return [ids[position] for position in np.argsort(distances)[:k]]
+
+
+def test_exact_search_matches_brute_force():
+    rng = np.random.default_rng(7)
+    ids = list(range(100, 400))
+    vectors = rng.normal(size=(len(ids), DIM)).astype(np.float32)
+    backend = ExactBackend(DIM)
+    backend.upsert(ids, vectors)
+
+    by_id = dict(zip(ids, vectors))
+    for query in rng.normal(size=(20, DIM)).astype(np.float32):
+        assert backend.search(query, 10) == brute_force(by_id, query, 10)
+
+
+def test_exact_search_after_updates_and_removals():
+    rng = np.random.default_rng(11)
+    ids = list(range(50))
+    vectors = rng.normal(size=(len(ids), DIM)).astype(np.float32)
+    backend = ExactBackend(DIM)
+    backend.upsert(ids, vectors)
+
+    updated_ids = [3, 49, 60]
+    updated = rng.normal(size=(len(updated_ids), DIM)).astype(np.float32)
+    backend.upsert(updated_ids, updated)
+    backend.remove([0, 49, 25, 999])
+
+    by_id = dict(zip(ids, vectors))
+    by_id.update(zip(updated_ids, updated))
+    for product_id in (0, 49, 25):
+        del by_id[product_id]
+
+    assert len(backend) == len(by_id)
+    for query in rng.normal(size=(10, DIM)).astype(np.float32):
+        assert backend.search(query, 5) == brute_force(by_id, query, 5)
+
+
+def test_exact_search_with_k_above_size():
+    backend = ExactBackend(2)
+    assert backend.search(np.zeros(2, dtype=np.float32), 3) == []
+
+    backend.upsert([1, 2], np.array([[0, 0], [3, 4]], dtype=np.float32))
+
+    assert backend.search(np.array([3, 3], dtype=np.float32), 5) == [2, 1]